@@ -1,22 +1,74 @@
 import uuid
-import asyncio
 import logging
-from fastapi import APIRouter, HTTPException, UploadFile, File, Form
-from fastapi.responses import JSONResponse
-from typing import Optional
-from app.models.schemas import ContractUpload, ContractTask, TaskStatus, ReviewSubmit
-from app.rag.db import save_task, get_task, update_task_status
+from fastapi import APIRouter, HTTPException, UploadFile, File, Form, Request, Query
+from fastapi.responses import JSONResponse, StreamingResponse, Response
+from fastapi.concurrency import run_in_threadpool
+from typing import Optional, Union
+from pydantic import ValidationError
+from app.models.schemas import (
+    ContractUpload, ContractTask, TaskStatus, ReviewSubmit, EvaluationPage, RiskLevel,
+    BatchItem, BatchManifest, BatchStatus, BatchItemPage
+)
+from app.config import get_config
+from app.rag.db import (
+    async_save_task, async_get_task, async_get_task_status, async_get_task_state, async_get_task_evaluations,
+    async_get_task_evaluation_results, async_count_task_risk_levels, async_update_task_status, async_requeue_task,
+    async_get_batch, async_get_batch_progress, async_get_batch_items, async_fail_pending_batch_tasks
+)
+from app.services.executor import get_review_executor, QueueFullError
+from app.services.events import TERMINAL_STATUSES, get_event_bus, publish_task_event, format_sse
+from app.services.result_cache import get_result_cache_config, make_result_key, reuse_review
+from app.services.batch import BatchBuilder, get_batch_config, start_batch_workers
+from app.worker import run_task
 
 logging.basicConfig(level=logging.INFO)
 logger = logging.getLogger(__name__)
 
 router = APIRouter(prefix="/api/contracts", tags=["contracts"])
 
-MAX_RETRIES = 3
-RETRY_DELAY = 2
+def uses_inline_dispatch() -> bool:
+    return get_config().get("task", {}).get("dispatch", "inline") == "inline"
+
+def ensure_review_capacity():
+    if uses_inline_dispatch() and not get_review_executor().has_capacity():
+        raise HTTPException(status_code=429, detail="审查队列已满，请稍后重试")
+
+async def schedule_review_task(task_id: str):
+    if not uses_inline_dispatch():
+        return
+    
+    try:
+        get_review_executor().submit(task_id, run_task, task_id)
+    except QueueFullError as e:
+        logger.warning(f"Task {task_id} rejected: {str(e)}")
+        await async_update_task_status(task_id, "failed", error=str(e))
+        raise HTTPException(status_code=429, detail="审查队列已满，请稍后重试")
+
+async def task_result_key(contract: ContractUpload) -> Optional[str]:
+    if not get_result_cache_config().get("enabled", True):
+        return None
+    return await run_in_threadpool(make_result_key, contract.original_text, contract.modified_text, contract.category)
+
+async def reuse_cached_review(result_key: str) -> Optional[TaskStatus]:
+    # An identical request reviewed before gets a new task holding a copy of that analysis.
+    task_id = str(uuid.uuid4())
+    status = await run_in_threadpool(reuse_review, task_id, result_key)
+    if status is None:
+        return None
+    
+    publish_task_event(task_id, "status", status=status)
+    return TaskStatus(task_id=task_id, status=status, message="已复用相同合同的审查结果")
 
 @router.post("/compare", response_model=TaskStatus)
-async def compare_contracts(contract: ContractUpload):
+async def compare_contracts(contract: ContractUpload, reuse: bool = Query(True)):
+    result_key = await task_result_key(contract)
+    if reuse and result_key:
+        reused = await reuse_cached_review(result_key)
+        if reused:
+            return reused
+    
+    ensure_review_capacity()
+    
     task_id = str(uuid.uuid4())
     
     task_data = {
@@ -29,13 +81,14 @@ async def compare_contracts(contract: ContractUpload):
         "evaluations": [],
         "human_reviews": [],
         "final_report": None,
-        "error": None
+        "error": None,
+        "result_key": result_key
     }
     
-    save_task(task_id, task_data)
+    await async_save_task(task_id, task_data)
     logger.info(f"Task {task_id} created")
     
-    asyncio.create_task(run_review_task_with_retry(task_id, contract))
+    await schedule_review_task(task_id)
     
     return TaskStatus(
         task_id=task_id,
@@ -43,54 +96,41 @@ async def compare_contracts(contract: ContractUpload):
         message="任务已创建，正在处理中"
     )
 
-async def run_review_task_with_retry(task_id: str, contract: ContractUpload, retry_count: int = 0):
-    from app.graph.workflow import run_contract_review
-    
-    try:
-        update_task_status(task_id, "in_progress")
-        logger.info(f"Task {task_id} started processing (attempt {retry_count + 1})")
-        
-        category = contract.category if contract.category else ""
-        
-        result = run_contract_review(
-            task_id=task_id,
-            original_text=contract.original_text,
-            modified_text=contract.modified_text,
-            category=category
-        )
-        
-        update_task_status(
-            task_id,
-            result["status"],
-            differences=result.get("differences", []),
-            evaluations=result.get("evaluations", []),
-            human_reviews=result.get("human_reviews", []),
-            final_report=result.get("final_report")
-        )
-        logger.info(f"Task {task_id} completed with status: {result['status']}")
-        
-    except Exception as e:
-        logger.error(f"Task {task_id} failed: {str(e)}")
-        
-        if retry_count < MAX_RETRIES - 1:
-            logger.info(f"Retrying task {task_id} in {RETRY_DELAY} seconds...")
-            await asyncio.sleep(RETRY_DELAY)
-            await run_review_task_with_retry(task_id, contract, retry_count + 1)
-        else:
-            logger.error(f"Task {task_id} failed after {MAX_RETRIES} attempts")
-            update_task_status(task_id, "failed", error=str(e))
+def task_etag(kind: str, version: int, *parts) -> str:
+    return '"' + "-".join(str(part) for part in (kind, version) + parts) + '"'
+
+def etag_matches(if_none_match: Optional[str], etag: str) -> bool:
+    if not if_none_match:
+        return False
+    candidates = [tag.strip() for tag in if_none_match.split(",")]
+    return "*" in candidates or any(tag.removeprefix("W/") == etag for tag in candidates)
+
+async def get_task_state_or_404(task_id: str) -> dict:
+    state = await async_get_task_state(task_id)
+    if state is None:
+        raise HTTPException(status_code=404, detail="Task not found")
+    return state
+
+def check_not_modified(request: Request, response: Response, etag: str) -> Optional[Response]:
+    # Polls whose task version has not moved are answered from the narrow state row alone.
+    headers = {"ETag": etag, "Cache-Control": "no-cache"}
+    if etag_matches(request.headers.get("if-none-match"), etag):
+        return Response(status_code=304, headers=headers)
+    response.headers.update(headers)
+    return None
 
 @router.get("/status/{task_id}", response_model=TaskStatus)
-async def get_task_status(task_id: str):
-    task = get_task(task_id)
+async def get_task_status(task_id: str, request: Request, response: Response):
+    state = await get_task_state_or_404(task_id)
     
-    if not task:
-        raise HTTPException(status_code=404, detail="Task not found")
+    not_modified = check_not_modified(request, response, task_etag("status", state["version"]))
+    if not_modified:
+        return not_modified
     
     return TaskStatus(
-        task_id=task["task_id"],
-        status=task["status"],
-        message=get_status_message(task["status"])
+        task_id=task_id,
+        status=state["status"],
+        message=get_status_message(state["status"])
     )
 
 def get_status_message(status: str) -> str:
@@ -99,43 +139,95 @@ def get_status_message(status: str) -> str:
         "in_progress": "正在分析合同...",
         "waiting_human": "需要法务人工确认",
         "completed": "审查完成",
-        "failed": "处理失败"
+        "failed": "处理失败",
+        "cancelled": "任务已取消"
     }
     return messages.get(status, "未知状态")
 
-@router.get("/result/{task_id}", response_model=ContractTask)
-async def get_task_result(task_id: str):
-    task = get_task(task_id)
+@router.get("/result/{task_id}", response_model=Union[ContractTask, EvaluationPage])
+async def get_task_result(
+    task_id: str,
+    request: Request,
+    response: Response,
+    cursor: Optional[int] = Query(None, ge=0),
+    limit: int = Query(100, ge=1, le=1000)
+):
+    state = await get_task_state_or_404(task_id)
+    
+    if cursor is not None:
+        not_modified = check_not_modified(request, response, task_etag("result", state["version"], cursor, limit))
+        if not_modified:
+            return not_modified
+        
+        # Incremental mode: only the evaluations stored after `cursor`, in the order they were
+        # decided. Pass the returned cursor back to fetch the next page.
+        entries = await async_get_task_evaluations(task_id, cursor, limit)
+        return EvaluationPage(
+            task_id=task_id,
+            status=state["status"],
+            evaluations=entries,
+            cursor=entries[-1]["seq"] if entries else cursor
+        )
+    
+    not_modified = check_not_modified(request, response, task_etag("result", state["version"]))
+    if not_modified:
+        return not_modified
+    
+    task = await async_get_task(task_id)
     
     if not task:
         raise HTTPException(status_code=404, detail="Task not found")
     
     return ContractTask(**task)
 
+@router.get("/evaluations/{task_id}")
+async def get_task_evaluations(task_id: str, risk_level: Optional[RiskLevel] = None):
+    if await async_get_task_status(task_id) is None:
+        raise HTTPException(status_code=404, detail="Task not found")
+    
+    return {
+        "task_id": task_id,
+        "risk_counts": await async_count_task_risk_levels(task_id),
+        "evaluations": await async_get_task_evaluation_results(task_id, risk_level.value if risk_level else None)
+    }
+
 @router.post("/retry/{task_id}")
 async def retry_task(task_id: str):
-    task = get_task(task_id)
+    status = await async_get_task_status(task_id)
     
-    if not task:
+    if status is None:
         raise HTTPException(status_code=404, detail="Task not found")
     
-    if task["status"] != "failed":
+    if status != "failed":
         raise HTTPException(status_code=400, detail="Only failed tasks can be retried")
     
-    contract = ContractUpload(
-        original_text=task["original_text"],
-        modified_text=task["modified_text"],
-        category=task.get("category")
-    )
+    ensure_review_capacity()
     
-    update_task_status(task_id, "pending")
-    asyncio.create_task(run_review_task_with_retry(task_id, contract))
+    await async_requeue_task(task_id, reset_attempts=True)
+    await schedule_review_task(task_id)
     
     return {"message": "Task retry initiated", "task_id": task_id}
 
+@router.post("/cancel/{task_id}")
+async def cancel_task(task_id: str):
+    status = await async_get_task_status(task_id)
+    
+    if status is None:
+        raise HTTPException(status_code=404, detail="Task not found")
+    
+    if status not in ("pending", "in_progress"):
+        raise HTTPException(status_code=400, detail="Only pending or running tasks can be cancelled")
+    
+    await async_update_task_status(task_id, "cancelled")
+    get_review_executor().cancel(task_id)
+    publish_task_event(task_id, "status", status="cancelled")
+    logger.info(f"Task {task_id} cancellation requested")
+    
+    return {"message": "Task cancellation requested", "task_id": task_id}
+
 @router.post("/review")
 async def submit_human_review(review: ReviewSubmit):
-    task = get_task(review.task_id)
+    task = await async_get_task(review.task_id)
     
     if not task:
         raise HTTPException(status_code=404, detail="Task not found")
@@ -152,31 +244,229 @@ async def submit_human_review(review: ReviewSubmit):
             "comment": r.comment
         })
     
-    update_task_status(review.task_id, "in_progress", human_reviews=reviews_list)
+    await async_update_task_status(review.task_id, "in_progress", human_reviews=reviews_list)
+    publish_task_event(review.task_id, "status", status="in_progress")
     logger.info(f"Human review submitted for task {review.task_id}")
     
-    from app.graph.workflow import run_contract_review
+    from app.graph.workflow import resume_contract_review
     
-    result = run_contract_review(
-        task_id=task["task_id"],
-        original_text=task["original_text"],
-        modified_text=task["modified_text"],
-        category=task.get("category") or ""
-    )
+    try:
+        result = await run_in_threadpool(resume_contract_review, task, reviews_list)
+    except Exception as e:
+        # Hand the task back to the reviewers instead of leaving it in_progress for good.
+        logger.error(f"Resuming task {review.task_id} failed: {str(e)}")
+        await async_update_task_status(
+            review.task_id, "waiting_human", human_reviews=task.get("human_reviews", []), error=str(e)
+        )
+        publish_task_event(review.task_id, "status", status="waiting_human", error=str(e))
+        raise HTTPException(status_code=500, detail=f"提交审查失败: {str(e)}")
     
-    update_task_status(
+    await async_update_task_status(
         review.task_id,
         result["status"],
-        final_report=result.get("final_report")
+        evaluations=result.get("evaluations", []),
+        human_reviews=result.get("human_reviews", []),
+        final_report=result.get("final_report"),
+        error=None
     )
+    publish_task_event(review.task_id, "status", status=result["status"])
     
     return {"message": "Review submitted successfully", "task_id": review.task_id}
 
+def parse_last_event_id(value: Optional[str]) -> Optional[int]:
+    try:
+        return int(value) if value else None
+    except ValueError:
+        return None
+
+def status_event(task_id: str, status: str) -> str:
+    return format_sse("status", {"task_id": task_id, "status": status, "message": get_status_message(status)})
+
+@router.get("/events/{task_id}")
+async def stream_task_events(task_id: str, request: Request):
+    bus = get_event_bus()
+    # Subscribe before reading the status so nothing published in between is lost.
+    subscription = bus.subscribe(task_id, parse_last_event_id(request.headers.get("last-event-id")))
+    
+    status = await async_get_task_status(task_id)
+    if status is None:
+        subscription.close()
+        raise HTTPException(status_code=404, detail="Task not found")
+    
+    poll_interval = get_config().get("events", {}).get("poll_interval", 5)
+    
+    async def event_stream():
+        current = status
+        try:
+            yield status_event(task_id, current)
+            while current not in TERMINAL_STATUSES:
+                event = await subscription.get(poll_interval)
+                if await request.is_disconnected():
+                    break
+                
+                if event is not None:
+                    if event["type"] == "status":
+                        current = event["data"].get("status", current)
+                    yield format_sse(event["type"], event["data"], event["id"])
+                    continue
+                
+                # Tasks run by the standalone worker publish on another process's bus; fall back
+                # to the database so their clients still see status changes.
+                latest = await async_get_task_status(task_id)
+                if latest is not None and latest != current:
+                    current = latest
+                    yield status_event(task_id, current)
+                else:
+                    yield ": keepalive\n\n"
+        finally:
+            subscription.close()
+    
+    return StreamingResponse(
+        event_stream(),
+        media_type="text/event-stream",
+        headers={"Cache-Control": "no-cache", "X-Accel-Buffering": "no"}
+    )
+
+NDJSON_CONTENT_TYPES = ("application/x-ndjson", "application/jsonl")
+
+async def ndjson_lines(request: Request):
+    # Lines of a streamed body; a contract can be megabytes, so partial lines are kept as parts
+    # and joined once instead of re-scanning a growing buffer.
+    parts = []
+    async for data in request.stream():
+        *lines, tail = data.split(b"\n")
+        for line in lines:
+            parts.append(line)
+            yield b"".join(parts)
+            parts = []
+        if tail:
+            parts.append(tail)
+    if parts:
+        yield b"".join(parts)
+
+async def read_ndjson_items(request: Request, chunk_size: int):
+    # Yields validated pairs in lists of chunk_size; one bad line rejects the batch.
+    chunk = []
+    line_number = 0
+    async for line in ndjson_lines(request):
+        line_number += 1
+        if not line.strip():
+            continue
+        try:
+            chunk.append(BatchItem.model_validate_json(line))
+        except ValidationError as e:
+            raise HTTPException(status_code=400, detail=f"第 {line_number} 行格式错误: {e.errors()[0]['msg']}")
+        if len(chunk) >= chunk_size:
+            yield chunk
+            chunk = []
+    if chunk:
+        yield chunk
+
+def batch_status(batch: dict, progress: dict) -> BatchStatus:
+    counts = progress["counts"]
+    active = counts.get("pending", 0) + counts.get("in_progress", 0)
+    if not active:
+        status = "completed"
+    elif counts.get("pending", 0) == batch["total"]:
+        status = "pending"
+    else:
+        status = "in_progress"
+    
+    return BatchStatus(
+        batch_id=batch["batch_id"],
+        status=status,
+        total=batch["total"],
+        counts=counts,
+        risk_counts=progress["risk_counts"],
+        message=f"已完成 {batch['total'] - active}/{batch['total']} 份合同"
+    )
+
+async def get_batch_or_404(batch_id: str) -> dict:
+    batch = await async_get_batch(batch_id)
+    if batch is None:
+        raise HTTPException(status_code=404, detail="Batch not found")
+    return batch
+
+async def build_batch(request: Request, builder: BatchBuilder, category: Optional[str]) -> dict:
+    chunk_size = get_batch_config().get("chunk_size", 32)
+    content_type = request.headers.get("content-type", "").split(";")[0].strip()
+    
+    try:
+        if content_type in NDJSON_CONTENT_TYPES:
+            async for items in read_ndjson_items(request, chunk_size):
+                await run_in_threadpool(builder.add, items)
+        else:
+            manifest = BatchManifest.model_validate_json(await request.body())
+            builder.category = manifest.category or category
+            for start in range(0, len(manifest.items), chunk_size):
+                await run_in_threadpool(builder.add, manifest.items[start:start + chunk_size])
+        return await run_in_threadpool(builder.create)
+    except ValidationError as e:
+        raise HTTPException(status_code=400, detail=f"批量清单格式错误: {e.errors()[0]['msg']}")
+    except ValueError as e:
+        raise HTTPException(status_code=400, detail=str(e))
+
+@router.post("/batch", response_model=BatchStatus)
+async def create_batch_review(
+    request: Request,
+    category: Optional[str] = Query(None),
+    reuse: bool = Query(True)
+):
+    # Accepts a JSON manifest ({"category": ..., "items": [...]}) or an NDJSON stream with one
+    # pair per line.
+    ensure_review_capacity()
+    
+    builder = await run_in_threadpool(BatchBuilder, category, reuse)
+    try:
+        created = await build_batch(request, builder, category)
+    except BaseException:
+        # A rejected manifest must not leave the texts read so far in the document store.
+        await run_in_threadpool(builder.discard)
+        raise
+    
+    batch_id = created["batch_id"]
+    if created["scheduled"] and uses_inline_dispatch() and not start_batch_workers(batch_id):
+        # The pool filled up while the manifest was being read; nothing would ever run the batch.
+        logger.warning(f"Batch {batch_id} rejected: review queue is full")
+        await async_fail_pending_batch_tasks(batch_id, "Review queue is full")
+        raise HTTPException(status_code=429, detail="审查队列已满，请稍后重试")
+    
+    return batch_status(await get_batch_or_404(batch_id), await async_get_batch_progress(batch_id))
+
+@router.get("/batch/{batch_id}", response_model=BatchStatus)
+async def get_batch_status(batch_id: str, request: Request, response: Response):
+    batch = await get_batch_or_404(batch_id)
+    progress = await async_get_batch_progress(batch_id)
+    
+    not_modified = check_not_modified(request, response, task_etag("batch", progress["version"]))
+    if not_modified:
+        return not_modified
+    
+    return batch_status(batch, progress)
+
+@router.get("/batch/{batch_id}/items", response_model=BatchItemPage)
+async def get_batch_items(
+    batch_id: str,
+    cursor: int = Query(0, ge=0),
+    limit: int = Query(100, ge=1, le=1000)
+):
+    await get_batch_or_404(batch_id)
+    items = await async_get_batch_items(batch_id, cursor, limit)
+    return BatchItemPage(batch_id=batch_id, items=items, cursor=items[-1]["position"] if items else cursor)
+
+@router.get("/cache/stats")
+async def get_cache_stats():
+    from app.services.llm_cache import get_llm_cache
+    
+    cache = get_llm_cache()
+    return {"llm_cache": cache.stats() if cache else None}
+
 @router.post("/upload")
 async def upload_contracts(
     original_file: Optional[UploadFile] = File(None),
     modified_file: Optional[UploadFile] = File(None),
-    category: Optional[str] = Form(None)
+    category: Optional[str] = Form(None),
+    reuse: bool = Query(True)
 ):
     original_text = ""
     modified_text = ""
@@ -204,6 +494,14 @@ async def upload_contracts(
         category=category
     )
     
+    result_key = await task_result_key(contract)
+    if reuse and result_key:
+        reused = await reuse_cached_review(result_key)
+        if reused:
+            return reused
+    
+    ensure_review_capacity()
+    
     task_id = str(uuid.uuid4())
     
     task_data = {
@@ -216,13 +514,14 @@ async def upload_contracts(
         "evaluations": [],
         "human_reviews": [],
         "final_report": None,
-        "error": None
+        "error": None,
+        "result_key": result_key
     }
     
-    save_task(task_id, task_data)
+    await async_save_task(task_id, task_data)
     logger.info(f"Task {task_id} created from file upload")
     
-    asyncio.create_task(run_review_task_with_retry(task_id, contract))
+    await schedule_review_task(task_id)
     
     return TaskStatus(
         task_id=task_id,
@@ -12,22 +12,100 @@ default_config = {
         "debug": False
     },
     "database": {
-        "path": "app/data/contracts.db"
+        "path": "app/data/contracts.db",
+        "async_pool_size": 4
     },
     "llm": {
         "provider": "ollama",
         "model": "llama3.2",
         "temperature": 0.3,
         "base_url": "http://localhost:11434",
-        "use_llm": True
+        "use_llm": True,
+        "timeout": 60,
+        "max_concurrency": 4,
+        "batch_size": 1
+    },
+    "llm_cache": {
+        "enabled": True,
+        "max_entries": 10000,
+        "ttl_seconds": 2592000
     },
     "embeddings": {
+        "backend": "openai",
         "model": "text-embedding-3-small",
-        "use_embeddings": False
+        "use_embeddings": False,
+        "batch_size": 64,
+        "cache": True,
+        "local_dim": 512,
+        "local_idf": True
+    },
+    "analysis": {
+        "diff_engine": "clause",
+        "match_threshold": 0.5,
+        "similarity": "lcs",
+        "prefilter": "minhash",
+        "minhash_perm": 64,
+        "minhash_shingle": 2,
+        "minhash_jaccard": 0.15,
+        "streaming": {
+            "enabled": True,
+            "threshold_bytes": 2097152,
+            "window": 200,
+            "batch_size": 100,
+            "max_line_chars": 8192
+        }
+    },
+    "retrieval": {
+        "mode": "hybrid",
+        "candidates": 20,
+        "rrf_k": 60,
+        "fts_weight": 1.0,
+        "vector_weight": 1.0,
+        "timeout": 10,
+        "cache_size": 4096
+    },
+    "vector_index": {
+        "enabled": False,
+        "path": "app/data/vector_index/templates",
+        "nlist": 64,
+        "nprobe": 8
     },
     "task": {
         "max_retries": 3,
-        "retry_delay": 2
+        "retry_delay": 2,
+        "dispatch": "inline",
+        "checkpoint_ttl_seconds": 604800
+    },
+    "queue": {
+        "lease_seconds": 60,
+        "heartbeat_interval": 15,
+        "poll_interval": 1
+    },
+    "executor": {
+        "mode": "thread",
+        "max_workers": 2,
+        "max_queue": 16
+    },
+    "result_cache": {
+        "enabled": True,
+        "ttl_seconds": 2592000
+    },
+    "batch": {
+        "max_items": 5000,
+        "concurrency": 1,
+        "chunk_size": 32
+    },
+    "documents": {
+        "compression": "zstd",
+        "level": 3,
+        "min_size": 4096
+    },
+    "events": {
+        "history_size": 256,
+        "retention_seconds": 300,
+        "idle_seconds": 3600,
+        "max_tasks": 1024,
+        "poll_interval": 5
     },
     "logging": {
         "level": "INFO",
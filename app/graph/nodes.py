@@ -1,165 +1,384 @@
 import os
 import re
-import difflib
-from typing import List, Dict, Any
+import json
+import time
+import logging
+import threading
+from concurrent.futures import ThreadPoolExecutor
+from typing import List, Dict, Any, Optional, Callable
+from app.config import get_config
 from app.graph.state import ContractReviewState
 from app.rag.retriever import retriever
 from app.models.schemas import ReviewStatus
+from app.rag.db import (
+    iter_task_text, read_task_text_head, append_task_differences, delete_task_differences, append_task_evaluations,
+    document_hash, get_document, is_document_shared, get_document_artifact, put_document_artifact
+)
+from app.services.diff_engine import Clause, SEGMENTATION_VERSION, diff_documents, segment_clauses, stream_documents
+from app.services.rule_matcher import RuleMatcher, get_rule_matcher, get_playbook_matcher
+from app.services.rule_engine import ThresholdMatch, get_threshold_engine, normalize_risk_level
+from app.services.events import publish_task_event
+
+logger = logging.getLogger(__name__)
+
+TEMPLATE_QUERY_CHARS = 500
+MAX_FALLBACK_DIFFERENCES = 10
+
+def state_text(state: ContractReviewState, side: str) -> str:
+    # The state is checkpointed after every node, so it carries the texts' hashes only.
+    return get_document(state[f"{side}_hash"]) or ""
 
 def node_retriever(state: ContractReviewState) -> ContractReviewState:
     state["status"] = "in_progress"
     
-    modified_text = state["modified_text"]
+    if state.get("streaming"):
+        excerpt = read_task_text_head(state["task_id"], "modified_text", TEMPLATE_QUERY_CHARS)
+    else:
+        excerpt = state_text(state, "modified")[:TEMPLATE_QUERY_CHARS]
     category = state.get("category") or None
+    differences = state.get("differences", [])
+    
+    templates = retriever.retrieve_templates(excerpt, top_k=2)
+    retrieval_result = retriever.retrieve_for_differences(differences, category or "")
     
-    retrieval_result = retriever.retrieve_for_contract(modified_text, category or "")
+    for diff, rule_ids in zip(differences, retrieval_result["rule_ids"]):
+        diff["rule_ids"] = rule_ids
     
-    state["retrieved_templates"] = retrieval_result["templates"]
+    state["differences"] = differences
+    state["retrieved_templates"] = templates
     state["playbook_rules"] = retrieval_result["playbook_rules"]
+    state["retrieval_timings"] = retrieval_result["timings"]
+    
+    logger.info(f"Task {state.get('task_id')} retrieval ({retrieval_result['mode']}, {len(differences)} differences): {retrieval_result['timings']}")
     
     return state
 
+def rules_for_differences(differences: List[Dict[str, Any]], playbook_rules: List[Dict[str, Any]]) -> List[List[Dict[str, Any]]]:
+    # Differences analysed before per-difference retrieval carry no rule_ids and see every rule.
+    rules_by_id = {rule.get("id"): rule for rule in playbook_rules}
+    return [
+        [rules_by_id[rule_id] for rule_id in diff["rule_ids"] if rule_id in rules_by_id]
+        if diff.get("rule_ids") is not None else playbook_rules
+        for diff in differences
+    ]
+
+def is_significant(diff: Dict[str, Any]) -> bool:
+    return len(diff["modified_section"]) > 10 or len(diff["original_section"]) > 10
+
+def stream_differences(task_id: str, analysis_config: Dict[str, Any]) -> List[Dict[str, Any]]:
+    # Reads both texts from the document store chunk by chunk and persists differences in batches
+    # as the windows are aligned; only the (much smaller) list of significant differences is kept.
+    batch_size = analysis_config.get("streaming", {}).get("batch_size", 100)
+    delete_task_differences(task_id)
+    
+    significant, insignificant, batch = [], [], []
+    seq = 0
+    for diff in stream_documents(
+        iter_task_text(task_id, "original_text"),
+        iter_task_text(task_id, "modified_text"),
+        analysis_config
+    ):
+        if is_significant(diff):
+            significant.append(diff)
+            batch.append(diff)
+        elif len(insignificant) < MAX_FALLBACK_DIFFERENCES:
+            insignificant.append(diff)
+        
+        if len(batch) >= batch_size:
+            append_task_differences(task_id, seq, batch)
+            seq += len(batch)
+            batch = []
+    
+    if not significant:
+        batch = insignificant
+    if batch:
+        append_task_differences(task_id, seq, batch)
+    return significant or insignificant
+
+def document_clauses(text: str) -> List[Clause]:
+    # Segmentation is memoized per document hash, but only for documents used by more than one
+    # task (a template compared against many redlines); one-off redlines are not worth storing.
+    digest = document_hash(text)
+    kind = f"clauses.v{SEGMENTATION_VERSION}"
+    stored = get_document_artifact(digest, kind)
+    if stored is not None:
+        return [Clause(*item)._replace(path=tuple(item[2])) for item in json.loads(stored)]
+    
+    clauses = segment_clauses(text)
+    if is_document_shared(digest):
+        put_document_artifact(digest, kind, json.dumps(clauses, ensure_ascii=False).encode("utf-8"))
+    return clauses
+
 def node_analyzer(state: ContractReviewState) -> ContractReviewState:
-    original = state["original_text"]
-    modified = state["modified_text"]
-    
-    original_lines = [line.strip() for line in original.split('\n') if line.strip()]
-    modified_lines = [line.strip() for line in modified.split('\n') if line.strip()]
-    
-    differences = []
-    
-    matcher = difflib.SequenceMatcher(None, original_lines, modified_lines)
-    
-    for tag, i1, i2, j1, j2 in matcher.get_opcodes():
-        if tag == 'replace':
-            for i in range(max(len(original_lines[i1:i2]), len(modified_lines[j1:j2]))):
-                orig = original_lines[i1 + i] if i < len(original_lines[i1:i2]) else ""
-                mod = modified_lines[j1 + i] if i < len(modified_lines[j1:j2]) else ""
-                if orig or mod:
-                    similarity = difflib.SequenceMatcher(None, orig, mod).ratio()
-                    differences.append({
-                        "original_section": orig,
-                        "modified_section": mod,
-                        "similarity": similarity,
-                        "change_type": "modified"
-                    })
-        elif tag == 'delete':
-            for orig in original_lines[i1:i2]:
-                differences.append({
-                    "original_section": orig,
-                    "modified_section": "",
-                    "similarity": 0.0,
-                    "change_type": "removed"
-                })
-        elif tag == 'insert':
-            for mod in modified_lines[j1:j2]:
-                differences.append({
-                    "original_section": "",
-                    "modified_section": mod,
-                    "similarity": 0.0,
-                    "change_type": "added"
-                })
-    
-    significant_diffs = [d for d in differences if len(d["modified_section"]) > 10 or len(d["original_section"]) > 10]
-    
-    state["differences"] = significant_diffs if significant_diffs else differences[:10]
+    analysis_config = get_config().get("analysis", {})
+    
+    if state.get("streaming"):
+        state["differences"] = stream_differences(state["task_id"], analysis_config)
+        return state
+    
+    differences = diff_documents(
+        state_text(state, "original"), state_text(state, "modified"), analysis_config, document_clauses
+    )
+    
+    significant_diffs = [d for d in differences if is_significant(d)]
+    
+    state["differences"] = significant_diffs if significant_diffs else differences[:MAX_FALLBACK_DIFFERENCES]
     
     return state
 
+def rule_based_evaluation(
+    idx: int,
+    diff: Dict[str, Any],
+    playbook_rules: List[Dict[str, Any]],
+    matcher: Optional[RuleMatcher] = None
+) -> Dict[str, Any]:
+    modified_text = diff.get("modified_section", "")
+    original_text = diff.get("original_section", "")
+    text_to_check = (modified_text + " " + original_text).lower()
+    
+    candidates = matcher.candidate_positions(playbook_rules) if matcher is not None else None
+    if candidates is None:
+        best_match_rule, best_score = get_rule_matcher(playbook_rules).best_match(text_to_check)
+    else:
+        best_match_rule, best_score = matcher.best_match(text_to_check, candidates)
+    
+    if best_match_rule and best_score > 0:
+        risk_level = normalize_risk_level(best_match_rule["risk_level"])
+        suggestion = best_match_rule["action"]
+        explanation = best_match_rule["description"]
+    else:
+        if diff.get("change_type") == "added":
+            risk_level = "yellow"
+            suggestion = "请确认此新增条款是否符合公司标准"
+            explanation = "新增条款，未匹配到明确的合规规则"
+        elif diff.get("change_type") == "removed":
+            risk_level = "yellow"
+            suggestion = "请确认删除此条款的原因"
+            explanation = "删除了原有条款"
+        else:
+            similarity = diff.get("similarity", 1.0)
+            if similarity > 0.8:
+                risk_level = "green"
+                suggestion = "符合标准"
+                explanation = "修改内容与原文高度相似，无明显风险"
+            else:
+                risk_level = "yellow"
+                suggestion = "请人工审核此修改"
+                explanation = "修改内容较复杂，建议人工确认"
+    
+    return {
+        "id": idx,
+        "difference": diff,
+        "risk_level": risk_level,
+        "matched_rule": best_match_rule,
+        "suggestion": suggestion,
+        "explanation": explanation
+    }
+
+def moved_evaluation(idx: int, diff: Dict[str, Any]) -> Dict[str, Any]:
+    origin = diff.get("original_clause") or "原位置"
+    target = diff.get("modified_clause") or "新位置"
+    return {
+        "id": idx,
+        "difference": diff,
+        "risk_level": "green",
+        "matched_rule": None,
+        "suggestion": "符合标准",
+        "explanation": f"条款内容未变，仅由{origin}调整至{target}"
+    }
+
+def threshold_evaluation(idx: int, diff: Dict[str, Any], match: ThresholdMatch) -> Dict[str, Any]:
+    rule = match.rule
+    return {
+        "id": idx,
+        "difference": diff,
+        "risk_level": normalize_risk_level(rule["risk_level"]),
+        "matched_rule": rule,
+        "suggestion": rule["action"],
+        "explanation": f"{rule['description']}（{'；'.join(match.facts)}）"
+    }
+
+def llm_evaluation(idx: int, diff: Dict[str, Any], llm_result: Dict[str, Any]) -> Dict[str, Any]:
+    return {
+        "id": idx,
+        "difference": diff,
+        "risk_level": llm_result["risk_level"],
+        "matched_rule": llm_result.get("matched_rule"),
+        "suggestion": llm_result["suggestion"],
+        "explanation": llm_result["explanation"]
+    }
+
+def run_llm_calls(
+    calls: List[Callable[[], Any]],
+    max_in_flight: int,
+    timeout: float,
+    on_result: Optional[Callable[[int, Any], None]] = None
+) -> List[Any]:
+    # Results come back in submission order; a call that fails or outlives its own timeout yields None.
+    # So does a call that gets no slot within the timeout (every slot held by a hung call); once that
+    # happens the remaining unstarted calls are given up at once. on_result sees each result as soon
+    # as it is collected.
+    started = [threading.Event() for _ in calls]
+    start_times = [0.0] * len(calls)
+    stalled = False
+    
+    def run(i):
+        start_times[i] = time.monotonic()
+        started[i].set()
+        return calls[i]()
+    
+    pool = ThreadPoolExecutor(max_workers=max(1, max_in_flight), thread_name_prefix="llm-eval")
+    results = []
+    try:
+        futures = [pool.submit(run, i) for i in range(len(calls))]
+        for i, future in enumerate(futures):
+            if not started[i].wait(0 if stalled else timeout):
+                stalled = True
+                future.cancel()
+                results.append(None)
+            else:
+                remaining = timeout - (time.monotonic() - start_times[i])
+                try:
+                    results.append(future.result(timeout=max(0, remaining)))
+                except Exception:
+                    results.append(None)
+            if on_result is not None:
+                on_result(i, results[-1])
+    finally:
+        pool.shutdown(wait=False, cancel_futures=True)
+    return results
+
+def evaluate_with_llm(
+    differences: List[Dict[str, Any]],
+    difference_rules: List[List[Dict[str, Any]]],
+    on_result: Optional[Callable[[int, Dict[str, Any]], None]] = None
+) -> List[Optional[Dict[str, Any]]]:
+    from app.services.llm import get_llm_service
+    llm = get_llm_service()
+    
+    llm_config = get_config().get("llm", {})
+    max_in_flight = llm_config.get("max_concurrency", 4)
+    timeout = llm_config.get("timeout", 60)
+    batch_size = max(1, llm_config.get("batch_size", 1))
+    
+    def single_call(idx):
+        diff = differences[idx]
+        return lambda: llm.analyze_contract_difference(
+            original_section=diff.get("original_section", ""),
+            modified_section=diff.get("modified_section", ""),
+            change_type=diff.get("change_type", "modified"),
+            playbook_rules=difference_rules[idx]
+        )
+    
+    def report(idx, result):
+        if on_result is not None and result is not None:
+            on_result(idx, result)
+    
+    if batch_size == 1:
+        return run_llm_calls([single_call(idx) for idx in range(len(differences))], max_in_flight, timeout, report)
+    
+    starts = range(0, len(differences), batch_size)
+    
+    def report_batch(position, batch_result):
+        for offset, result in enumerate(batch_result or []):
+            report(starts[position] + offset, result)
+    
+    batches = [differences[i:i + batch_size] for i in starts]
+    batch_results = run_llm_calls(
+        [
+            lambda i=i: llm.analyze_contract_differences_batch(
+                differences[i:i + batch_size], item_rules=difference_rules[i:i + batch_size]
+            )
+            for i in starts
+        ],
+        max_in_flight,
+        timeout,
+        report_batch
+    )
+    
+    results = []
+    for batch, batch_result in zip(batches, batch_results):
+        results.extend(batch_result if batch_result else [None] * len(batch))
+    
+    missing = [idx for idx, result in enumerate(results) if result is None]
+    if missing:
+        retried = run_llm_calls([single_call(idx) for idx in missing], max_in_flight, timeout,
+                                 lambda position, result: report(missing[position], result))
+        for idx, result in zip(missing, retried):
+            results[idx] = result
+    return results
+
 def node_evaluator(state: ContractReviewState) -> ContractReviewState:
     differences = state.get("differences", [])
-    playbook_rules = state.get("playbook_rules", [])
+    difference_rules = rules_for_differences(differences, state.get("playbook_rules", []))
     
     use_llm = os.getenv("USE_LLM", "false").lower() == "true"
     
-    evaluations = []
+    # Unchanged clauses that only moved, and clauses whose numbers settle a threshold rule, are
+    # decided here and never reach the LLM.
+    decided = [None] * len(differences)
+    engine = get_threshold_engine() if differences else None
+    for idx, (diff, rules) in enumerate(zip(differences, difference_rules)):
+        if diff.get("change_type") == "moved" and diff.get("similarity") == 1.0:
+            decided[idx] = moved_evaluation(idx, diff)
+        elif engine is not None:
+            match = engine.classify(diff.get("modified_section", ""), rules)
+            if match is not None:
+                decided[idx] = threshold_evaluation(idx, diff, match)
+    
+    task_id = state.get("task_id")
+    review_round = state.get("review_round", 0)
     
-    for idx, diff in enumerate(differences):
-        modified_text = diff.get("modified_section", "")
-        original_text = diff.get("original_section", "")
-        change_type = diff.get("change_type", "modified")
-        
-        if use_llm:
-            try:
-                from app.services.llm import get_llm_service
-                llm = get_llm_service()
-                llm_result = llm.analyze_contract_difference(
-                    original_section=original_text,
-                    modified_section=modified_text,
-                    change_type=change_type,
-                    playbook_rules=playbook_rules
+    def report(evaluations):
+        # Each evaluation is stored and announced as soon as it is decided, so reviewers can start
+        # before the whole task finishes. Events carry only the risk level; clients fetch the
+        # clause texts through the result cursor.
+        if not task_id or not evaluations:
+            return
+        append_task_evaluations(task_id, review_round, evaluations)
+        for evaluation in evaluations:
+            matched_rule = evaluation.get("matched_rule") or {}
+            publish_task_event(
+                task_id, "evaluation",
+                risk_level=evaluation["risk_level"], rule_id=matched_rule.get("id"), review_round=review_round
+            )
+    
+    report([evaluation for evaluation in decided if evaluation is not None])
+    
+    llm_results = [None] * len(differences)
+    pending = [idx for idx, evaluation in enumerate(decided) if evaluation is None]
+    if use_llm and pending:
+        try:
+            results = evaluate_with_llm(
+                [differences[idx] for idx in pending],
+                [difference_rules[idx] for idx in pending],
+                on_result=lambda position, result: report(
+                    [llm_evaluation(pending[position], differences[pending[position]], result)]
                 )
-                
-                evaluations.append({
-                    "id": idx,
-                    "difference": diff,
-                    "risk_level": llm_result["risk_level"],
-                    "matched_rule": llm_result.get("matched_rule"),
-                    "suggestion": llm_result["suggestion"],
-                    "explanation": llm_result["explanation"]
-                })
-                continue
-            except Exception as e:
-                pass
-        
-        best_match_rule = None
-        best_score = 0
-        
-        for rule in playbook_rules:
-            keywords = rule.get("keywords", "").lower()
-            rule_desc = rule.get("description", "").lower()
-            
-            text_to_check = (modified_text + " " + original_text).lower()
-            
-            score = 0
-            if keywords:
-                keyword_list = [k.strip() for k in keywords.split(",")]
-                for kw in keyword_list:
-                    if kw in text_to_check:
-                        score += 1
-                    if kw in rule_desc:
-                        score += 0.5
-            
-            if score > best_score:
-                best_score = score
-                best_match_rule = rule
-        
-        if best_match_rule and best_score > 0:
-            risk_level = best_match_rule["risk_level"]
-            suggestion = best_match_rule["action"]
-            explanation = best_match_rule["description"]
+            )
+            for idx, result in zip(pending, results):
+                llm_results[idx] = result
+        except Exception as e:
+            pass
+    
+    matcher = None
+    if any(llm_results[idx] is None for idx in pending):
+        matcher = get_playbook_matcher(state.get("category") or None)
+    
+    evaluations = []
+    fallbacks = []
+    for idx, (diff, evaluation, llm_result) in enumerate(zip(differences, decided, llm_results)):
+        if evaluation is not None:
+            evaluations.append(evaluation)
+        elif llm_result is not None:
+            evaluations.append(llm_evaluation(idx, diff, llm_result))
         else:
-            if diff.get("change_type") == "added":
-                risk_level = "yellow"
-                suggestion = "请确认此新增条款是否符合公司标准"
-                explanation = "新增条款，未匹配到明确的合规规则"
-            elif diff.get("change_type") == "removed":
-                risk_level = "yellow"
-                suggestion = "请确认删除此条款的原因"
-                explanation = "删除了原有条款"
-            else:
-                similarity = diff.get("similarity", 1.0)
-                if similarity > 0.8:
-                    risk_level = "green"
-                    suggestion = "符合标准"
-                    explanation = "修改内容与原文高度相似，无明显风险"
-                else:
-                    risk_level = "yellow"
-                    suggestion = "请人工审核此修改"
-                    explanation = "修改内容较复杂，建议人工确认"
-        
-        evaluations.append({
-            "id": idx,
-            "difference": diff,
-            "risk_level": risk_level,
-            "matched_rule": best_match_rule,
-            "suggestion": suggestion,
-            "explanation": explanation
-        })
+            evaluations.append(rule_based_evaluation(idx, diff, difference_rules[idx], matcher))
+            fallbacks.append(evaluations[-1])
+    report(fallbacks)
     
     state["evaluations"] = evaluations
     
-    review_round = state.get("review_round", 0)
     max_rounds = state.get("max_review_rounds", 3)
     
     has_yellow_or_red = any(e["risk_level"] in ["yellow", "red"] for e in evaluations)
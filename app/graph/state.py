@@ -3,12 +3,14 @@ from typing import TypedDict, List, Dict, Any, Optional
 class ContractReviewState(TypedDict):
     task_id: str
     status: str
-    original_text: str
-    modified_text: str
+    original_hash: Optional[str]
+    modified_hash: Optional[str]
     category: Optional[str]
+    streaming: bool
     
     retrieved_templates: List[Dict[str, Any]]
     playbook_rules: List[Dict[str, Any]]
+    retrieval_timings: Dict[str, float]
     
     differences: List[Dict[str, Any]]
     evaluations: List[Dict[str, Any]]
@@ -1,6 +1,16 @@
+import os
+import time
+import sqlite3
+import threading
+from typing import Optional, List, Dict, Any
 from langgraph.graph import StateGraph, END
+from langgraph.checkpoint.sqlite import SqliteSaver
+from app.config import get_config
 from app.graph.state import ContractReviewState
+from app.rag.db import DATA_DIR, save_documents, list_prunable_review_threads
 from app.graph.nodes import node_retriever, node_analyzer, node_evaluator, node_human_loop, node_finalizer
+from app.services.executor import TaskCancelledError
+from app.services.events import TERMINAL_STATUSES, publish_task_event
 
 def should_need_human(state: ContractReviewState) -> str:
     if state.get("needs_human_review", False):
@@ -12,19 +22,36 @@ def should_continue_review(state: ContractReviewState) -> str:
         return "continue"
     return "finish"
 
+def with_progress(name: str, node):
+    # Reports each node as it finishes to clients following the task's event stream.
+    def run(state: ContractReviewState) -> ContractReviewState:
+        started = time.perf_counter()
+        result = node(state)
+        publish_task_event(
+            result.get("task_id"),
+            "node",
+            node=name,
+            status=result.get("status"),
+            elapsed_ms=round((time.perf_counter() - started) * 1000, 1),
+            differences=len(result.get("differences", [])),
+            evaluations=len(result.get("evaluations", []))
+        )
+        return result
+    return run
+
 def build_workflow() -> StateGraph:
     workflow = StateGraph(ContractReviewState)
     
-    workflow.add_node("retriever", node_retriever)
-    workflow.add_node("analyzer", node_analyzer)
-    workflow.add_node("evaluator", node_evaluator)
-    workflow.add_node("human_loop", node_human_loop)
-    workflow.add_node("finalizer", node_finalizer)
+    workflow.add_node("retriever", with_progress("retriever", node_retriever))
+    workflow.add_node("analyzer", with_progress("analyzer", node_analyzer))
+    workflow.add_node("evaluator", with_progress("evaluator", node_evaluator))
+    workflow.add_node("human_loop", with_progress("human_loop", node_human_loop))
+    workflow.add_node("finalizer", with_progress("finalizer", node_finalizer))
     
-    workflow.set_entry_point("retriever")
+    workflow.set_entry_point("analyzer")
     
-    workflow.add_edge("retriever", "analyzer")
-    workflow.add_edge("analyzer", "evaluator")
+    workflow.add_edge("analyzer", "retriever")
+    workflow.add_edge("retriever", "evaluator")
     
     workflow.add_conditional_edges(
         "evaluator",
@@ -48,17 +75,53 @@ def build_workflow() -> StateGraph:
     
     return workflow
 
-contract_review_graph = build_workflow().compile()
+# Checkpoints live next to the configured task database, on the same volume.
+CHECKPOINT_DB_PATH = os.path.join(DATA_DIR, "checkpoints.db")
+
+# Stale threads are looked for once every this many finished runs.
+CHECKPOINT_PRUNE_INTERVAL = 100
+
+_graph_lock = threading.Lock()
+_compiled_graph = None
+_compiled_pid = None
+_finished_runs = 0
+
+def get_contract_review_graph():
+    global _compiled_graph, _compiled_pid
+    with _graph_lock:
+        if _compiled_graph is None or _compiled_pid != os.getpid():
+            os.makedirs(os.path.dirname(CHECKPOINT_DB_PATH), exist_ok=True)
+            conn = sqlite3.connect(CHECKPOINT_DB_PATH, check_same_thread=False)
+            _compiled_graph = build_workflow().compile(
+                checkpointer=SqliteSaver(conn),
+                interrupt_before=["human_loop"]
+            )
+            _compiled_pid = os.getpid()
+        return _compiled_graph
 
-def run_contract_review(task_id: str, original_text: str, modified_text: str, category: str = None) -> ContractReviewState:
-    initial_state: ContractReviewState = {
+def thread_config(task_id: str) -> dict:
+    return {"configurable": {"thread_id": task_id}}
+
+def build_initial_state(
+    task_id: str,
+    original_text: str,
+    modified_text: str,
+    category: str = None,
+    streaming: bool = False
+) -> ContractReviewState:
+    # Texts go to the document store and only their hashes into the state, which is written to
+    # the checkpoint database after every node. Streamed reviews read the task's texts directly.
+    original_hash, modified_hash = (None, None) if streaming else save_documents([original_text, modified_text])[0]
+    return {
         "task_id": task_id,
         "status": "pending",
-        "original_text": original_text,
-        "modified_text": modified_text,
+        "original_hash": original_hash,
+        "modified_hash": modified_hash,
         "category": category,
+        "streaming": streaming,
         "retrieved_templates": [],
         "playbook_rules": [],
+        "retrieval_timings": {},
         "differences": [],
         "evaluations": [],
         "human_reviews": [],
@@ -69,6 +132,97 @@ def run_contract_review(task_id: str, original_text: str, modified_text: str, ca
         "max_review_rounds": 3,
         "continue_review": False
     }
+
+def get_checkpoint_ttl() -> float:
+    return get_config().get("task", {}).get("checkpoint_ttl_seconds", 604800)
+
+def prune_checkpoints(max_waiting_seconds: Optional[float] = None) -> int:
+    # Drops the threads of finished or unknown tasks and of tasks left waiting for a reviewer
+    # longer than the TTL. A paused run only saves work: resuming without one rebuilds the
+    # state from the stored task.
+    graph = get_contract_review_graph()
+    with graph.checkpointer.cursor(transaction=False) as cursor:
+        thread_ids = [row[0] for row in cursor.execute("SELECT DISTINCT thread_id FROM checkpoints")]
+    if not thread_ids:
+        return 0
     
-    result = contract_review_graph.invoke(initial_state)
+    ttl = get_checkpoint_ttl() if max_waiting_seconds is None else max_waiting_seconds
+    stale = list_prunable_review_threads(thread_ids, ttl)
+    for thread_id in stale:
+        graph.checkpointer.delete_thread(thread_id)
+    return len(stale)
+
+def forget_run(graph, task_id: str):
+    global _finished_runs
+    graph.checkpointer.delete_thread(task_id)
+    with _graph_lock:
+        _finished_runs += 1
+        should_prune = _finished_runs % CHECKPOINT_PRUNE_INTERVAL == 0
+    if should_prune:
+        prune_checkpoints()
+
+def finish_run(graph, task_id: str, result: ContractReviewState) -> ContractReviewState:
+    if result.get("status") in TERMINAL_STATUSES:
+        forget_run(graph, task_id)
     return result
+
+def run_contract_review(
+    task_id: str,
+    original_text: str,
+    modified_text: str,
+    category: str = None,
+    cancel_event: Optional[threading.Event] = None,
+    streaming: bool = False
+) -> ContractReviewState:
+    graph = get_contract_review_graph()
+    config = thread_config(task_id)
+    initial_state = build_initial_state(task_id, original_text, modified_text, category, streaming)
+    
+    try:
+        if cancel_event is None:
+            return finish_run(graph, task_id, graph.invoke(initial_state, config))
+        
+        result = initial_state
+        for state in graph.stream(initial_state, config, stream_mode="values"):
+            if cancel_event.is_set():
+                raise TaskCancelledError(f"Task {task_id} was cancelled")
+            result = state
+        return finish_run(graph, task_id, result)
+    except BaseException:
+        # Cancelled, failed or retried later from the start: the partial run is of no use.
+        forget_run(graph, task_id)
+        raise
+
+def copy_paused_review(source_task_id: str, task_id: str) -> bool:
+    # Gives a cloned task its own paused run, so resuming it keeps the retrieved rules instead
+    # of rebuilding the state from the stored task.
+    graph = get_contract_review_graph()
+    snapshot = graph.get_state(thread_config(source_task_id))
+    if not snapshot.next:
+        return False
+    
+    config = thread_config(task_id)
+    graph.update_state(config, {**snapshot.values, "task_id": task_id}, as_node="evaluator")
+    graph.invoke(None, config)
+    return True
+
+def resume_contract_review(task: Dict[str, Any], human_reviews: List[Dict[str, Any]]) -> ContractReviewState:
+    graph = get_contract_review_graph()
+    task_id = task["task_id"]
+    config = thread_config(task_id)
+    
+    if not graph.get_state(config).next:
+        # No paused run for this task (e.g. it predates checkpointing): rebuild the
+        # post-evaluation state from the stored task instead of re-running the LLM.
+        state = build_initial_state(task_id, task["original_text"], task["modified_text"], task.get("category"))
+        state.update({
+            "status": "waiting_human",
+            "differences": task.get("differences", []),
+            "evaluations": task.get("evaluations", []),
+            "needs_human_review": True
+        })
+        graph.update_state(config, state, as_node="evaluator")
+        graph.invoke(None, config)
+    
+    graph.update_state(config, {"human_reviews": human_reviews})
+    return finish_run(graph, task_id, graph.invoke(None, config))
@@ -4,8 +4,11 @@ from fastapi import FastAPI
 from fastapi.staticfiles import StaticFiles
 from fastapi.responses import FileResponse
 from app.api.routes import router as contracts_router
-from app.rag.db import init_db
+from app.rag.db import init_db, list_claimable_task_ids, list_unfinished_batch_ids, close_async_connections
 from app.config import get_config
+from app.services.executor import get_review_executor
+from app.services.batch import start_batch_workers
+from app.worker import run_task
 
 config = get_config()
 
@@ -29,6 +32,34 @@ async def startup_event():
     logger.info("Starting ContractGuardAgent...")
     init_db()
     logger.info("Database initialized")
+    
+    from app.graph.workflow import prune_checkpoints
+    
+    pruned = prune_checkpoints()
+    if pruned:
+        logger.info(f"Pruned {pruned} stale review checkpoints")
+    
+    if config.get("task", {}).get("dispatch", "inline") == "inline":
+        recover_pending_tasks()
+
+def recover_pending_tasks():
+    executor = get_review_executor()
+    task_ids = list_claimable_task_ids(limit=executor.capacity, include_batches=False)
+    for task_id in task_ids:
+        executor.submit(task_id, run_task, task_id)
+    
+    # Batches take whatever slots are left.
+    batch_ids = list_unfinished_batch_ids()
+    for batch_id in batch_ids:
+        start_batch_workers(batch_id)
+    if task_ids or batch_ids:
+        logger.info(f"Recovered {len(task_ids)} unfinished tasks and {len(batch_ids)} batches from the queue")
+
+@app.on_event("shutdown")
+async def shutdown_event():
+    get_review_executor().shutdown(wait=False)
+    await close_async_connections()
+    logger.info("Review executor and database connections stopped")
 
 @app.get("/")
 async def root():
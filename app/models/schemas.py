@@ -8,6 +8,7 @@ class ReviewStatus(str, Enum):
     WAITING_HUMAN = "waiting_human"
     COMPLETED = "completed"
     FAILED = "failed"
+    CANCELLED = "cancelled"
 
 class RiskLevel(str, Enum):
     GREEN = "green"
@@ -30,6 +31,19 @@ class ContractTask(BaseModel):
     human_reviews: Optional[List[Dict[str, Any]]] = None
     final_report: Optional[str] = None
     created_at: Optional[str] = None
+    version: Optional[int] = None
+    cloned_from: Optional[str] = None
+
+class EvaluationEntry(BaseModel):
+    seq: int
+    review_round: int
+    evaluation: Dict[str, Any]
+
+class EvaluationPage(BaseModel):
+    task_id: str
+    status: ReviewStatus
+    evaluations: List[EvaluationEntry]
+    cursor: int
 
 class DifferenceItem(BaseModel):
     original_section: str
@@ -57,3 +71,30 @@ class TaskStatus(BaseModel):
     task_id: str
     status: ReviewStatus
     message: Optional[str] = None
+
+class BatchItem(ContractUpload):
+    reference: Optional[str] = None
+
+class BatchManifest(BaseModel):
+    category: Optional[str] = None
+    items: List[BatchItem]
+
+class BatchStatus(BaseModel):
+    batch_id: str
+    status: ReviewStatus
+    total: int
+    counts: Dict[str, int]
+    risk_counts: Dict[str, int]
+    message: Optional[str] = None
+
+class BatchItemStatus(BaseModel):
+    position: int
+    reference: Optional[str] = None
+    task_id: str
+    status: ReviewStatus
+    risk_counts: Dict[str, int]
+
+class BatchItemPage(BaseModel):
+    batch_id: str
+    items: List[BatchItemStatus]
+    cursor: int
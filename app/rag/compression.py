@@ -0,0 +1,50 @@
+import zlib
+import logging
+from typing import Optional
+
+try:
+    import zstandard
+except ImportError:
+    zstandard = None
+
+logger = logging.getLogger(__name__)
+
+CODECS = ("none", "zlib", "zstd")
+
+_warned_no_zstd = False
+
+def resolve_codec(name: str) -> str:
+    # zstd is optional; without the zstandard package new documents fall back to zlib.
+    global _warned_no_zstd
+    if name not in CODECS:
+        raise ValueError(f"Unknown compression codec: {name}")
+    if name == "zstd" and zstandard is None:
+        if not _warned_no_zstd:
+            logger.warning("zstandard is not installed, compressing documents with zlib")
+            _warned_no_zstd = True
+        return "zlib"
+    return name
+
+def compress(data: bytes, codec: str, level: Optional[int] = None) -> bytes:
+    if codec == "zstd":
+        return zstandard.ZstdCompressor(level=level if level is not None else 3).compress(data)
+    if codec == "zlib":
+        return zlib.compress(data, level if level is not None else 6)
+    return data
+
+class _Passthrough:
+    def decompress(self, data: bytes) -> bytes:
+        return data
+
+def decompressor(codec: str):
+    # Incremental decompressor with a decompress(chunk) method, for reading documents in pages.
+    if codec == "zstd":
+        if zstandard is None:
+            raise RuntimeError("Document is zstd-compressed but zstandard is not installed")
+        return zstandard.ZstdDecompressor().decompressobj()
+    if codec == "zlib":
+        return zlib.decompressobj()
+    return _Passthrough()
+
+def decompress(data: bytes, codec: str) -> bytes:
+    return decompressor(codec).decompress(data)
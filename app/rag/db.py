@@ -1,18 +1,155 @@
 import os
+import json
+import codecs
+import hashlib
+import time
+import asyncio
 import sqlite3
+import threading
+from contextlib import contextmanager, asynccontextmanager
 from typing import Optional
 
-DATA_DIR = os.path.join(os.path.dirname(os.path.dirname(__file__)), "data")
-DB_PATH = os.path.join(DATA_DIR, "contracts.db")
+import aiosqlite
+
+from app.config import BASE_DIR, get_config
+from app.rag.tokenizer import tokenize, segment_text, build_match_query
+from app.rag.compression import resolve_codec, compress, decompress, decompressor
+
+def configured_db_path() -> str:
+    # Relative paths in config.yaml are relative to the project root, not the working directory.
+    path = get_config().get("database", {}).get("path", "app/data/contracts.db")
+    return str(BASE_DIR / path) if not os.path.isabs(path) else path
+
+DB_PATH = configured_db_path()
+DATA_DIR = os.path.dirname(DB_PATH)
+
+CONNECTION_PRAGMAS = (
+    "PRAGMA journal_mode = WAL",
+    "PRAGMA synchronous = NORMAL",
+    "PRAGMA busy_timeout = 5000",
+    "PRAGMA cache_size = -32768",
+    "PRAGMA mmap_size = 268435456",
+    "PRAGMA temp_store = MEMORY",
+)
+STATEMENT_CACHE_SIZE = 256
+
+_local = threading.local()
+_connections_lock = threading.Lock()
+_open_connections = []
+_connections_generation = 0
 
 def get_db_path() -> str:
-    os.makedirs(DATA_DIR, exist_ok=True)
+    os.makedirs(os.path.dirname(DB_PATH), exist_ok=True)
     return DB_PATH
 
-def init_db():
+def create_connection(db_path: str) -> sqlite3.Connection:
+    conn = sqlite3.connect(
+        db_path,
+        isolation_level=None,
+        check_same_thread=False,
+        cached_statements=STATEMENT_CACHE_SIZE
+    )
+    conn.row_factory = sqlite3.Row
+    conn.create_function("cjk_segment", 1, segment_text, deterministic=True)
+    for pragma in CONNECTION_PRAGMAS:
+        conn.execute(pragma)
+    return conn
+
+def get_connection() -> sqlite3.Connection:
     db_path = get_db_path()
-    conn = sqlite3.connect(db_path)
-    cursor = conn.cursor()
+    pid = os.getpid()
+    
+    if getattr(_local, "pid", None) != pid or getattr(_local, "generation", None) != _connections_generation:
+        _local.pid = pid
+        _local.generation = _connections_generation
+        _local.connections = {}
+    
+    conn = _local.connections.get(db_path)
+    if conn is None:
+        conn = create_connection(db_path)
+        _local.connections[db_path] = conn
+        with _connections_lock:
+            _open_connections.append(conn)
+    return conn
+
+def close_connections():
+    global _connections_generation
+    with _connections_lock:
+        for conn in _open_connections:
+            try:
+                conn.close()
+            except sqlite3.Error:
+                pass
+        _open_connections.clear()
+        _connections_generation += 1
+
+@contextmanager
+def transaction():
+    conn = get_connection()
+    conn.execute("BEGIN IMMEDIATE")
+    try:
+        yield conn
+        conn.execute("COMMIT")
+    except BaseException:
+        conn.execute("ROLLBACK")
+        raise
+
+def init_db():
+    with transaction() as conn:
+        create_schema(conn.cursor())
+
+SEARCH_INDEX_VERSION = 2
+
+SEARCH_INDEX_COLUMNS = {
+    "templates": ("title", "category", "content"),
+    "playbook": ("rule_name", "category", "description", "risk_level", "keywords"),
+}
+
+def create_search_indexes(cursor):
+    cursor.execute("INSERT OR IGNORE INTO meta (key, value) VALUES ('search_index_version', 0)")
+    cursor.execute("SELECT value FROM meta WHERE key = 'search_index_version'")
+    if cursor.fetchone()[0] >= SEARCH_INDEX_VERSION:
+        return
+    
+    for table, columns in SEARCH_INDEX_COLUMNS.items():
+        fts = f"{table}_fts"
+        column_list = ", ".join(columns)
+        new_values = ", ".join(f"cjk_segment(new.{column})" for column in columns)
+        old_values = ", ".join(f"cjk_segment(old.{column})" for column in columns)
+        
+        for suffix in ("ai", "ad", "au"):
+            cursor.execute(f"DROP TRIGGER IF EXISTS {table}_{suffix}")
+        cursor.execute(f"DROP TABLE IF EXISTS {fts}_vocab")
+        cursor.execute(f"DROP TABLE IF EXISTS {fts}")
+        
+        cursor.execute(f"CREATE VIRTUAL TABLE {fts} USING fts5({column_list}, content='')")
+        cursor.execute(f"CREATE VIRTUAL TABLE {fts}_vocab USING fts5vocab({fts}, 'row')")
+        
+        cursor.execute(f"""
+            CREATE TRIGGER {table}_ai AFTER INSERT ON {table} BEGIN
+                INSERT INTO {fts}(rowid, {column_list}) VALUES (new.id, {new_values});
+            END
+        """)
+        
+        cursor.execute(f"""
+            CREATE TRIGGER {table}_ad AFTER DELETE ON {table} BEGIN
+                INSERT INTO {fts}({fts}, rowid, {column_list}) VALUES ('delete', old.id, {old_values});
+            END
+        """)
+        
+        cursor.execute(f"""
+            CREATE TRIGGER {table}_au AFTER UPDATE ON {table} BEGIN
+                INSERT INTO {fts}({fts}, rowid, {column_list}) VALUES ('delete', old.id, {old_values});
+                INSERT INTO {fts}(rowid, {column_list}) VALUES (new.id, {new_values});
+            END
+        """)
+        
+        select_values = ", ".join(f"cjk_segment({column})" for column in columns)
+        cursor.execute(f"INSERT INTO {fts}(rowid, {column_list}) SELECT id, {select_values} FROM {table}")
+    
+    cursor.execute("UPDATE meta SET value = ? WHERE key = 'search_index_version'", (SEARCH_INDEX_VERSION,))
+
+def create_schema(cursor):
     
     cursor.execute("""
         CREATE TABLE IF NOT EXISTS templates (
@@ -24,12 +161,6 @@ def init_db():
         )
     """)
     
-    cursor.execute("""
-        CREATE VIRTUAL TABLE IF NOT EXISTS templates_fts USING fts5(
-            title, category, content, content=templates, content_rowid=id
-        )
-    """)
-    
     cursor.execute("""
         CREATE TABLE IF NOT EXISTS playbook (
             id INTEGER PRIMARY KEY AUTOINCREMENT,
@@ -44,51 +175,215 @@ def init_db():
     """)
     
     cursor.execute("""
-        CREATE VIRTUAL TABLE IF NOT EXISTS playbook_fts USING fts5(
-            rule_name, category, description, risk_level, keywords,
-            content=playbook, content_rowid=id
+        CREATE TABLE IF NOT EXISTS meta (
+            key TEXT PRIMARY KEY,
+            value INTEGER NOT NULL DEFAULT 0
         )
     """)
     
+    cursor.execute("INSERT OR IGNORE INTO meta (key, value) VALUES ('playbook_version', 0)")
+    cursor.execute("INSERT OR IGNORE INTO meta (key, value) VALUES ('templates_version', 0)")
+    
+    create_search_indexes(cursor)
+    
+    for table in ("playbook", "templates"):
+        for event in ("INSERT", "UPDATE", "DELETE"):
+            cursor.execute(f"""
+                CREATE TRIGGER IF NOT EXISTS {table}_version_{event.lower()} AFTER {event} ON {table} BEGIN
+                    UPDATE meta SET value = value + 1 WHERE key = '{table}_version';
+                END
+            """)
+    
     cursor.execute("""
-        CREATE TRIGGER IF NOT EXISTS templates_ai AFTER INSERT ON templates BEGIN
-            INSERT INTO templates_fts(rowid, title, category, content)
-            VALUES (new.id, new.title, new.category, new.content);
-        END
+        CREATE TABLE IF NOT EXISTS playbook_embeddings (
+            rule_id INTEGER NOT NULL,
+            model TEXT NOT NULL,
+            text_hash TEXT NOT NULL,
+            dim INTEGER NOT NULL,
+            vector BLOB NOT NULL,
+            PRIMARY KEY (rule_id, model)
+        )
     """)
     
     cursor.execute("""
-        CREATE TRIGGER IF NOT EXISTS templates_ad AFTER DELETE ON templates BEGIN
-            INSERT INTO templates_fts(templates_fts, rowid, title, category, content)
-            VALUES ('delete', old.id, old.title, old.category, old.content);
+        CREATE TRIGGER IF NOT EXISTS playbook_embeddings_ad AFTER DELETE ON playbook BEGIN
+            DELETE FROM playbook_embeddings WHERE rule_id = old.id;
         END
     """)
     
     cursor.execute("""
-        CREATE TRIGGER IF NOT EXISTS playbook_ai AFTER INSERT ON playbook BEGIN
-            INSERT INTO playbook_fts(rowid, rule_name, category, description, risk_level, keywords)
-            VALUES (new.id, new.rule_name, new.category, new.description, new.risk_level, new.keywords);
+        CREATE TABLE IF NOT EXISTS playbook_conditions (
+            id INTEGER PRIMARY KEY AUTOINCREMENT,
+            rule_id INTEGER NOT NULL,
+            group_no INTEGER NOT NULL DEFAULT 0,
+            field TEXT NOT NULL,
+            operator TEXT NOT NULL CHECK (operator IN ('<', '<=', '>', '>=', '=')),
+            threshold REAL NOT NULL,
+            unit TEXT NOT NULL CHECK (unit IN ('percent', 'month', 'yuan'))
+        )
+    """)
+    
+    cursor.execute("CREATE INDEX IF NOT EXISTS idx_playbook_conditions_rule ON playbook_conditions(rule_id)")
+    
+    cursor.execute("""
+        CREATE TRIGGER IF NOT EXISTS playbook_conditions_ad AFTER DELETE ON playbook BEGIN
+            DELETE FROM playbook_conditions WHERE rule_id = old.id;
         END
     """)
     
+    for event in ("INSERT", "UPDATE", "DELETE"):
+        cursor.execute(f"""
+            CREATE TRIGGER IF NOT EXISTS playbook_conditions_version_{event.lower()} AFTER {event} ON playbook_conditions BEGIN
+                UPDATE meta SET value = value + 1 WHERE key = 'playbook_version';
+            END
+        """)
+    
+    cursor.execute("""
+        CREATE TABLE IF NOT EXISTS embedding_cache (
+            model TEXT NOT NULL,
+            text_hash TEXT NOT NULL,
+            vector BLOB NOT NULL,
+            PRIMARY KEY (model, text_hash)
+        )
+    """)
+    
+    cursor.execute("""
+        CREATE TABLE IF NOT EXISTS llm_cache (
+            cache_key TEXT PRIMARY KEY,
+            result TEXT NOT NULL,
+            playbook_version INTEGER NOT NULL,
+            created_at REAL NOT NULL,
+            last_access REAL NOT NULL
+        )
+    """)
+    
+    cursor.execute("CREATE INDEX IF NOT EXISTS idx_llm_cache_last_access ON llm_cache(last_access)")
+    
+    # Contract texts, stored once per SHA-256 of their UTF-8 bytes; `size` is the uncompressed
+    # byte length. Rowid table so the content can be read through blob handles.
+    cursor.execute("""
+        CREATE TABLE IF NOT EXISTS documents (
+            hash TEXT PRIMARY KEY,
+            codec TEXT NOT NULL,
+            size INTEGER NOT NULL,
+            content BLOB NOT NULL,
+            created_at TIMESTAMP DEFAULT CURRENT_TIMESTAMP
+        )
+    """)
+    
+    # Results derived from a document alone (e.g. clause segmentation), memoized by its hash.
+    cursor.execute("""
+        CREATE TABLE IF NOT EXISTS document_artifacts (
+            hash TEXT NOT NULL,
+            kind TEXT NOT NULL,
+            codec TEXT NOT NULL,
+            content BLOB NOT NULL,
+            PRIMARY KEY (hash, kind)
+        ) WITHOUT ROWID
+    """)
+    
     cursor.execute("""
         CREATE TABLE IF NOT EXISTS tasks (
             task_id TEXT PRIMARY KEY,
             status TEXT NOT NULL DEFAULT 'pending',
-            original_text TEXT NOT NULL,
-            modified_text TEXT NOT NULL,
+            original_hash TEXT,
+            modified_hash TEXT,
             category TEXT,
-            differences TEXT,
-            evaluations TEXT,
-            human_reviews TEXT,
             final_report TEXT,
             error TEXT,
             created_at TIMESTAMP DEFAULT CURRENT_TIMESTAMP,
-            updated_at TIMESTAMP DEFAULT CURRENT_TIMESTAMP
+            updated_at TIMESTAMP DEFAULT CURRENT_TIMESTAMP,
+            attempts INTEGER NOT NULL DEFAULT 0,
+            available_at REAL,
+            lease_owner TEXT,
+            lease_expires_at REAL,
+            heartbeat_at REAL,
+            version INTEGER NOT NULL DEFAULT 0,
+            result_key TEXT,
+            cloned_from TEXT,
+            batch_id TEXT
         )
     """)
     
-    conn.commit()
+    migrate_task_columns(cursor)
+    migrate_task_documents(cursor)
+    
+    cursor.execute("CREATE INDEX IF NOT EXISTS idx_tasks_original_hash ON tasks(original_hash)")
+    cursor.execute("CREATE INDEX IF NOT EXISTS idx_tasks_modified_hash ON tasks(modified_hash)")
+    cursor.execute("CREATE INDEX IF NOT EXISTS idx_tasks_result_key ON tasks(result_key)")
+    cursor.execute("CREATE INDEX IF NOT EXISTS idx_tasks_batch ON tasks(batch_id, status)")
+    
+    cursor.execute("""
+        CREATE INDEX IF NOT EXISTS idx_tasks_queue ON tasks(status, available_at)
+    """)
+    
+    cursor.execute("""
+        CREATE TABLE IF NOT EXISTS task_differences (
+            task_id TEXT NOT NULL,
+            seq INTEGER NOT NULL,
+            difference TEXT NOT NULL,
+            PRIMARY KEY (task_id, seq)
+        ) WITHOUT ROWID
+    """)
+    
+    cursor.execute("""
+        CREATE TABLE IF NOT EXISTS task_evaluations (
+            task_id TEXT NOT NULL,
+            seq INTEGER NOT NULL,
+            review_round INTEGER NOT NULL DEFAULT 0,
+            evaluation TEXT NOT NULL,
+            PRIMARY KEY (task_id, seq)
+        ) WITHOUT ROWID
+    """)
+    
+    # Current evaluation per difference: the newest entry of the task_evaluations log, or the
+    # list last written by update_task_status / finish_task.
+    cursor.execute("""
+        CREATE TABLE IF NOT EXISTS task_evaluation_results (
+            task_id TEXT NOT NULL,
+            evaluation_id INTEGER NOT NULL,
+            risk_level TEXT,
+            evaluation TEXT NOT NULL,
+            PRIMARY KEY (task_id, evaluation_id)
+        ) WITHOUT ROWID
+    """)
+    
+    cursor.execute("""
+        CREATE INDEX IF NOT EXISTS idx_task_evaluation_results_risk
+        ON task_evaluation_results(task_id, risk_level)
+    """)
+    
+    cursor.execute("""
+        CREATE TABLE IF NOT EXISTS task_reviews (
+            task_id TEXT NOT NULL,
+            evaluation_id INTEGER NOT NULL,
+            approved INTEGER NOT NULL,
+            modified_suggestion TEXT,
+            comment TEXT,
+            PRIMARY KEY (task_id, evaluation_id)
+        ) WITHOUT ROWID
+    """)
+    
+    migrate_task_blobs(cursor)
+    
+    cursor.execute("""
+        CREATE TABLE IF NOT EXISTS batches (
+            batch_id TEXT PRIMARY KEY,
+            total INTEGER NOT NULL,
+            created_at TIMESTAMP DEFAULT CURRENT_TIMESTAMP
+        )
+    """)
+    
+    # One row per submitted pair. Identical pairs within a batch point at the same task.
+    cursor.execute("""
+        CREATE TABLE IF NOT EXISTS batch_items (
+            batch_id TEXT NOT NULL,
+            position INTEGER NOT NULL,
+            task_id TEXT NOT NULL,
+            reference TEXT,
+            PRIMARY KEY (batch_id, position)
+        ) WITHOUT ROWID
+    """)
     
     cursor.execute("SELECT COUNT(*) FROM templates")
     if cursor.fetchone()[0] == 0:
@@ -98,8 +393,90 @@ def init_db():
     if cursor.fetchone()[0] == 0:
         seed_playbook_data(cursor)
     
-    conn.commit()
-    conn.close()
+    cursor.execute("SELECT COUNT(*) FROM playbook_conditions")
+    if cursor.fetchone()[0] == 0:
+        seed_playbook_conditions(cursor)
+
+TASK_ADDED_COLUMNS = {
+    "attempts": "INTEGER NOT NULL DEFAULT 0",
+    "available_at": "REAL",
+    "lease_owner": "TEXT",
+    "lease_expires_at": "REAL",
+    "heartbeat_at": "REAL",
+    "version": "INTEGER NOT NULL DEFAULT 0",
+    "original_hash": "TEXT",
+    "modified_hash": "TEXT",
+    "result_key": "TEXT",
+    "cloned_from": "TEXT",
+    "batch_id": "TEXT",
+}
+
+def migrate_task_columns(cursor):
+    cursor.execute("PRAGMA table_info(tasks)")
+    existing = {row[1] for row in cursor.fetchall()}
+    
+    missing = [name for name in TASK_ADDED_COLUMNS if name not in existing]
+    for name in missing:
+        cursor.execute(f"ALTER TABLE tasks ADD COLUMN {name} {TASK_ADDED_COLUMNS[name]}")
+    
+    if "lease_expires_at" in missing:
+        # Rows left in_progress by a pre-queue process have no owner; expire them so they are reclaimed.
+        cursor.execute("UPDATE tasks SET lease_expires_at = 0 WHERE status = 'in_progress'")
+
+def migrate_task_documents(cursor):
+    # Tasks used to hold both contract texts inline; move them into documents, one row per task
+    # at a time so large texts are never all in memory.
+    cursor.execute("PRAGMA table_info(tasks)")
+    existing = {row[1] for row in cursor.fetchall()}
+    if "original_text" not in existing:
+        return
+    
+    task_ids = [row[0] for row in cursor.execute("SELECT task_id FROM tasks").fetchall()]
+    for task_id in task_ids:
+        row = cursor.execute(
+            "SELECT original_text, modified_text FROM tasks WHERE task_id = ?", (task_id,)
+        ).fetchone()
+        hashes = [store_document(cursor, text or "") for text in row]
+        cursor.execute(
+            "UPDATE tasks SET original_hash = ?, modified_hash = ? WHERE task_id = ?",
+            (*hashes, task_id)
+        )
+    
+    for name in TASK_TEXT_COLUMNS:
+        cursor.execute(f"ALTER TABLE tasks DROP COLUMN {name}")
+
+TASK_BLOB_COLUMNS = ("differences", "evaluations", "human_reviews")
+
+def migrate_task_blobs(cursor):
+    # Tasks used to keep these lists as JSON in their own row; move them into the child tables
+    # and drop the columns.
+    cursor.execute("PRAGMA table_info(tasks)")
+    existing = {row[1] for row in cursor.fetchall()}
+    columns = [name for name in TASK_BLOB_COLUMNS if name in existing]
+    if not columns:
+        return
+    
+    rows = cursor.execute(f"SELECT task_id, {', '.join(columns)} FROM tasks").fetchall()
+    for row in rows:
+        task_id = row[0]
+        children = {
+            name: json.loads(value)
+            for name, value in zip(columns, row[1:])
+            if value and json.loads(value)
+        }
+        
+        logged = cursor.execute("SELECT 1 FROM task_evaluations WHERE task_id = ? LIMIT 1", (task_id,)).fetchone()
+        if children.get("evaluations") and not logged:
+            cursor.executemany(
+                APPEND_TASK_EVALUATION_SQL,
+                [(task_id, task_id, 0, json.dumps(evaluation)) for evaluation in children["evaluations"]]
+            )
+        
+        for sql, params in task_child_writes(task_id, **children):
+            cursor.executemany(sql, params)
+    
+    for name in columns:
+        cursor.execute(f"ALTER TABLE tasks DROP COLUMN {name}")
 
 def seed_template_data(cursor):
     templates = [
@@ -313,142 +690,703 @@ def seed_playbook_data(cursor):
         playbook_rules
     )
 
+def seed_playbook_conditions(cursor):
+    # (rule description, group_no, field, operator, threshold, unit). Conditions sharing a
+    # group_no must all hold; any matching group triggers the rule.
+    conditions = [
+        ("预付款不超过合同金额的30%，验收款不超过60%，尾款不低于10%", 0, "预付款", "<=", 30, "percent"),
+        ("预付款不超过合同金额的30%，验收款不超过60%，尾款不低于10%", 0, "验收款", "<=", 60, "percent"),
+        ("预付款不超过合同金额的30%，验收款不超过60%，尾款不低于10%", 0, "尾款", ">=", 10, "percent"),
+        ("预付款超过40%或验收款超过70%", 0, "预付款", ">", 40, "percent"),
+        ("预付款超过40%或验收款超过70%", 1, "验收款", ">", 70, "percent"),
+        ("违约金不超过合同金额的20%", 0, "违约金", "<=", 20, "percent"),
+        ("违约金超过合同金额的30%", 0, "违约金", ">", 30, "percent"),
+        ("质保期不少于12个月", 0, "质保期|保修期|质保", ">=", 12, "month"),
+        ("质保期少于6个月", 0, "质保期|保修期|质保", "<", 6, "month"),
+        ("竞业限制期限不超过2年", 0, "竞业限制|竞业", "<=", 24, "month"),
+        ("竞业限制期限超过3年或无补偿", 0, "竞业限制|竞业", ">", 36, "month"),
+        ("押金不超过2个月租金", 0, "押金", "<=", 2, "month"),
+        ("押金超过3个月租金", 0, "押金", ">", 3, "month"),
+        ("保密期限不超过劳动关系解除后2年", 0, "保密期限|保密期|保密义务", "<=", 24, "month"),
+        ("保密期限为永久或过长", 0, "保密期限|保密期|保密义务", ">", 24, "month"),
+    ]
+    
+    cursor.execute("SELECT id, description FROM playbook")
+    rule_ids = {row[1]: row[0] for row in cursor.fetchall()}
+    
+    cursor.executemany(
+        "INSERT INTO playbook_conditions (rule_id, group_no, field, operator, threshold, unit) VALUES (?, ?, ?, ?, ?, ?)",
+        [(rule_ids[description], *rest) for description, *rest in conditions if description in rule_ids]
+    )
+
 def escape_fts_query(query: str) -> str:
-    import re
-    query = re.sub(r'[^\w\s\u4e00-\u9fff]', ' ', query)
-    words = query.split()
-    if not words:
+    return build_match_query(query) or '"*"'
+
+# Query bigrams present in more than COMMON_TERM_RATIO of a large table carry almost no BM25
+# weight but dominate the cost of scoring, so they are dropped from the MATCH expression.
+COMMON_TERM_RATIO = 0.1
+COMMON_TERM_MIN_DOCS = 1000
+
+def term_stats_sql(table: str, tokens: list) -> str:
+    placeholders = ", ".join("?" * len(tokens))
+    return f"""
+        SELECT term, doc, (SELECT COUNT(*) FROM {table}) AS total
+        FROM {table}_fts_vocab WHERE term IN ({placeholders})
+    """
+
+def select_query_terms(tokens: list, doc_freq: dict, total_docs: int) -> str:
+    present = [token for token in tokens if token in doc_freq]
+    if not present:
         return '"*"'
-    return ' OR '.join(f'"{w}"' for w in words[:10])
+    
+    limit = max(total_docs * COMMON_TERM_RATIO, COMMON_TERM_MIN_DOCS)
+    selective = [token for token in present if doc_freq[token] <= limit] or [min(present, key=doc_freq.get)]
+    return " OR ".join(f'"{token}"' for token in selective)
 
-def search_templates(query: str, top_k: int = 3) -> list:
-    db_path = get_db_path()
-    conn = sqlite3.connect(db_path)
-    conn.row_factory = sqlite3.Row
-    cursor = conn.cursor()
+def term_stats(rows: list) -> tuple:
+    return {row[0]: row[1] for row in rows}, (rows[0][2] if rows else 0)
+
+def build_fts_query(conn: sqlite3.Connection, table: str, query: str) -> str:
+    tokens = list(dict.fromkeys(tokenize(query)))
+    if not tokens:
+        return '"*"'
+    rows = conn.execute(term_stats_sql(table, tokens), tokens).fetchall()
+    return select_query_terms(tokens, *term_stats(rows))
+
+async def async_build_fts_query(conn: aiosqlite.Connection, table: str, query: str) -> str:
+    tokens = list(dict.fromkeys(tokenize(query)))
+    if not tokens:
+        return '"*"'
+    rows = await conn.execute_fetchall(term_stats_sql(table, tokens), tokens)
+    return select_query_terms(tokens, *term_stats(rows))
+
+def build_fts_queries(conn: sqlite3.Connection, table: str, queries: list) -> list:
+    token_lists = [list(dict.fromkeys(tokenize(query))) for query in queries]
+    vocabulary = list(dict.fromkeys(token for tokens in token_lists for token in tokens))
     
-    fts_query = escape_fts_query(query)
+    rows = []
+    for start in range(0, len(vocabulary), SQL_VARIABLE_CHUNK):
+        chunk = vocabulary[start:start + SQL_VARIABLE_CHUNK]
+        rows.extend(conn.execute(term_stats_sql(table, chunk), chunk).fetchall())
+    doc_freq, total_docs = term_stats(rows)
     
-    cursor.execute("""
-        SELECT t.* FROM templates t
-        JOIN templates_fts fts ON t.id = fts.rowid
-        WHERE templates_fts MATCH ?
-        ORDER BY rank
-        LIMIT ?
-    """, (fts_query, top_k))
-    
-    results = [dict(row) for row in cursor.fetchall()]
-    conn.close()
-    return results
+    return [select_query_terms(tokens, doc_freq, total_docs) if tokens else '"*"' for tokens in token_lists]
+
+TEMPLATES_BM25 = "bm25(templates_fts, 4.0, 1.0, 1.0)"
+PLAYBOOK_BM25 = "bm25(playbook_fts, 4.0, 1.0, 2.0, 0.0, 3.0)"
+
+SEARCH_TEMPLATES_SQL = f"""
+    SELECT t.* FROM templates_fts fts
+    JOIN templates t ON t.id = fts.rowid
+    WHERE templates_fts MATCH ?
+    ORDER BY {TEMPLATES_BM25}
+    LIMIT ?
+"""
+
+SEARCH_PLAYBOOK_SQL = f"""
+    SELECT p.* FROM playbook_fts fts
+    JOIN playbook p ON p.id = fts.rowid
+    WHERE playbook_fts MATCH ?
+    ORDER BY {PLAYBOOK_BM25}
+    LIMIT ?
+"""
+
+SEARCH_PLAYBOOK_BY_CATEGORY_SQL = f"""
+    SELECT p.* FROM playbook_fts fts
+    JOIN playbook p ON p.id = fts.rowid
+    WHERE playbook_fts MATCH ? AND p.category = ?
+    ORDER BY {PLAYBOOK_BM25}
+    LIMIT ?
+"""
 
-def search_playbook(query: str, category: str = None, top_k: int = 5) -> list:
-    db_path = get_db_path()
-    conn = sqlite3.connect(db_path)
-    conn.row_factory = sqlite3.Row
-    cursor = conn.cursor()
+def search_templates(query: str, top_k: int = 3) -> list:
+    conn = get_connection()
+    fts_query = build_fts_query(conn, "templates", query)
     
-    fts_query = escape_fts_query(query)
+    rows = conn.execute(SEARCH_TEMPLATES_SQL, (fts_query, top_k)).fetchall()
+    return [dict(row) for row in rows]
+
+def search_playbook(query: str, category: str = None, top_k: int = 5) -> list:
+    conn = get_connection()
+    fts_query = build_fts_query(conn, "playbook", query)
     
     if category:
-        cursor.execute("""
-            SELECT p.* FROM playbook p
-            JOIN playbook_fts fts ON p.id = fts.rowid
-            WHERE playbook_fts MATCH ? AND p.category = ?
-            ORDER BY rank
-            LIMIT ?
-        """, (fts_query, category, top_k))
+        rows = conn.execute(SEARCH_PLAYBOOK_BY_CATEGORY_SQL, (fts_query, category, top_k)).fetchall()
     else:
-        cursor.execute("""
-            SELECT p.* FROM playbook p
-            JOIN playbook_fts fts ON p.id = fts.rowid
-            WHERE playbook_fts MATCH ?
-            ORDER BY rank
-            LIMIT ?
-        """, (fts_query, top_k))
-    
-    results = [dict(row) for row in cursor.fetchall()]
-    conn.close()
+        rows = conn.execute(SEARCH_PLAYBOOK_SQL, (fts_query, top_k)).fetchall()
+    
+    return [dict(row) for row in rows]
+
+SEARCH_PLAYBOOK_BATCH_SQL = f"""
+    WITH queries(query_id, fts_query) AS (VALUES {{values}}),
+    scored AS (
+        SELECT queries.query_id, p.id AS rule_id, {PLAYBOOK_BM25} AS score
+        FROM queries
+        JOIN playbook_fts ON playbook_fts MATCH queries.fts_query
+        JOIN playbook p ON p.id = playbook_fts.rowid
+        {{category_filter}}
+    ),
+    ranked AS (
+        SELECT query_id, rule_id, ROW_NUMBER() OVER (PARTITION BY query_id ORDER BY score) AS position
+        FROM scored
+    )
+    SELECT ranked.query_id, p.* FROM ranked
+    JOIN playbook p ON p.id = ranked.rule_id
+    WHERE ranked.position <= ?
+    ORDER BY ranked.query_id, ranked.position
+"""
+
+def search_playbook_batch(queries: list, category: str = None, top_k: int = 5) -> list:
+    # Top-k rules for every query in one statement: the queries are bound as a VALUES table
+    # and each row drives its own FTS5 MATCH, ranked per query with a window function.
+    if not queries:
+        return []
+    
+    conn = get_connection()
+    fts_queries = build_fts_queries(conn, "playbook", queries)
+    results = [[] for _ in queries]
+    
+    chunk_size = SQL_VARIABLE_CHUNK // 2
+    for start in range(0, len(fts_queries), chunk_size):
+        chunk = fts_queries[start:start + chunk_size]
+        sql = SEARCH_PLAYBOOK_BATCH_SQL.format(
+            values=", ".join("(?, ?)" for _ in chunk),
+            category_filter="WHERE p.category = ?" if category else ""
+        )
+        params = [value for i, fts_query in enumerate(chunk) for value in (start + i, fts_query)]
+        params += [category, top_k] if category else [top_k]
+        
+        for row in conn.execute(sql, params):
+            rule = dict(row)
+            results[rule.pop("query_id")].append(rule)
     return results
 
 def get_all_playbook_rules(category: str = None) -> list:
-    db_path = get_db_path()
-    conn = sqlite3.connect(db_path)
-    conn.row_factory = sqlite3.Row
-    cursor = conn.cursor()
+    conn = get_connection()
     
     if category:
-        cursor.execute("SELECT * FROM playbook WHERE category = ?", (category,))
+        rows = conn.execute("SELECT * FROM playbook WHERE category = ?", (category,)).fetchall()
     else:
-        cursor.execute("SELECT * FROM playbook")
+        rows = conn.execute("SELECT * FROM playbook").fetchall()
     
-    results = [dict(row) for row in cursor.fetchall()]
-    conn.close()
+    return [dict(row) for row in rows]
+
+SQL_VARIABLE_CHUNK = 500
+
+def get_meta_value(key: str) -> int:
+    row = get_connection().execute("SELECT value FROM meta WHERE key = ?", (key,)).fetchone()
+    return row[0] if row else 0
+
+def get_playbook_conditions() -> list:
+    rows = get_connection().execute(
+        "SELECT rule_id, group_no, field, operator, threshold, unit FROM playbook_conditions ORDER BY rule_id, group_no, id"
+    ).fetchall()
+    return [dict(row) for row in rows]
+
+def get_playbook_version() -> int:
+    return get_meta_value("playbook_version")
+
+def get_templates_version() -> int:
+    return get_meta_value("templates_version")
+
+def get_template_texts() -> list:
+    rows = get_connection().execute("SELECT id, title, content FROM templates ORDER BY id").fetchall()
+    return [dict(row) for row in rows]
+
+def get_templates_by_ids(template_ids: list) -> list:
+    conn = get_connection()
+    found = {}
+    for start in range(0, len(template_ids), SQL_VARIABLE_CHUNK):
+        chunk = list(template_ids[start:start + SQL_VARIABLE_CHUNK])
+        placeholders = ", ".join("?" * len(chunk))
+        for row in conn.execute(f"SELECT * FROM templates WHERE id IN ({placeholders})", chunk):
+            found[row["id"]] = dict(row)
+    return [found[template_id] for template_id in template_ids if template_id in found]
+
+def get_playbook_embeddings(model: str) -> dict:
+    rows = get_connection().execute(
+        "SELECT rule_id, text_hash, dim, vector FROM playbook_embeddings WHERE model = ?",
+        (model,)
+    ).fetchall()
+    return {row["rule_id"]: dict(row) for row in rows}
+
+def save_playbook_embeddings(model: str, entries: list) -> None:
+    with transaction() as conn:
+        conn.executemany("""
+            INSERT OR REPLACE INTO playbook_embeddings (rule_id, model, text_hash, dim, vector)
+            VALUES (?, ?, ?, ?, ?)
+        """, [(e["rule_id"], model, e["text_hash"], e["dim"], e["vector"]) for e in entries])
+
+def get_cached_embeddings(model: str, text_hashes: list) -> dict:
+    conn = get_connection()
+    results = {}
+    for start in range(0, len(text_hashes), SQL_VARIABLE_CHUNK):
+        chunk = text_hashes[start:start + SQL_VARIABLE_CHUNK]
+        placeholders = ", ".join("?" * len(chunk))
+        rows = conn.execute(
+            f"SELECT text_hash, vector FROM embedding_cache WHERE model = ? AND text_hash IN ({placeholders})",
+            [model] + chunk
+        ).fetchall()
+        results.update({row["text_hash"]: row["vector"] for row in rows})
     return results
 
-import json
+def put_cached_embeddings(model: str, entries: list) -> None:
+    with transaction() as conn:
+        conn.executemany(
+            "INSERT OR REPLACE INTO embedding_cache (model, text_hash, vector) VALUES (?, ?, ?)",
+            [(model, text_hash, vector) for text_hash, vector in entries]
+        )
 
-def save_task(task_id: str, task_data: dict) -> None:
-    db_path = get_db_path()
-    conn = sqlite3.connect(db_path)
-    cursor = conn.cursor()
+def get_llm_cache_entry(cache_key: str) -> Optional[dict]:
+    row = get_connection().execute(
+        "SELECT result, playbook_version, created_at FROM llm_cache WHERE cache_key = ?",
+        (cache_key,)
+    ).fetchone()
+    if not row:
+        return None
     
-    cursor.execute("""
-        INSERT OR REPLACE INTO tasks 
-        (task_id, status, original_text, modified_text, category, 
-         differences, evaluations, human_reviews, final_report, error, updated_at)
-        VALUES (?, ?, ?, ?, ?, ?, ?, ?, ?, ?, CURRENT_TIMESTAMP)
-    """, (
+    entry = dict(row)
+    entry["result"] = json.loads(entry["result"])
+    return entry
+
+def touch_llm_cache_entry(cache_key: str) -> None:
+    get_connection().execute(
+        "UPDATE llm_cache SET last_access = ? WHERE cache_key = ?",
+        (time.time(), cache_key)
+    )
+
+def put_llm_cache_entry(cache_key: str, result: dict, playbook_version: int) -> None:
+    now = time.time()
+    get_connection().execute("""
+        INSERT OR REPLACE INTO llm_cache (cache_key, result, playbook_version, created_at, last_access)
+        VALUES (?, ?, ?, ?, ?)
+    """, (cache_key, json.dumps(result, ensure_ascii=False), playbook_version, now, now))
+
+def delete_llm_cache_entry(cache_key: str) -> None:
+    get_connection().execute("DELETE FROM llm_cache WHERE cache_key = ?", (cache_key,))
+
+def purge_llm_cache(playbook_version: int = None, created_before: float = None) -> int:
+    conditions = []
+    params = []
+    if playbook_version is not None:
+        conditions.append("playbook_version != ?")
+        params.append(playbook_version)
+    if created_before is not None:
+        conditions.append("created_at < ?")
+        params.append(created_before)
+    
+    where = f" WHERE {' OR '.join(conditions)}" if conditions else ""
+    return get_connection().execute(f"DELETE FROM llm_cache{where}", params).rowcount
+
+def evict_llm_cache(max_entries: int) -> int:
+    conn = get_connection()
+    count = conn.execute("SELECT COUNT(*) FROM llm_cache").fetchone()[0]
+    if count <= max_entries:
+        return 0
+    
+    return conn.execute("""
+        DELETE FROM llm_cache WHERE cache_key IN (
+            SELECT cache_key FROM llm_cache ORDER BY last_access LIMIT ?
+        )
+    """, (count - max_entries,)).rowcount
+
+# `version` goes up with every change a client can see (status, report, error, child rows) but
+# not with lease heartbeats, so pollers can compare it instead of the task itself.
+SAVE_TASK_SQL = """
+    INSERT OR REPLACE INTO tasks 
+    (task_id, status, original_hash, modified_hash, category, final_report, error, result_key, batch_id,
+     updated_at, version)
+    VALUES (?, ?, ?, ?, ?, ?, ?, ?, ?, CURRENT_TIMESTAMP,
+            COALESCE((SELECT version FROM tasks WHERE task_id = ?1), 0) + 1)
+"""
+
+BUMP_TASK_VERSION_SQL = "UPDATE tasks SET version = version + 1 WHERE task_id = ?"
+
+GET_TASK_SQL = "SELECT * FROM tasks WHERE task_id = ?"
+GET_TASK_STATUS_SQL = "SELECT status FROM tasks WHERE task_id = ?"
+GET_TASK_STATE_SQL = "SELECT status, version FROM tasks WHERE task_id = ?"
+
+def task_params(task_id: str, task_data: dict, original_hash: str, modified_hash: str) -> tuple:
+    return (
         task_id,
         task_data.get("status", "pending"),
-        task_data.get("original_text", ""),
-        task_data.get("modified_text", ""),
+        original_hash,
+        modified_hash,
         task_data.get("category"),
-        json.dumps(task_data.get("differences", [])),
-        json.dumps(task_data.get("evaluations", [])),
-        json.dumps(task_data.get("human_reviews", [])),
         task_data.get("final_report"),
-        task_data.get("error")
-    ))
-    
-    conn.commit()
-    conn.close()
+        task_data.get("error"),
+        task_data.get("result_key"),
+        task_data.get("batch_id")
+    )
+
+TASK_TEXT_COLUMNS = ("original_text", "modified_text")
+TASK_DOCUMENT_COLUMNS = {"original_text": "original_hash", "modified_text": "modified_hash"}
+TEXT_CHUNK_SIZE = 1 << 20
+
+DOCUMENT_EXISTS_SQL = "SELECT 1 FROM documents WHERE hash = ?"
+INSERT_DOCUMENT_SQL = "INSERT OR IGNORE INTO documents (hash, codec, size, content) VALUES (?, ?, ?, ?)"
+GET_DOCUMENT_SQL = "SELECT codec, content FROM documents WHERE hash = ?"
+
+def document_hash(text: str) -> str:
+    return hashlib.sha256(text.encode("utf-8")).hexdigest()
+
+def encode_document(data: bytes) -> tuple:
+    # (codec, content). Small payloads are not worth a codec round trip.
+    documents_config = get_config().get("documents", {})
+    codec = resolve_codec(documents_config.get("compression", "zstd"))
+    if codec == "none" or len(data) < documents_config.get("min_size", 4096):
+        return "none", data
+    return codec, compress(data, codec, documents_config.get("level", 3))
+
+def document_row(digest: str, text: str) -> tuple:
+    data = text.encode("utf-8")
+    codec, content = encode_document(data)
+    return (digest, codec, len(data), content)
+
+def decode_document(codec: str, content: bytes) -> str:
+    return decompress(content, codec).decode("utf-8")
+
+def store_document(conn, text: str) -> str:
+    # Identical texts share one row; only a text seen for the first time is compressed.
+    digest = document_hash(text)
+    if conn.execute(DOCUMENT_EXISTS_SQL, (digest,)).fetchone() is None:
+        conn.execute(INSERT_DOCUMENT_SQL, document_row(digest, text))
+    return digest
+
+def prepare_documents(texts: list) -> tuple:
+    # (hashes, rows to insert). Compression happens here, before the write transaction opens.
+    conn = get_connection()
+    hashes = [document_hash(text) for text in texts]
+    rows = [
+        document_row(digest, text) for text, digest in zip(texts, hashes)
+        if conn.execute(DOCUMENT_EXISTS_SQL, (digest,)).fetchone() is None
+    ]
+    return hashes, rows
+
+def save_documents(texts: list) -> tuple:
+    # (hashes, hashes of the documents this call stored for the first time).
+    hashes, documents = prepare_documents(texts)
+    with transaction() as conn:
+        conn.executemany(INSERT_DOCUMENT_SQL, documents)
+    return hashes, [row[0] for row in documents]
+
+def delete_unreferenced_documents(hashes: list) -> int:
+    # Drops stored texts no task points at, e.g. those of a batch rejected half way through.
+    params = [(digest,) for digest in set(hashes)]
+    with transaction() as conn:
+        conn.executemany("""
+            DELETE FROM document_artifacts WHERE hash = ?1
+            AND NOT EXISTS (SELECT 1 FROM tasks WHERE original_hash = ?1)
+            AND NOT EXISTS (SELECT 1 FROM tasks WHERE modified_hash = ?1)
+        """, params)
+        cursor = conn.executemany("""
+            DELETE FROM documents WHERE hash = ?1
+            AND NOT EXISTS (SELECT 1 FROM tasks WHERE original_hash = ?1)
+            AND NOT EXISTS (SELECT 1 FROM tasks WHERE modified_hash = ?1)
+        """, params)
+        return cursor.rowcount
+
+def get_document(digest: str) -> Optional[str]:
+    row = get_connection().execute(GET_DOCUMENT_SQL, (digest,)).fetchone()
+    return decode_document(row[0], row[1]) if row else None
+
+def is_document_shared(digest: str) -> bool:
+    row = get_connection().execute("""
+        SELECT COUNT(*) FROM (
+            SELECT 1 FROM tasks WHERE original_hash = ?1
+            UNION ALL
+            SELECT 1 FROM tasks WHERE modified_hash = ?1
+            LIMIT 2
+        )
+    """, (digest,)).fetchone()
+    return row[0] > 1
+
+def get_document_artifact(digest: str, kind: str) -> Optional[bytes]:
+    row = get_connection().execute(
+        "SELECT codec, content FROM document_artifacts WHERE hash = ? AND kind = ?", (digest, kind)
+    ).fetchone()
+    return decompress(row[1], row[0]) if row else None
+
+def put_document_artifact(digest: str, kind: str, data: bytes) -> None:
+    codec, content = encode_document(data)
+    get_connection().execute(
+        "INSERT OR REPLACE INTO document_artifacts (hash, kind, codec, content) VALUES (?, ?, ?, ?)",
+        (digest, kind, codec, content)
+    )
+
+GET_TASK_DIFFERENCES_SQL = "SELECT difference FROM task_differences WHERE task_id = ? ORDER BY seq"
+INSERT_TASK_DIFFERENCE_SQL = "INSERT OR REPLACE INTO task_differences (task_id, seq, difference) VALUES (?, ?, ?)"
+
+# Evaluations are appended as the evaluator decides them; seq numbers start at 1 so a cursor of
+# 0 means "from the beginning".
+APPEND_TASK_EVALUATION_SQL = """
+    INSERT INTO task_evaluations (task_id, seq, review_round, evaluation)
+    VALUES (?, (SELECT COALESCE(MAX(seq), 0) + 1 FROM task_evaluations WHERE task_id = ?), ?, ?)
+"""
+
+GET_TASK_EVALUATIONS_SQL = """
+    SELECT seq, review_round, evaluation FROM task_evaluations
+    WHERE task_id = ? AND seq > ? ORDER BY seq LIMIT ?
+"""
+
+# Rewrites a result only when it changed, so storing the final list after the evaluator already
+# logged each item touches no rows.
+UPSERT_EVALUATION_RESULT_SQL = """
+    INSERT INTO task_evaluation_results (task_id, evaluation_id, risk_level, evaluation)
+    VALUES (?, ?, ?, ?)
+    ON CONFLICT (task_id, evaluation_id) DO UPDATE
+    SET risk_level = excluded.risk_level, evaluation = excluded.evaluation
+    WHERE evaluation IS NOT excluded.evaluation
+"""
+
+GET_EVALUATION_RESULTS_SQL = """
+    SELECT evaluation FROM task_evaluation_results WHERE task_id = ? ORDER BY evaluation_id
+"""
+
+GET_EVALUATION_RESULTS_BY_RISK_SQL = """
+    SELECT evaluation FROM task_evaluation_results
+    WHERE task_id = ? AND risk_level = ? ORDER BY evaluation_id
+"""
+
+COUNT_RISK_LEVELS_SQL = """
+    SELECT risk_level, COUNT(*) FROM task_evaluation_results WHERE task_id = ? GROUP BY risk_level
+"""
+
+GET_TASK_REVIEWS_SQL = """
+    SELECT evaluation_id, approved, modified_suggestion, comment FROM task_reviews
+    WHERE task_id = ? ORDER BY evaluation_id
+"""
+
+def evaluation_result_params(task_id: str, evaluation: dict) -> tuple:
+    return (task_id, evaluation["id"], evaluation.get("risk_level"), json.dumps(evaluation))
+
+def task_child_writes(task_id: str, **kwargs) -> list:
+    # (sql, rows) pairs that replace the child rows of each list passed in kwargs.
+    writes = []
+    if "differences" in kwargs:
+        writes.append(("DELETE FROM task_differences WHERE task_id = ?", [(task_id,)]))
+        writes.append((
+            INSERT_TASK_DIFFERENCE_SQL,
+            [(task_id, seq, json.dumps(diff)) for seq, diff in enumerate(kwargs["differences"])]
+        ))
+    if "evaluations" in kwargs:
+        evaluations = kwargs["evaluations"]
+        writes.append((
+            "DELETE FROM task_evaluation_results WHERE task_id = ? "
+            "AND evaluation_id NOT IN (SELECT value FROM json_each(?))",
+            [(task_id, json.dumps([evaluation["id"] for evaluation in evaluations]))]
+        ))
+        writes.append((
+            UPSERT_EVALUATION_RESULT_SQL,
+            [evaluation_result_params(task_id, evaluation) for evaluation in evaluations]
+        ))
+    if "human_reviews" in kwargs:
+        writes.append(("DELETE FROM task_reviews WHERE task_id = ?", [(task_id,)]))
+        writes.append((
+            "INSERT OR REPLACE INTO task_reviews "
+            "(task_id, evaluation_id, approved, modified_suggestion, comment) VALUES (?, ?, ?, ?, ?)",
+            [
+                (task_id, review["evaluation_id"], int(bool(review.get("approved"))),
+                 review.get("modified_suggestion"), review.get("comment"))
+                for review in kwargs["human_reviews"]
+            ]
+        ))
+    return writes
+
+def task_children(task_data: dict) -> dict:
+    return {name: task_data.get(name, []) for name in TASK_BLOB_COLUMNS}
+
+def decode_evaluation_rows(rows) -> list:
+    return [
+        {"seq": row[0], "review_round": row[1], "evaluation": json.loads(row[2])}
+        for row in rows
+    ]
+
+def decode_review_rows(rows) -> list:
+    return [
+        {"evaluation_id": row[0], "approved": bool(row[1]), "modified_suggestion": row[2], "comment": row[3]}
+        for row in rows
+    ]
+
+def save_task(task_id: str, task_data: dict) -> None:
+    hashes, documents = prepare_documents([task_data.get(column) or "" for column in TASK_TEXT_COLUMNS])
+    with transaction() as conn:
+        conn.executemany(INSERT_DOCUMENT_SQL, documents)
+        conn.execute(SAVE_TASK_SQL, task_params(task_id, task_data, *hashes))
+        for sql, params in task_child_writes(task_id, **task_children(task_data)):
+            conn.executemany(sql, params)
 
 def get_task(task_id: str) -> Optional[dict]:
-    db_path = get_db_path()
-    conn = sqlite3.connect(db_path)
-    conn.row_factory = sqlite3.Row
-    cursor = conn.cursor()
-    
-    cursor.execute("SELECT * FROM tasks WHERE task_id = ?", (task_id,))
-    row = cursor.fetchone()
-    conn.close()
-    
-    if not row:
+    row = get_connection().execute(GET_TASK_SQL, (task_id,)).fetchone()
+    if row is None:
         return None
-    
     task = dict(row)
-    task["differences"] = json.loads(task.get("differences", "[]"))
-    task["evaluations"] = json.loads(task.get("evaluations", "[]"))
-    task["human_reviews"] = json.loads(task.get("human_reviews", "[]"))
+    for column, hash_column in TASK_DOCUMENT_COLUMNS.items():
+        task[column] = get_document(task[hash_column]) or ""
+    task["differences"] = get_task_differences(task_id)
+    task["evaluations"] = get_task_evaluation_results(task_id)
+    task["human_reviews"] = get_task_reviews(task_id)
     return task
 
-def update_task_status(task_id: str, status: str, **kwargs) -> None:
-    db_path = get_db_path()
-    conn = sqlite3.connect(db_path)
-    cursor = conn.cursor()
+# An analysis can be handed to an identical request only while no reviewer has touched it.
+REUSABLE_TASK_CONDITION = """
+    status IN ('completed', 'waiting_human')
+    AND NOT EXISTS (SELECT 1 FROM task_reviews r WHERE r.task_id = tasks.task_id)
+"""
+
+FIND_REUSABLE_TASK_SQL = f"""
+    SELECT task_id FROM tasks
+    WHERE result_key = ? AND created_at >= datetime('now', ?) AND {REUSABLE_TASK_CONDITION}
+    ORDER BY created_at DESC LIMIT 1
+"""
+
+CLONE_TASK_SQL = f"""
+    INSERT INTO tasks
+    (task_id, status, original_hash, modified_hash, category, final_report, result_key, cloned_from, version)
+    SELECT ?1, status, original_hash, modified_hash, category, final_report, result_key, task_id, 1
+    FROM tasks WHERE task_id = ?2 AND {REUSABLE_TASK_CONDITION}
+"""
+
+CLONE_TASK_CHILDREN_SQL = (
+    "INSERT INTO task_differences (task_id, seq, difference) "
+    "SELECT ?1, seq, difference FROM task_differences WHERE task_id = ?2",
+    "INSERT INTO task_evaluations (task_id, seq, review_round, evaluation) "
+    "SELECT ?1, seq, review_round, evaluation FROM task_evaluations WHERE task_id = ?2",
+    "INSERT INTO task_evaluation_results (task_id, evaluation_id, risk_level, evaluation) "
+    "SELECT ?1, evaluation_id, risk_level, evaluation FROM task_evaluation_results WHERE task_id = ?2",
+)
+
+def find_reusable_task(result_key: str, max_age_seconds: float) -> Optional[str]:
+    row = get_connection().execute(
+        FIND_REUSABLE_TASK_SQL, (result_key, f"-{int(max_age_seconds)} seconds")
+    ).fetchone()
+    return row[0] if row else None
+
+def clone_task(source_task_id: str, task_id: str) -> Optional[str]:
+    # Copies the source's analysis into a new task and returns its status, or None if the source
+    # stopped being reusable (e.g. a review was submitted) since it was looked up.
+    with transaction() as conn:
+        if conn.execute(CLONE_TASK_SQL, (task_id, source_task_id)).rowcount == 0:
+            return None
+        for sql in CLONE_TASK_CHILDREN_SQL:
+            conn.execute(sql, (task_id, source_task_id))
+    return get_task_status(task_id)
+
+def get_task_status(task_id: str) -> Optional[str]:
+    row = get_connection().execute(GET_TASK_STATUS_SQL, (task_id,)).fetchone()
+    return row[0] if row else None
+
+def get_task_state(task_id: str) -> Optional[dict]:
+    row = get_connection().execute(GET_TASK_STATE_SQL, (task_id,)).fetchone()
+    return dict(row) if row else None
+
+def get_task_texts(task_id: str) -> tuple:
+    row = get_connection().execute(
+        "SELECT original_hash, modified_hash FROM tasks WHERE task_id = ?", (task_id,)
+    ).fetchone()
+    return (get_document(row[0]) or "", get_document(row[1]) or "") if row else ("", "")
+
+def get_task_text_sizes(task_id: str) -> dict:
+    # Uncompressed byte sizes as recorded with the documents, without reading the texts.
+    rows = get_connection().execute("""
+        SELECT 'original_text', d.size FROM tasks t JOIN documents d ON d.hash = t.original_hash
+        WHERE t.task_id = ?1
+        UNION ALL
+        SELECT 'modified_text', d.size FROM tasks t JOIN documents d ON d.hash = t.modified_hash
+        WHERE t.task_id = ?1
+    """, (task_id,)).fetchall()
+    sizes = {column: 0 for column in TASK_TEXT_COLUMNS}
+    sizes.update({row[0]: row[1] for row in rows})
+    return sizes
+
+def iter_task_text(task_id: str, column: str, chunk_size: int = TEXT_CHUNK_SIZE):
+    # Yields the stored text in decoded chunks. Each chunk opens its own short-lived blob
+    # handle, so no read transaction stays open while the caller works on the previous one;
+    # compressed documents are inflated page by page.
+    if column not in TASK_TEXT_COLUMNS:
+        raise ValueError(f"Not a task text column: {column}")
     
-    update_fields = ["status = ?", "updated_at = CURRENT_TIMESTAMP"]
-    params = [status]
+    conn = get_connection()
+    row = conn.execute(f"""
+        SELECT d.rowid, d.codec FROM tasks t JOIN documents d ON d.hash = t.{TASK_DOCUMENT_COLUMNS[column]}
+        WHERE t.task_id = ?
+    """, (task_id,)).fetchone()
+    if row is None:
+        return
+    
+    inflater = decompressor(row[1])
+    decoder = codecs.getincrementaldecoder("utf-8")(errors="replace")
+    offset = 0
+    while True:
+        with conn.blobopen("documents", "content", row[0], readonly=True) as blob:
+            blob.seek(offset)
+            data = blob.read(chunk_size)
+        if not data:
+            break
+        offset += len(data)
+        text = decoder.decode(inflater.decompress(data))
+        if text:
+            yield text
+    
+    tail = decoder.decode(b"", final=True)
+    if tail:
+        yield tail
+
+def read_task_text_head(task_id: str, column: str, chars: int) -> str:
+    # UTF-8 needs at most 4 bytes per character.
+    return next(iter_task_text(task_id, column, chunk_size=chars * 4), "")[:chars]
+
+def append_task_differences(task_id: str, start_seq: int, differences: list) -> None:
+    with transaction() as conn:
+        conn.executemany(
+            INSERT_TASK_DIFFERENCE_SQL,
+            [(task_id, start_seq + offset, json.dumps(diff)) for offset, diff in enumerate(differences)]
+        )
+        conn.execute(BUMP_TASK_VERSION_SQL, (task_id,))
+
+def get_task_differences(task_id: str) -> list:
+    rows = get_connection().execute(GET_TASK_DIFFERENCES_SQL, (task_id,)).fetchall()
+    return [json.loads(row[0]) for row in rows]
+
+def delete_task_differences(task_id: str) -> None:
+    with transaction() as conn:
+        conn.execute("DELETE FROM task_differences WHERE task_id = ?", (task_id,))
+        conn.execute(BUMP_TASK_VERSION_SQL, (task_id,))
+
+def append_task_evaluations(task_id: str, review_round: int, evaluations: list) -> None:
+    with transaction() as conn:
+        conn.executemany(
+            APPEND_TASK_EVALUATION_SQL,
+            [(task_id, task_id, review_round, json.dumps(evaluation)) for evaluation in evaluations]
+        )
+        conn.executemany(
+            UPSERT_EVALUATION_RESULT_SQL,
+            [evaluation_result_params(task_id, evaluation) for evaluation in evaluations]
+        )
+        conn.execute(BUMP_TASK_VERSION_SQL, (task_id,))
+
+def get_task_evaluations(task_id: str, after_seq: int = 0, limit: int = -1) -> list:
+    rows = get_connection().execute(GET_TASK_EVALUATIONS_SQL, (task_id, after_seq, limit)).fetchall()
+    return decode_evaluation_rows(rows)
+
+def get_task_evaluation_results(task_id: str, risk_level: str = None) -> list:
+    if risk_level:
+        rows = get_connection().execute(GET_EVALUATION_RESULTS_BY_RISK_SQL, (task_id, risk_level)).fetchall()
+    else:
+        rows = get_connection().execute(GET_EVALUATION_RESULTS_SQL, (task_id,)).fetchall()
+    return [json.loads(row[0]) for row in rows]
+
+def count_task_risk_levels(task_id: str) -> dict:
+    rows = get_connection().execute(COUNT_RISK_LEVELS_SQL, (task_id,)).fetchall()
+    return {row[0]: row[1] for row in rows}
+
+def get_task_reviews(task_id: str) -> list:
+    return decode_review_rows(get_connection().execute(GET_TASK_REVIEWS_SQL, (task_id,)).fetchall())
+
+def build_task_update(**kwargs) -> tuple:
+    update_fields = []
+    params = []
     
-    if "differences" in kwargs:
-        update_fields.append("differences = ?")
-        params.append(json.dumps(kwargs["differences"]))
-    if "evaluations" in kwargs:
-        update_fields.append("evaluations = ?")
-        params.append(json.dumps(kwargs["evaluations"]))
-    if "human_reviews" in kwargs:
-        update_fields.append("human_reviews = ?")
-        params.append(json.dumps(kwargs["human_reviews"]))
     if "final_report" in kwargs:
         update_fields.append("final_report = ?")
         params.append(kwargs["final_report"])
@@ -456,11 +1394,413 @@ def update_task_status(task_id: str, status: str, **kwargs) -> None:
         update_fields.append("error = ?")
         params.append(kwargs["error"])
     
-    params.append(task_id)
+    return update_fields, params
+
+def update_task_status_sql(**kwargs) -> tuple:
+    extra_fields, extra_params = build_task_update(**kwargs)
+    update_fields = ["status = ?", "updated_at = CURRENT_TIMESTAMP", "version = version + 1"] + extra_fields
+    return f"UPDATE tasks SET {', '.join(update_fields)} WHERE task_id = ?", extra_params
+
+def update_task_status(task_id: str, status: str, **kwargs) -> None:
+    sql, extra_params = update_task_status_sql(**kwargs)
+    with transaction() as conn:
+        conn.execute(sql, [status] + extra_params + [task_id])
+        for child_sql, params in task_child_writes(task_id, **kwargs):
+            conn.executemany(child_sql, params)
+
+CLAIMABLE_CONDITION = """
+    (status = 'pending' AND (available_at IS NULL OR available_at <= ?))
+    OR (status = 'in_progress' AND lease_expires_at IS NOT NULL AND lease_expires_at <= ?)
+"""
+
+CLAIM_TASK_SQL = """
+    UPDATE tasks
+    SET status = 'in_progress', attempts = attempts + 1,
+        lease_owner = ?, lease_expires_at = ?, heartbeat_at = ?,
+        updated_at = CURRENT_TIMESTAMP, version = version + 1
+    WHERE task_id = ?
+"""
+
+# Claims return the queue fields only; the contract texts are loaded (or streamed) by the worker.
+GET_CLAIMED_TASK_SQL = """
+    SELECT task_id, status, category, error, attempts, available_at,
+           lease_owner, lease_expires_at, heartbeat_at, created_at, updated_at
+    FROM tasks WHERE task_id = ?
+"""
+
+# A worker that crashes or is killed never reaches its retry check, so an expired lease on a
+# task that has used up its attempts fails the task instead of handing it to the next worker.
+FAIL_EXHAUSTED_LEASES_SQL = """
+    UPDATE tasks
+    SET status = 'failed', error = 'Worker stopped without finishing the task after ' || attempts || ' attempts',
+        lease_owner = NULL, lease_expires_at = NULL, updated_at = CURRENT_TIMESTAMP, version = version + 1
+    WHERE status = 'in_progress' AND lease_expires_at IS NOT NULL AND lease_expires_at <= ? AND attempts >= ?
+"""
+
+def _fail_exhausted_leases(conn, now: float, max_attempts: Optional[int]):
+    if max_attempts is not None:
+        conn.execute(FAIL_EXHAUSTED_LEASES_SQL, (now, max_attempts))
+
+def _claim(conn, task_id: str, worker_id: str, lease_seconds: float, now: float) -> Optional[dict]:
+    conn.execute(CLAIM_TASK_SQL, (worker_id, now + lease_seconds, now, task_id))
+    return dict(conn.execute(GET_CLAIMED_TASK_SQL, (task_id,)).fetchone())
+
+def claim_task(
+    task_id: str, worker_id: str, lease_seconds: float = 60, max_attempts: Optional[int] = None
+) -> Optional[dict]:
+    now = time.time()
+    
+    with transaction() as conn:
+        _fail_exhausted_leases(conn, now, max_attempts)
+        row = conn.execute(
+            f"SELECT task_id FROM tasks WHERE task_id = ? AND ({CLAIMABLE_CONDITION})",
+            (task_id, now, now)
+        ).fetchone()
+        return _claim(conn, task_id, worker_id, lease_seconds, now) if row else None
+
+def claim_next_task(
+    worker_id: str, lease_seconds: float = 60, batch_id: str = None, max_attempts: Optional[int] = None
+) -> Optional[dict]:
+    now = time.time()
+    batch_sql, batch_params = ("batch_id = ? AND ", [batch_id]) if batch_id else ("", [])
     
-    cursor.execute(f"UPDATE tasks SET {', '.join(update_fields)} WHERE task_id = ?", params)
-    conn.commit()
-    conn.close()
+    with transaction() as conn:
+        _fail_exhausted_leases(conn, now, max_attempts)
+        row = conn.execute(
+            f"SELECT task_id FROM tasks WHERE {batch_sql}({CLAIMABLE_CONDITION}) ORDER BY created_at LIMIT 1",
+            batch_params + [now, now]
+        ).fetchone()
+        return _claim(conn, row["task_id"], worker_id, lease_seconds, now) if row else None
+
+def list_claimable_task_ids(limit: int = 100, include_batches: bool = True) -> list:
+    now = time.time()
+    batch_sql = "" if include_batches else "batch_id IS NULL AND "
+    rows = get_connection().execute(
+        f"SELECT task_id FROM tasks WHERE {batch_sql}({CLAIMABLE_CONDITION}) ORDER BY created_at LIMIT ?",
+        (now, now, limit)
+    ).fetchall()
+    return [row[0] for row in rows]
+
+def heartbeat_task(task_id: str, worker_id: str, lease_seconds: float = 60) -> bool:
+    now = time.time()
+    cursor = get_connection().execute("""
+        UPDATE tasks SET lease_expires_at = ?, heartbeat_at = ?
+        WHERE task_id = ? AND lease_owner = ? AND status = 'in_progress'
+    """, (now + lease_seconds, now, task_id, worker_id))
+    return cursor.rowcount > 0
+
+def finish_task(task_id: str, worker_id: str, status: str, **kwargs) -> bool:
+    extra_fields, extra_params = build_task_update(**kwargs)
+    update_fields = [
+        "status = ?", "updated_at = CURRENT_TIMESTAMP", "version = version + 1",
+        "lease_owner = NULL", "lease_expires_at = NULL"
+    ] + extra_fields
+    params = [status] + extra_params + [task_id, worker_id]
+    
+    with transaction() as conn:
+        cursor = conn.execute(
+            f"UPDATE tasks SET {', '.join(update_fields)} WHERE task_id = ? AND lease_owner = ? AND status = 'in_progress'",
+            params
+        )
+        if cursor.rowcount == 0:
+            return False
+        for sql, child_params in task_child_writes(task_id, **kwargs):
+            conn.executemany(sql, child_params)
+    return True
+
+def create_batch(batch_id: str, tasks: list, items: list) -> None:
+    # tasks: (task_id, task_data, original_hash, modified_hash) for the pairs that need a run;
+    # items: (position, task_id, reference) for every submitted pair.
+    with transaction() as conn:
+        conn.execute("INSERT INTO batches (batch_id, total) VALUES (?, ?)", (batch_id, len(items)))
+        conn.executemany(SAVE_TASK_SQL, [task_params(*task) for task in tasks])
+        conn.executemany(
+            "INSERT INTO batch_items (batch_id, position, task_id, reference) VALUES (?, ?, ?, ?)",
+            [(batch_id, *item) for item in items]
+        )
+
+def has_pending_batch_tasks(batch_id: str) -> bool:
+    row = get_connection().execute(
+        "SELECT 1 FROM tasks WHERE batch_id = ? AND status = 'pending' LIMIT 1", (batch_id,)
+    ).fetchone()
+    return row is not None
+
+FAIL_PENDING_BATCH_TASKS_SQL = """
+    UPDATE tasks SET status = 'failed', error = ?, updated_at = CURRENT_TIMESTAMP, version = version + 1
+    WHERE batch_id = ? AND status = 'pending'
+"""
+
+def list_prunable_review_threads(thread_ids: list, max_waiting_seconds: float) -> list:
+    # Of the given checkpoint threads (one per task), those of unknown or finished tasks and of
+    # tasks waiting for a reviewer since before the cutoff.
+    rows = get_connection().execute("""
+        SELECT ids.value FROM json_each(?) AS ids
+        LEFT JOIN tasks t ON t.task_id = ids.value
+        WHERE t.task_id IS NULL
+           OR t.status IN ('completed', 'failed', 'cancelled')
+           OR (t.status = 'waiting_human' AND t.updated_at < datetime('now', ?))
+    """, (json.dumps(thread_ids), f"-{int(max_waiting_seconds)} seconds")).fetchall()
+    return [row[0] for row in rows]
+
+def list_unfinished_batch_ids() -> list:
+    rows = get_connection().execute(
+        "SELECT DISTINCT batch_id FROM tasks WHERE batch_id IS NOT NULL AND status IN ('pending', 'in_progress')"
+    ).fetchall()
+    return [row[0] for row in rows]
+
+def requeue_task_sql(task_id: str, delay: float = 0, reset_attempts: bool = False) -> tuple:
+    attempts_sql = ", attempts = 0, error = NULL" if reset_attempts else ""
+    sql = f"""
+        UPDATE tasks
+        SET status = 'pending', available_at = ?, lease_owner = NULL, lease_expires_at = NULL,
+            updated_at = CURRENT_TIMESTAMP, version = version + 1{attempts_sql}
+        WHERE task_id = ?
+    """
+    return sql, (time.time() + delay, task_id)
+
+def requeue_task(task_id: str, delay: float = 0, reset_attempts: bool = False) -> None:
+    sql, params = requeue_task_sql(task_id, delay, reset_attempts)
+    get_connection().execute(sql, params)
+
+class AsyncConnectionPool:
+    def __init__(self, db_path: str, size: int = 4):
+        self.db_path = db_path
+        self.size = max(1, int(size))
+        self.loop = asyncio.get_running_loop()
+        self._idle = asyncio.Queue()
+        self._connections = []
+        self._opening = 0
+    
+    async def _open_connection(self) -> aiosqlite.Connection:
+        conn = await aiosqlite.connect(
+            self.db_path,
+            isolation_level=None,
+            cached_statements=STATEMENT_CACHE_SIZE
+        )
+        conn.row_factory = sqlite3.Row
+        await conn.create_function("cjk_segment", 1, segment_text, deterministic=True)
+        for pragma in CONNECTION_PRAGMAS:
+            await conn.execute(pragma)
+        return conn
+    
+    @asynccontextmanager
+    async def acquire(self):
+        if self._idle.empty() and len(self._connections) + self._opening < self.size:
+            self._opening += 1
+            try:
+                conn = await self._open_connection()
+            finally:
+                self._opening -= 1
+            self._connections.append(conn)
+        else:
+            conn = await self._idle.get()
+        
+        try:
+            yield conn
+        finally:
+            self._idle.put_nowait(conn)
+    
+    async def close(self):
+        for conn in self._connections:
+            await conn.close()
+        self._connections.clear()
+    
+    def discard(self):
+        for conn in self._connections:
+            conn.stop()
+        self._connections.clear()
+
+_async_pools = {}
+
+def get_async_pool() -> AsyncConnectionPool:
+    loop = asyncio.get_running_loop()
+    db_path = get_db_path()
+    
+    pool = _async_pools.get(db_path)
+    if pool is None or pool.loop is not loop:
+        if pool is not None:
+            pool.discard()
+        pool_size = get_config().get("database", {}).get("async_pool_size", 4)
+        pool = AsyncConnectionPool(db_path, pool_size)
+        _async_pools[db_path] = pool
+    return pool
+
+async def close_async_connections():
+    pools = list(_async_pools.values())
+    _async_pools.clear()
+    for pool in pools:
+        await pool.close()
+
+async def async_search_templates(query: str, top_k: int = 3) -> list:
+    async with get_async_pool().acquire() as conn:
+        fts_query = await async_build_fts_query(conn, "templates", query)
+        rows = await conn.execute_fetchall(SEARCH_TEMPLATES_SQL, (fts_query, top_k))
+    return [dict(row) for row in rows]
+
+async def async_search_playbook(query: str, category: str = None, top_k: int = 5) -> list:
+    async with get_async_pool().acquire() as conn:
+        fts_query = await async_build_fts_query(conn, "playbook", query)
+        if category:
+            rows = await conn.execute_fetchall(SEARCH_PLAYBOOK_BY_CATEGORY_SQL, (fts_query, category, top_k))
+        else:
+            rows = await conn.execute_fetchall(SEARCH_PLAYBOOK_SQL, (fts_query, top_k))
+    return [dict(row) for row in rows]
+
+async def async_get_all_playbook_rules(category: str = None) -> list:
+    async with get_async_pool().acquire() as conn:
+        if category:
+            rows = await conn.execute_fetchall("SELECT * FROM playbook WHERE category = ?", (category,))
+        else:
+            rows = await conn.execute_fetchall("SELECT * FROM playbook", ())
+    return [dict(row) for row in rows]
+
+@asynccontextmanager
+async def async_transaction():
+    async with get_async_pool().acquire() as conn:
+        await conn.execute("BEGIN IMMEDIATE")
+        try:
+            yield conn
+            await conn.execute("COMMIT")
+        except BaseException:
+            await conn.execute("ROLLBACK")
+            raise
+
+async def async_prepare_documents(texts: list) -> tuple:
+    hashes = [document_hash(text) for text in texts]
+    missing = []
+    async with get_async_pool().acquire() as conn:
+        for text, digest in zip(texts, hashes):
+            if not await conn.execute_fetchall(DOCUMENT_EXISTS_SQL, (digest,)):
+                missing.append((digest, text))
+    # Compressing a large contract is kept off the event loop.
+    rows = [await asyncio.to_thread(document_row, digest, text) for digest, text in missing]
+    return hashes, rows
+
+async def async_save_task(task_id: str, task_data: dict) -> None:
+    hashes, documents = await async_prepare_documents([task_data.get(column) or "" for column in TASK_TEXT_COLUMNS])
+    async with async_transaction() as conn:
+        await conn.executemany(INSERT_DOCUMENT_SQL, documents)
+        await conn.execute(SAVE_TASK_SQL, task_params(task_id, task_data, *hashes))
+        for sql, params in task_child_writes(task_id, **task_children(task_data)):
+            await conn.executemany(sql, params)
+
+async def async_get_task(task_id: str) -> Optional[dict]:
+    async with get_async_pool().acquire() as conn:
+        rows = await conn.execute_fetchall(GET_TASK_SQL, (task_id,))
+        if not rows:
+            return None
+        task = dict(rows[0])
+        for column, hash_column in TASK_DOCUMENT_COLUMNS.items():
+            rows = await conn.execute_fetchall(GET_DOCUMENT_SQL, (task[hash_column],))
+            task[column] = await asyncio.to_thread(decode_document, rows[0][0], rows[0][1]) if rows else ""
+        rows = await conn.execute_fetchall(GET_TASK_DIFFERENCES_SQL, (task_id,))
+        task["differences"] = [json.loads(row[0]) for row in rows]
+        rows = await conn.execute_fetchall(GET_EVALUATION_RESULTS_SQL, (task_id,))
+        task["evaluations"] = [json.loads(row[0]) for row in rows]
+        rows = await conn.execute_fetchall(GET_TASK_REVIEWS_SQL, (task_id,))
+        task["human_reviews"] = decode_review_rows(rows)
+    return task
+
+async def async_get_task_evaluations(task_id: str, after_seq: int = 0, limit: int = -1) -> list:
+    async with get_async_pool().acquire() as conn:
+        rows = await conn.execute_fetchall(GET_TASK_EVALUATIONS_SQL, (task_id, after_seq, limit))
+    return decode_evaluation_rows(rows)
+
+async def async_get_task_status(task_id: str) -> Optional[str]:
+    async with get_async_pool().acquire() as conn:
+        rows = await conn.execute_fetchall(GET_TASK_STATUS_SQL, (task_id,))
+    return rows[0][0] if rows else None
+
+async def async_get_task_state(task_id: str) -> Optional[dict]:
+    async with get_async_pool().acquire() as conn:
+        rows = await conn.execute_fetchall(GET_TASK_STATE_SQL, (task_id,))
+    return dict(rows[0]) if rows else None
+
+async def async_get_task_evaluation_results(task_id: str, risk_level: str = None) -> list:
+    async with get_async_pool().acquire() as conn:
+        if risk_level:
+            rows = await conn.execute_fetchall(GET_EVALUATION_RESULTS_BY_RISK_SQL, (task_id, risk_level))
+        else:
+            rows = await conn.execute_fetchall(GET_EVALUATION_RESULTS_SQL, (task_id,))
+    return [json.loads(row[0]) for row in rows]
+
+async def async_count_task_risk_levels(task_id: str) -> dict:
+    async with get_async_pool().acquire() as conn:
+        rows = await conn.execute_fetchall(COUNT_RISK_LEVELS_SQL, (task_id,))
+    return {row[0]: row[1] for row in rows}
+
+GET_BATCH_SQL = "SELECT batch_id, total, created_at FROM batches WHERE batch_id = ?"
+
+# Progress counts pairs, not tasks; the summed task versions change whenever any of them does.
+BATCH_PROGRESS_SQL = """
+    SELECT t.status, COUNT(*), SUM(t.version)
+    FROM batch_items b JOIN tasks t ON t.task_id = b.task_id
+    WHERE b.batch_id = ? GROUP BY t.status
+"""
+
+BATCH_RISK_COUNTS_SQL = """
+    SELECT r.risk_level, COUNT(*)
+    FROM batch_items b JOIN task_evaluation_results r ON r.task_id = b.task_id
+    WHERE b.batch_id = ? GROUP BY r.risk_level
+"""
+
+GET_BATCH_ITEMS_SQL = """
+    SELECT b.position, b.reference, b.task_id, t.status,
+           COUNT(*) FILTER (WHERE r.risk_level = 'red') AS red,
+           COUNT(*) FILTER (WHERE r.risk_level = 'yellow') AS yellow,
+           COUNT(*) FILTER (WHERE r.risk_level = 'green') AS green
+    FROM batch_items b
+    JOIN tasks t ON t.task_id = b.task_id
+    LEFT JOIN task_evaluation_results r ON r.task_id = b.task_id
+    WHERE b.batch_id = ? AND b.position > ?
+    GROUP BY b.position ORDER BY b.position LIMIT ?
+"""
+
+async def async_get_batch(batch_id: str) -> Optional[dict]:
+    async with get_async_pool().acquire() as conn:
+        rows = await conn.execute_fetchall(GET_BATCH_SQL, (batch_id,))
+    return dict(rows[0]) if rows else None
+
+async def async_get_batch_progress(batch_id: str) -> dict:
+    async with get_async_pool().acquire() as conn:
+        progress = await conn.execute_fetchall(BATCH_PROGRESS_SQL, (batch_id,))
+        risks = await conn.execute_fetchall(BATCH_RISK_COUNTS_SQL, (batch_id,))
+    return {
+        "counts": {row[0]: row[1] for row in progress},
+        "version": sum(row[2] for row in progress),
+        "risk_counts": {row[0]: row[1] for row in risks}
+    }
+
+async def async_get_batch_items(batch_id: str, after_position: int = 0, limit: int = -1) -> list:
+    async with get_async_pool().acquire() as conn:
+        rows = await conn.execute_fetchall(GET_BATCH_ITEMS_SQL, (batch_id, after_position, limit))
+    return [
+        {
+            "position": row[0],
+            "reference": row[1],
+            "task_id": row[2],
+            "status": row[3],
+            "risk_counts": {"red": row[4], "yellow": row[5], "green": row[6]}
+        }
+        for row in rows
+    ]
+
+async def async_fail_pending_batch_tasks(batch_id: str, error: str) -> int:
+    async with get_async_pool().acquire() as conn:
+        cursor = await conn.execute(FAIL_PENDING_BATCH_TASKS_SQL, (error, batch_id))
+        return cursor.rowcount
+
+async def async_update_task_status(task_id: str, status: str, **kwargs) -> None:
+    sql, extra_params = update_task_status_sql(**kwargs)
+    async with async_transaction() as conn:
+        await conn.execute(sql, [status] + extra_params + [task_id])
+        for child_sql, params in task_child_writes(task_id, **kwargs):
+            await conn.executemany(child_sql, params)
+
+async def async_requeue_task(task_id: str, delay: float = 0, reset_attempts: bool = False) -> None:
+    sql, params = requeue_task_sql(task_id, delay, reset_attempts)
+    async with get_async_pool().acquire() as conn:
+        await conn.execute(sql, params)
 
 if __name__ == "__main__":
     init_db()
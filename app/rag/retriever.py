@@ -1,66 +1,381 @@
-from app.rag.db import search_templates, search_playbook, get_all_playbook_rules
-from app.services.embeddings import get_embeddings_service, cosine_similarity
+from app.config import get_config
+from app.rag.db import (
+    search_templates, search_playbook, search_playbook_batch, get_all_playbook_rules, get_templates_by_ids,
+    get_playbook_version, get_templates_version, get_playbook_embeddings, save_playbook_embeddings
+)
+from app.rag.template_index import TemplateVectorIndex
+from app.services.embeddings import get_embeddings_service, normalize_rows, top_k_indices
 import os
+import time
+import logging
+import hashlib
+import threading
+import numpy as np
+from collections import OrderedDict
+from concurrent.futures import ThreadPoolExecutor, TimeoutError as FutureTimeoutError
+
+logger = logging.getLogger(__name__)
+
+RETRIEVAL_WORKERS = 4
+DIFF_QUERY_LIMIT = 500
+
+_stage_executor = None
+_stage_executor_lock = threading.Lock()
+
+def playbook_rule_text(rule: dict) -> str:
+    return f"{rule.get('rule_name', '')} {rule.get('description', '')}"
+
+def difference_query_text(diff: dict) -> str:
+    return f"{diff.get('original_section', '')} {diff.get('modified_section', '')}".strip()[:DIFF_QUERY_LIMIT]
+
+def elapsed_ms(start: float) -> float:
+    return round((time.perf_counter() - start) * 1000, 2)
+
+def get_stage_executor() -> ThreadPoolExecutor:
+    global _stage_executor
+    with _stage_executor_lock:
+        if _stage_executor is None:
+            _stage_executor = ThreadPoolExecutor(max_workers=RETRIEVAL_WORKERS, thread_name_prefix="retrieval")
+        return _stage_executor
+
+def run_stages(stages: dict, timeout: float = None) -> tuple:
+    # Runs independent retrieval stages concurrently. A stage that fails or misses the shared
+    # deadline is logged and left out, so fusion proceeds with whatever finished.
+    def timed(fn):
+        start = time.perf_counter()
+        return fn(), elapsed_ms(start)
+
+    executor = get_stage_executor()
+    futures = {name: executor.submit(timed, fn) for name, fn in stages.items()}
+    deadline = time.monotonic() + timeout if timeout else None
+
+    results, timings = {}, {}
+    for name, future in futures.items():
+        try:
+            remaining = max(0.0, deadline - time.monotonic()) if deadline else None
+            results[name], timings[f"{name}_ms"] = future.result(timeout=remaining)
+        except FutureTimeoutError:
+            logger.warning(f"Retrieval stage '{name}' timed out after {timeout}s, skipping")
+        except Exception as e:
+            logger.warning(f"Retrieval stage '{name}' failed, skipping: {str(e)}")
+    return results, timings
+
+def reciprocal_rank_fusion(ranked_lists: dict, weights: dict = None, k: int = 60, top_k: int = None) -> list:
+    scores, items = {}, {}
+    for name, results in ranked_lists.items():
+        weight = (weights or {}).get(name, 1.0)
+        for rank, item in enumerate(results):
+            scores[item["id"]] = scores.get(item["id"], 0.0) + weight / (k + rank + 1)
+            items.setdefault(item["id"], item)
+
+    fused = sorted(items, key=lambda item_id: scores[item_id], reverse=True)
+    return [items[item_id] for item_id in fused[:top_k]]
+
+class QueryCache:
+    # LRU of retrieval results shared by every task in the process, so the same clause edit in
+    # many redlines of a batch is looked up once. Emptied whenever the playbook or templates change.
+
+    def __init__(self):
+        self._entries: "OrderedDict[tuple, list]" = OrderedDict()
+        self._version = None
+        self._lock = threading.Lock()
+
+    def get_many(self, keys: list) -> tuple:
+        # (version, values); pass the version back to put_many so results computed against an
+        # older playbook are not stored under a newer one.
+        version = (get_playbook_version(), get_templates_version())
+        with self._lock:
+            if version != self._version:
+                self._entries.clear()
+                self._version = version
+            values = []
+            for key in keys:
+                value = self._entries.get(key)
+                if value is not None:
+                    self._entries.move_to_end(key)
+                values.append(value)
+        return version, values
+
+    def put_many(self, version: tuple, entries: dict):
+        max_entries = get_config().get("retrieval", {}).get("cache_size", 4096)
+        with self._lock:
+            if version != self._version or max_entries <= 0:
+                return
+            for key, value in entries.items():
+                self._entries[key] = value
+                self._entries.move_to_end(key)
+            while len(self._entries) > max_entries:
+                self._entries.popitem(last=False)
 
 class Retriever:
     def __init__(self):
-        self.use_embeddings = os.getenv("USE_EMBEDDINGS", "false").lower() == "true"
+        use_embeddings = os.getenv("USE_EMBEDDINGS")
+        if use_embeddings is None:
+            self.use_embeddings = bool(get_config().get("embeddings", {}).get("use_embeddings", False))
+        else:
+            self.use_embeddings = use_embeddings.lower() == "true"
         self._embeddings_service = None
-    
+        self._rule_index_cache = {}
+        self._rule_index_lock = threading.Lock()
+        self._template_index = None
+        self._warned_no_embeddings = False
+        self.query_cache = QueryCache()
+
     @property
     def embeddings_service(self):
         if self.use_embeddings and self._embeddings_service is None:
             self._embeddings_service = get_embeddings_service()
         return self._embeddings_service
-    
+
+    @property
+    def template_index(self):
+        index_config = get_config().get("vector_index", {})
+        if not index_config.get("enabled", False) or not self.embeddings_service:
+            return None
+        if self._template_index is None:
+            self._template_index = TemplateVectorIndex(
+                index_config.get("path", "app/data/vector_index/templates"),
+                self.embeddings_service,
+                nlist=index_config.get("nlist", 64),
+                nprobe=index_config.get("nprobe", 8)
+            )
+        return self._template_index
+
     def retrieve_templates(self, query: str, top_k: int = 3) -> list:
-        return search_templates(query, top_k)
-    
+        # Only template ids are cached; the rows are re-read by primary key.
+        template_index = self.template_index
+        cache_key = ("templates", query, top_k, template_index is not None)
+        version, (template_ids,) = self.query_cache.get_many([cache_key])
+        if template_ids is not None:
+            return get_templates_by_ids(template_ids)
+        
+        if template_index is not None:
+            try:
+                hits = template_index.search(query, top_k)
+                templates = get_templates_by_ids([template_id for template_id, _ in hits])
+            except Exception as e:
+                logger.warning(f"Template vector search failed, using FTS: {str(e)}")
+                return search_templates(query, top_k)
+        else:
+            templates = search_templates(query, top_k)
+        
+        self.query_cache.put_many(version, {cache_key: [template["id"] for template in templates]})
+        return templates
+
     def retrieve_playbook(self, query: str, category: str = None, top_k: int = 5) -> list:
         return search_playbook(query, category, top_k)
-    
+
     def get_all_rules(self, category: str = None) -> list:
         return get_all_playbook_rules(category)
-    
+
+    def load_rule_index(self, category: str = None) -> tuple:
+        model = getattr(self.embeddings_service, "model", "default")
+        cache_key = (category, model, get_playbook_version())
+
+        with self._rule_index_lock:
+            cached = self._rule_index_cache.get(cache_key)
+            if cached is not None:
+                return cached
+
+            rules = get_all_playbook_rules(category)
+            if not rules:
+                return [], np.zeros((0, 0), dtype=np.float32)
+
+            stored = get_playbook_embeddings(model)
+            texts = [playbook_rule_text(rule) for rule in rules]
+            hashes = [hashlib.sha256(text.encode("utf-8")).hexdigest() for text in texts]
+
+            stale = [
+                i for i, rule in enumerate(rules)
+                if rule["id"] not in stored or stored[rule["id"]]["text_hash"] != hashes[i]
+            ]
+            if stale:
+                vectors = np.asarray(
+                    self.embeddings_service.embed_documents([texts[i] for i in stale]),
+                    dtype=np.float32
+                )
+                entries = []
+                for i, vector in zip(stale, vectors):
+                    entry = {
+                        "rule_id": rules[i]["id"],
+                        "text_hash": hashes[i],
+                        "dim": len(vector),
+                        "vector": vector.tobytes()
+                    }
+                    stored[rules[i]["id"]] = entry
+                    entries.append(entry)
+                save_playbook_embeddings(model, entries)
+
+            matrix = normalize_rows(np.stack([
+                np.frombuffer(stored[rule["id"]]["vector"], dtype=np.float32) for rule in rules
+            ]))
+
+            self._rule_index_cache = {
+                key: value for key, value in self._rule_index_cache.items() if key[2] == cache_key[2]
+            }
+            self._rule_index_cache[cache_key] = (rules, matrix)
+            return rules, matrix
+
+    def vector_search_playbook(self, query: str, category: str = None, top_k: int = 5) -> list:
+        rules, matrix = self.load_rule_index(category)
+        if not rules:
+            return []
+
+        query_vector = normalize_rows(self.embeddings_service.embed_text(query))
+        scores = matrix @ query_vector
+        return [rules[i] for i in top_k_indices(scores, top_k)]
+
+    def vector_search_playbook_batch(self, queries: list, category: str = None, top_k: int = 5) -> list:
+        rules, matrix = self.load_rule_index(category)
+        if not rules or not queries:
+            return [[] for _ in queries]
+
+        query_vectors = normalize_rows(self.embeddings_service.embed_documents(queries))
+        scores = query_vectors @ matrix.T
+        return [[rules[i] for i in top_k_indices(row, top_k)] for row in scores]
+
     def semantic_search_playbook(
-        self, 
-        query: str, 
-        category: str = None, 
+        self,
+        query: str,
+        category: str = None,
         top_k: int = 5
     ) -> list:
         if not self.use_embeddings or not self.embeddings_service:
             return self.retrieve_playbook(query, category, top_k)
-        
+
         try:
-            playbook_rules = get_all_playbook_rules(category)
-            if not playbook_rules:
-                return []
-            
-            query_embedding = self.embeddings_service.embed_text(query)
-            
-            scored_rules = []
-            for rule in playbook_rules:
-                rule_text = f"{rule.get('rule_name', '')} {rule.get('description', '')}"
-                rule_embedding = self.embeddings_service.embed_text(rule_text)
-                similarity = cosine_similarity(query_embedding, rule_embedding)
-                scored_rules.append((similarity, rule))
-            
-            scored_rules.sort(key=lambda x: x[0], reverse=True)
-            return [rule for _, rule in scored_rules[:top_k]]
-        except Exception:
+            return self.vector_search_playbook(query, category, top_k)
+        except Exception as e:
+            logger.warning(f"Vector playbook search failed, using FTS: {str(e)}")
             return self.retrieve_playbook(query, category, top_k)
-    
+
+    def retrieval_mode(self) -> str:
+        mode = get_config().get("retrieval", {}).get("mode", "hybrid")
+        if mode == "fts" or not self.use_embeddings:
+            return "fts"
+        if not self.embeddings_service:
+            if not self._warned_no_embeddings:
+                logger.warning(f"Retrieval mode '{mode}' requested but no embeddings backend is available, using FTS")
+                self._warned_no_embeddings = True
+            return "fts"
+        return mode
+
+    def hybrid_search_playbook(self, query: str, category: str = None, top_k: int = 5) -> tuple:
+        retrieval_config = get_config().get("retrieval", {})
+        candidates = max(top_k, retrieval_config.get("candidates", 20))
+
+        results, timings = run_stages({
+            "fts": lambda: self.retrieve_playbook(query, category, candidates),
+            "vector": lambda: self.vector_search_playbook(query, category, candidates),
+        }, timeout=retrieval_config.get("timeout", 10))
+
+        start = time.perf_counter()
+        rules = reciprocal_rank_fusion(
+            results,
+            weights={
+                "fts": retrieval_config.get("fts_weight", 1.0),
+                "vector": retrieval_config.get("vector_weight", 1.0)
+            },
+            k=retrieval_config.get("rrf_k", 60),
+            top_k=top_k
+        )
+        timings["fusion_ms"] = elapsed_ms(start)
+        return rules, timings
+
+    def retrieve_for_differences(self, differences: list, category: str = None, top_k: int = 5) -> dict:
+        # One batched lookup for every difference of a task (a single FTS statement and/or one
+        # embedding call plus one matmul), fused per difference. Queries answered before, by this
+        # task or another, come from the query cache.
+        start = time.perf_counter()
+        queries = [difference_query_text(diff) for diff in differences]
+        mode = self.retrieval_mode()
+        retrieval_config = get_config().get("retrieval", {})
+        candidates = max(top_k, retrieval_config.get("candidates", 20)) if mode == "hybrid" else top_k
+        weights = {
+            "fts": retrieval_config.get("fts_weight", 1.0),
+            "vector": retrieval_config.get("vector_weight", 1.0)
+        }
+        rrf_k = retrieval_config.get("rrf_k", 60)
+
+        unique_queries = list(dict.fromkeys(queries))
+        cache_keys = {
+            query: ("rules", query, category, mode, top_k, candidates, weights["fts"], weights["vector"], rrf_k)
+            for query in unique_queries
+        }
+        version, cached = self.query_cache.get_many(list(cache_keys.values()))
+        fused = {query: rules for query, rules in zip(unique_queries, cached) if rules is not None}
+        pending = [query for query in unique_queries if query not in fused]
+
+        timings = {}
+        if pending:
+            stages = {}
+            if mode in ("fts", "hybrid"):
+                stages["fts"] = lambda: search_playbook_batch(pending, category, candidates)
+            if mode in ("vector", "hybrid"):
+                stages["vector"] = lambda: self.vector_search_playbook_batch(pending, category, candidates)
+
+            results, timings = run_stages(stages, timeout=retrieval_config.get("timeout", 10))
+            # Results missing a stage are used for this task but not cached.
+            complete = set(results) == set(stages)
+            if not results and mode == "vector":
+                logger.warning("Batched vector retrieval failed, using FTS")
+                results, fts_timings = run_stages({"fts": lambda: search_playbook_batch(pending, category, top_k)})
+                timings.update(fts_timings)
+
+            fusion_start = time.perf_counter()
+            for i, query in enumerate(pending):
+                fused[query] = reciprocal_rank_fusion(
+                    {name: ranked[i] for name, ranked in results.items()},
+                    weights=weights,
+                    k=rrf_k,
+                    top_k=top_k
+                )
+            timings["fusion_ms"] = elapsed_ms(fusion_start)
+
+            if complete:
+                self.query_cache.put_many(version, {cache_keys[query]: fused[query] for query in pending})
+
+        per_difference = [fused[query] for query in queries]
+        playbook_rules = {}
+        for rules in per_difference:
+            for rule in rules:
+                playbook_rules.setdefault(rule["id"], rule)
+
+        timings["cached_queries"] = len(unique_queries) - len(pending)
+        timings["total_ms"] = elapsed_ms(start)
+        return {
+            "rule_ids": [[rule["id"] for rule in rules] for rules in per_difference],
+            "playbook_rules": list(playbook_rules.values()),
+            "mode": mode,
+            "timings": timings
+        }
+
     def retrieve_for_contract(self, contract_text: str, category: str = None) -> dict:
-        templates = self.retrieve_templates(contract_text[:500], top_k=2)
-        
-        if self.use_embeddings:
-            playbook_rules = self.semantic_search_playbook(contract_text[:500], category, top_k=10)
+        start = time.perf_counter()
+        query = contract_text[:500]
+        mode = self.retrieval_mode()
+
+        templates = self.retrieve_templates(query, top_k=2)
+        timings = {"templates_ms": elapsed_ms(start)}
+
+        stage_start = time.perf_counter()
+        if mode == "hybrid":
+            playbook_rules, rule_timings = self.hybrid_search_playbook(query, category, top_k=10)
+            timings.update(rule_timings)
+        elif mode == "vector":
+            playbook_rules = self.semantic_search_playbook(query, category, top_k=10)
+            timings["vector_ms"] = elapsed_ms(stage_start)
         else:
-            playbook_rules = self.retrieve_playbook(contract_text[:500], category, top_k=10)
-        
+            playbook_rules = self.retrieve_playbook(query, category, top_k=10)
+            timings["fts_ms"] = elapsed_ms(stage_start)
+
+        timings["total_ms"] = elapsed_ms(start)
+
         return {
             "templates": templates,
-            "playbook_rules": playbook_rules
+            "playbook_rules": playbook_rules,
+            "mode": mode,
+            "timings": timings
         }
 
 retriever = Retriever()
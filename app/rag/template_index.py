@@ -0,0 +1,105 @@
+import os
+import json
+import hashlib
+import threading
+import numpy as np
+from typing import List, Tuple, Optional
+
+from app.rag.db import get_templates_version, get_template_texts
+from app.rag.vector_index import IVFIndex
+
+TEMPLATE_TEXT_LIMIT = 2000
+
+def template_text(template: dict) -> str:
+    return f"{template.get('title', '')} {template.get('content', '')}"[:TEMPLATE_TEXT_LIMIT]
+
+def text_digest(text: str) -> str:
+    return hashlib.blake2b(text.encode("utf-8"), digest_size=8).hexdigest()
+
+class TemplateVectorIndex:
+    # Keeps an IVF index of template embeddings in step with the templates table. The
+    # templates_version counter in `meta` tells us when to diff; only new or edited rows are
+    # re-embedded and removed rows are tombstoned.
+
+    def __init__(self, path: str, embeddings_service, nlist: int = 64, nprobe: int = 8):
+        self.path = path
+        self.embeddings_service = embeddings_service
+        self.nlist = nlist
+        self.nprobe = nprobe
+
+        self._lock = threading.Lock()
+        self._index: Optional[IVFIndex] = None
+        self._digests = {}
+        self._version = None
+
+    @property
+    def state_path(self) -> str:
+        return os.path.join(self.path, "state.json")
+
+    def load(self) -> bool:
+        if not IVFIndex.exists(self.path) or not os.path.exists(self.state_path):
+            return False
+        with open(self.state_path, encoding="utf-8") as f:
+            state = json.load(f)
+        if state.get("model") != self.embeddings_service.model:
+            return False
+
+        index = IVFIndex.load(self.path)
+        digests = {int(k): v for k, v in state["digests"].items()}
+        if len(index) != len(digests):
+            # The vectors on disk do not cover every recorded template; rebuild rather than trust them.
+            return False
+
+        self._index = index
+        self._index.nprobe = self.nprobe
+        self._digests = digests
+        self._version = state["version"]
+        return True
+
+    def save(self):
+        self._index.save(self.path)
+        tmp_path = self.state_path + ".tmp"
+        with open(tmp_path, "w", encoding="utf-8") as f:
+            json.dump({
+                "model": self.embeddings_service.model,
+                "version": self._version,
+                "digests": self._digests
+            }, f)
+        os.replace(tmp_path, self.state_path)
+
+    def sync(self):
+        with self._lock:
+            version = get_templates_version()
+            if self._version == version:
+                return
+            if self._version is None and self.load() and self._version == version:
+                return
+
+            templates = get_template_texts()
+            texts = {template["id"]: template_text(template) for template in templates}
+            digests = {template_id: text_digest(text) for template_id, text in texts.items()}
+
+            removed = [template_id for template_id in self._digests if template_id not in digests]
+            stale = [template_id for template_id, digest in digests.items() if self._digests.get(template_id) != digest]
+
+            if stale:
+                vectors = np.asarray(
+                    self.embeddings_service.embed_documents([texts[template_id] for template_id in stale]),
+                    dtype=np.float32
+                )
+                if self._index is None:
+                    self._index = IVFIndex(vectors.shape[1], nlist=self.nlist, nprobe=self.nprobe)
+                self._index.add(stale, vectors)
+            if removed and self._index is not None:
+                self._index.delete(removed)
+
+            self._digests = digests
+            self._version = version
+            if self._index is not None:
+                self.save()
+
+    def search(self, query: str, top_k: int = 3) -> List[Tuple[int, float]]:
+        self.sync()
+        if self._index is None:
+            return []
+        return self._index.search(self.embeddings_service.embed_text(query), top_k)
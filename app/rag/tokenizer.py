@@ -0,0 +1,30 @@
+import re
+import unicodedata
+from typing import List, Optional
+
+CJK_CHARS = "㐀-䶿一-鿿豈-﫿"
+TOKEN_PATTERN = re.compile(f"[{CJK_CHARS}]+|[^\\W_{CJK_CHARS}]+")
+CJK_RUN = re.compile(f"[{CJK_CHARS}]")
+
+def tokenize(text: Optional[str]) -> List[str]:
+    # Chinese runs become overlapping bigrams ("预付款" -> "预付", "付款"); latin words and
+    # numbers stay whole. The same function feeds the FTS index and the MATCH query.
+    if not text:
+        return []
+
+    tokens = []
+    for run in TOKEN_PATTERN.findall(unicodedata.normalize("NFKC", text).lower()):
+        if CJK_RUN.match(run) and len(run) > 1:
+            tokens.extend(run[i:i + 2] for i in range(len(run) - 1))
+        else:
+            tokens.append(run)
+    return tokens
+
+def segment_text(text: Optional[str]) -> str:
+    return " ".join(tokenize(text))
+
+def build_match_query(text: Optional[str]) -> Optional[str]:
+    tokens = list(dict.fromkeys(tokenize(text)))
+    if not tokens:
+        return None
+    return " OR ".join(f'"{token}"' for token in tokens)
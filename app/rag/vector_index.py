@@ -0,0 +1,226 @@
+import os
+import json
+import threading
+import numpy as np
+from typing import List, Tuple, Optional, Iterable
+
+from app.services.embeddings import normalize_rows, top_k_indices
+
+ASSIGN_CHUNK = 8192
+
+def spherical_kmeans(data: np.ndarray, k: int, iterations: int = 10, seed: int = 0) -> np.ndarray:
+    rng = np.random.default_rng(seed)
+    centroids = data[rng.choice(len(data), size=k, replace=False)].copy()
+
+    for _ in range(iterations):
+        assignments = assign_to_centroids(data, centroids)
+        sums = np.zeros_like(centroids)
+        np.add.at(sums, assignments, data)
+        counts = np.bincount(assignments, minlength=k)
+
+        empty = counts == 0
+        if empty.any():
+            sums[empty] = data[rng.choice(len(data), size=int(empty.sum()), replace=False)]
+        centroids = normalize_rows(sums)
+
+    return centroids
+
+def assign_to_centroids(data: np.ndarray, centroids: np.ndarray) -> np.ndarray:
+    assignments = np.empty(len(data), dtype=np.int64)
+    for start in range(0, len(data), ASSIGN_CHUNK):
+        chunk = data[start:start + ASSIGN_CHUNK]
+        assignments[start:start + ASSIGN_CHUNK] = np.argmax(chunk @ centroids.T, axis=1)
+    return assignments
+
+class FlatIndex:
+    def __init__(self, dim: int):
+        self.dim = dim
+        self._ids = np.zeros(0, dtype=np.int64)
+        self._vectors = np.zeros((0, dim), dtype=np.float32)
+
+    def __len__(self) -> int:
+        return len(self._ids)
+
+    def add(self, ids: Iterable[int], vectors: np.ndarray):
+        ids = np.asarray(list(ids), dtype=np.int64)
+        self.delete(ids)
+        self._ids = np.concatenate([self._ids, ids])
+        self._vectors = np.concatenate([self._vectors, normalize_rows(vectors).reshape(-1, self.dim)])
+
+    def delete(self, ids: Iterable[int]):
+        keep = ~np.isin(self._ids, np.asarray(list(ids), dtype=np.int64))
+        self._ids = self._ids[keep]
+        self._vectors = self._vectors[keep]
+
+    def search(self, query: np.ndarray, k: int = 10) -> List[Tuple[int, float]]:
+        if not len(self._ids):
+            return []
+        scores = self._vectors @ normalize_rows(query)
+        return [(int(self._ids[i]), float(scores[i])) for i in top_k_indices(scores, k)]
+
+class IVFIndex:
+    # Inverted-file index over unit vectors (inner product == cosine). Trained vectors live in one
+    # array sorted by inverted list so each probed list is a contiguous (memory-mappable) slice;
+    # additions go to an in-memory delta until the next compaction, deletions are tombstones.
+
+    def __init__(self, dim: int, nlist: int = 64, nprobe: int = 8, train_size: int = None):
+        self.dim = dim
+        self.nlist = nlist
+        self.nprobe = nprobe
+        self.train_size = train_size or nlist * 39
+
+        self._lock = threading.RLock()
+        self._centroids: Optional[np.ndarray] = None
+        self._vectors = np.zeros((0, dim), dtype=np.float32)
+        self._ids = np.zeros(0, dtype=np.int64)
+        self._offsets = np.zeros(nlist + 1, dtype=np.int64)
+
+        self._delta_ids: List[np.ndarray] = []
+        self._delta_vectors: List[np.ndarray] = []
+        self._deleted = set()
+
+    @property
+    def is_trained(self) -> bool:
+        return self._centroids is not None
+
+    def __len__(self) -> int:
+        with self._lock:
+            return len(self._ids) + sum(len(ids) for ids in self._delta_ids) - len(self._deleted)
+
+    def ids(self) -> np.ndarray:
+        with self._lock:
+            all_ids = np.concatenate([self._ids] + self._delta_ids)
+            if self._deleted:
+                all_ids = all_ids[~np.isin(all_ids, np.fromiter(self._deleted, dtype=np.int64))]
+            return all_ids
+
+    def add(self, ids: Iterable[int], vectors: np.ndarray):
+        ids = np.asarray(list(ids), dtype=np.int64)
+        vectors = normalize_rows(vectors).reshape(-1, self.dim)
+
+        with self._lock:
+            self.delete(ids)
+            self._deleted.difference_update(int(i) for i in ids)
+            self._delta_ids.append(ids)
+            self._delta_vectors.append(vectors)
+
+            delta_size = sum(len(d) for d in self._delta_ids)
+            if not self.is_trained and delta_size >= self.train_size:
+                self.compact(retrain=True)
+            elif self.is_trained and delta_size > max(len(self._ids) // 4, self.nlist):
+                self.compact()
+
+    def delete(self, ids: Iterable[int]):
+        with self._lock:
+            ids = [int(i) for i in ids]
+            if not ids:
+                return
+            removed = np.asarray(ids, dtype=np.int64)
+            for n, delta_ids in enumerate(self._delta_ids):
+                keep = ~np.isin(delta_ids, removed)
+                self._delta_ids[n] = delta_ids[keep]
+                self._delta_vectors[n] = self._delta_vectors[n][keep]
+            present = set(np.asarray(self._ids)[np.isin(self._ids, removed)].tolist())
+            self._deleted.update(present)
+
+    def compact(self, retrain: bool = False):
+        with self._lock:
+            ids = np.concatenate([np.asarray(self._ids)] + self._delta_ids)
+            vectors = np.concatenate([np.asarray(self._vectors)] + self._delta_vectors)
+            if self._deleted:
+                keep = ~np.isin(ids, np.fromiter(self._deleted, dtype=np.int64))
+                ids, vectors = ids[keep], vectors[keep]
+
+            if (retrain or not self.is_trained) and len(ids) >= self.nlist:
+                sample = vectors
+                if len(sample) > self.train_size:
+                    sample = vectors[np.random.default_rng(0).choice(len(vectors), self.train_size, replace=False)]
+                self._centroids = spherical_kmeans(sample, self.nlist)
+
+            if self.is_trained:
+                assignments = assign_to_centroids(vectors, self._centroids)
+                order = np.argsort(assignments, kind="stable")
+                ids, vectors = ids[order], vectors[order]
+                self._offsets = np.concatenate([[0], np.cumsum(np.bincount(assignments, minlength=self.nlist))])
+                self._ids, self._vectors = ids, vectors
+                self._delta_ids, self._delta_vectors = [], []
+            else:
+                self._ids = np.zeros(0, dtype=np.int64)
+                self._vectors = np.zeros((0, self.dim), dtype=np.float32)
+                self._delta_ids, self._delta_vectors = [ids], [vectors]
+            self._deleted = set()
+
+    def search(self, query: np.ndarray, k: int = 10, nprobe: int = None) -> List[Tuple[int, float]]:
+        query = normalize_rows(query)
+        nprobe = nprobe or self.nprobe
+
+        with self._lock:
+            candidate_ids = list(self._delta_ids)
+            candidate_scores = [vectors @ query for vectors in self._delta_vectors]
+
+            if self.is_trained and len(self._ids):
+                probes = top_k_indices(self._centroids @ query, min(nprobe, self.nlist))
+                for probe in probes:
+                    start, end = self._offsets[probe], self._offsets[probe + 1]
+                    if end > start:
+                        candidate_ids.append(self._ids[start:end])
+                        candidate_scores.append(self._vectors[start:end] @ query)
+
+            deleted = np.fromiter(self._deleted, dtype=np.int64) if self._deleted else None
+
+        if not candidate_ids:
+            return []
+        ids = np.concatenate(candidate_ids)
+        scores = np.concatenate(candidate_scores)
+        if deleted is not None:
+            keep = ~np.isin(ids, deleted)
+            ids, scores = ids[keep], scores[keep]
+        if not len(ids):
+            return []
+        return [(int(ids[i]), float(scores[i])) for i in top_k_indices(scores, k)]
+
+    def save(self, path: str):
+        with self._lock:
+            self.compact()
+            os.makedirs(path, exist_ok=True)
+            arrays = {"ids": self._ids, "vectors": self._vectors, "offsets": self._offsets}
+            if self.is_trained:
+                arrays["centroids"] = self._centroids
+            else:
+                # Too few vectors to train: compact() keeps them all in the delta, which load()
+                # turns back into the delta.
+                arrays["ids"] = np.concatenate([np.zeros(0, dtype=np.int64)] + self._delta_ids)
+                arrays["vectors"] = np.concatenate([np.zeros((0, self.dim), dtype=np.float32)] + self._delta_vectors)
+            for name, array in arrays.items():
+                tmp_path = os.path.join(path, f"{name}.tmp.npy")
+                np.save(tmp_path, np.ascontiguousarray(array))
+                os.replace(tmp_path, os.path.join(path, f"{name}.npy"))
+
+            meta = {"dim": self.dim, "nlist": self.nlist, "nprobe": self.nprobe,
+                    "train_size": self.train_size, "trained": self.is_trained}
+            tmp_meta = os.path.join(path, "meta.json.tmp")
+            with open(tmp_meta, "w", encoding="utf-8") as f:
+                json.dump(meta, f)
+            os.replace(tmp_meta, os.path.join(path, "meta.json"))
+
+    @classmethod
+    def load(cls, path: str, mmap: bool = True) -> "IVFIndex":
+        with open(os.path.join(path, "meta.json"), encoding="utf-8") as f:
+            meta = json.load(f)
+
+        index = cls(meta["dim"], nlist=meta["nlist"], nprobe=meta["nprobe"], train_size=meta["train_size"])
+        mmap_mode = "r" if mmap else None
+        index._ids = np.load(os.path.join(path, "ids.npy"), mmap_mode=mmap_mode)
+        index._vectors = np.load(os.path.join(path, "vectors.npy"), mmap_mode=mmap_mode)
+        index._offsets = np.load(os.path.join(path, "offsets.npy"))
+        if meta["trained"]:
+            index._centroids = np.load(os.path.join(path, "centroids.npy"))
+        else:
+            index._delta_ids, index._delta_vectors = [np.asarray(index._ids)], [np.asarray(index._vectors)]
+            index._ids = np.zeros(0, dtype=np.int64)
+            index._vectors = np.zeros((0, index.dim), dtype=np.float32)
+        return index
+
+    @classmethod
+    def exists(cls, path: str) -> bool:
+        return os.path.exists(os.path.join(path, "meta.json"))
@@ -0,0 +1,86 @@
+import uuid
+import logging
+from typing import List, Optional
+
+from app.config import get_config
+from app.models.schemas import BatchItem
+from app.rag.db import save_documents, delete_unreferenced_documents, create_batch
+from app.services.executor import get_review_executor, QueueFullError
+from app.services.result_cache import get_result_cache_config, analysis_version, result_key, reuse_review
+from app.worker import run_batch
+
+logger = logging.getLogger(__name__)
+
+def get_batch_config() -> dict:
+    return get_config().get("batch", {})
+
+class BatchBuilder:
+    # Collects a batch as it is read. Texts go to the document store chunk by chunk, so only
+    # their hashes are held until the whole manifest has been accepted; discard() removes them
+    # again if it is not.
+
+    def __init__(self, category: Optional[str] = None, reuse: bool = True):
+        self.category = category
+        self.reuse = reuse
+        self.max_items = get_batch_config().get("max_items", 5000)
+        # Read once so every pair of the batch is keyed against the same playbook version.
+        self.version = analysis_version() if get_result_cache_config().get("enabled", True) else None
+        self.entries: List[tuple] = []
+        self.stored: List[str] = []
+
+    def add(self, items: List[BatchItem]) -> None:
+        if len(self.entries) + len(items) > self.max_items:
+            raise ValueError(f"A batch holds at most {self.max_items} contract pairs")
+        
+        hashes, stored = save_documents([text for item in items for text in (item.original_text, item.modified_text)])
+        self.stored.extend(stored)
+        for item, original_hash, modified_hash in zip(items, hashes[0::2], hashes[1::2]):
+            category = item.category or self.category
+            key = result_key(original_hash, modified_hash, category, self.version) if self.version is not None else None
+            self.entries.append((item.reference, category, original_hash, modified_hash, key))
+
+    def create(self) -> dict:
+        # Identical pairs share one task and pairs reviewed before reuse that review; only the
+        # rest become pending tasks.
+        if not self.entries:
+            raise ValueError("Batch contains no contract pairs")
+        
+        batch_id = str(uuid.uuid4())
+        tasks, items = [], []
+        task_for_pair = {}
+        reused = 0
+        for position, (reference, category, original_hash, modified_hash, key) in enumerate(self.entries, 1):
+            pair = key or (original_hash, modified_hash, category)
+            task_id = task_for_pair.get(pair)
+            if task_id is None:
+                task_id = task_for_pair[pair] = str(uuid.uuid4())
+                if self.reuse and key and reuse_review(task_id, key):
+                    reused += 1
+                else:
+                    task_data = {"status": "pending", "category": category, "result_key": key, "batch_id": batch_id}
+                    tasks.append((task_id, task_data, original_hash, modified_hash))
+            items.append((position, task_id, reference))
+        
+        create_batch(batch_id, tasks, items)
+        self.stored = []
+        logger.info(f"Batch {batch_id} created: {len(items)} pairs, {len(tasks)} to review, {reused} reused")
+        return {"batch_id": batch_id, "total": len(items), "scheduled": len(tasks), "reused": reused}
+
+    def discard(self) -> None:
+        if self.stored:
+            removed = delete_unreferenced_documents(self.stored)
+            logger.info(f"Rejected batch: removed {removed} stored documents")
+            self.stored = []
+
+def start_batch_workers(batch_id: str) -> int:
+    # A batch takes a fixed number of executor slots however large it is, leaving the rest of
+    # the pool to single reviews.
+    executor = get_review_executor()
+    started = 0
+    for slot in range(get_batch_config().get("concurrency", 1)):
+        try:
+            executor.submit(f"batch:{batch_id}:{slot}", run_batch, batch_id)
+        except QueueFullError:
+            break
+        started += 1
+    return started
@@ -0,0 +1,434 @@
+import re
+import bisect
+import difflib
+from typing import List, Dict, Any, Optional, Tuple, NamedTuple, Callable, Iterable, Iterator
+from app.services.similarity import MinHasher, lcs_ratio, get_similarity_kernel, get_minhasher
+
+CN_NUMERAL = "[零〇一二两三四五六七八九十百千]+"
+
+# Heading styles in roughly the order contracts nest them. The level of a style is decided by
+# the order in which styles first appear in the document, since drafters mix them freely.
+HEADING_STYLES = [
+    ("chapter", re.compile(rf"^(第\s*(?:{CN_NUMERAL}|\d+)\s*[章节部分]+)\s*")),
+    ("article", re.compile(rf"^(第\s*(?:{CN_NUMERAL}|\d+)\s*条)\s*")),
+    ("cn_enum", re.compile(rf"^({CN_NUMERAL}\s*[、.．])\s*")),
+    ("cn_paren", re.compile(rf"^([（(]\s*{CN_NUMERAL}\s*[）)])\s*")),
+    ("num", re.compile(r"^((\d+(?:[.．]\d+)*)(?:\s*[、．]|\.(?!\d)|\s+))\s*")),
+    ("num_paren", re.compile(r"^([（(]\s*\d+\s*[）)]|\d+\s*[）)])\s*")),
+]
+
+WHITESPACE = re.compile(r"\s+")
+
+class Clause(NamedTuple):
+    index: int
+    label: str
+    path: Tuple[str, ...]
+    text: str
+    body: str
+
+def match_heading(line: str) -> Optional[Tuple[str, str, str]]:
+    # Returns (style, label, rest of line). Dotted numbers nest by depth: "1" -> "1.1" -> "1.1.1".
+    for style, pattern in HEADING_STYLES:
+        match = pattern.match(line)
+        if match:
+            label = match.group(1).strip()
+            if style == "num":
+                style = f"num{match.group(2).replace('．', '.').count('.')}"
+            return style, label, line[match.end():]
+    return None
+
+def normalize_body(text: str) -> str:
+    return WHITESPACE.sub("", text)
+
+# A streamed line longer than this is cut after its last sentence terminator (or hard at the
+# limit), so a document without line breaks is not buffered whole.
+MAX_LINE_CHARS = 8192
+SENTENCE_TERMINATORS = "。；;"
+
+def split_long_line(line: str, max_chars: int) -> Tuple[List[str], str]:
+    # (pieces cut off the front, remainder of at most max_chars characters)
+    pieces = []
+    while len(line) > max_chars:
+        cut = max(line.rfind(terminator, 0, max_chars) for terminator in SENTENCE_TERMINATORS) + 1
+        cut = cut or max_chars
+        pieces.append(line[:cut])
+        line = line[cut:]
+    return pieces, line
+
+def iter_lines(chunks: Iterable[str], max_chars: int = MAX_LINE_CHARS) -> Iterator[str]:
+    # Reassembles lines from text chunks of any size, e.g. pages read from storage.
+    pending = ""
+    for chunk in chunks:
+        lines = (pending + chunk).split("\n")
+        pending = lines.pop()
+        for line in lines:
+            pieces, rest = split_long_line(line, max_chars)
+            yield from pieces
+            yield rest
+        pieces, pending = split_long_line(pending, max_chars)
+        yield from pieces
+    if pending:
+        yield pending
+
+def build_clause(index: int, label: str, path: Tuple[str, ...], lines: List[str], body: List[str]) -> Clause:
+    return Clause(index, label, path, "\n".join(lines), normalize_body("".join(body)))
+
+def iter_clauses(lines: Iterable[str]) -> Iterator[Clause]:
+    # A clause is a heading line plus the lines that follow it up to the next heading. Lines
+    # before the first heading, and documents without headings, give one clause per line.
+    # The body drops the clause number, so renumbered clauses still compare equal.
+    style_levels: Dict[str, int] = {}
+    stack: List[Tuple[int, str]] = []
+    index = 0
+    current = None
+
+    for raw_line in lines:
+        line = raw_line.strip()
+        if not line:
+            continue
+
+        heading = match_heading(line)
+        if heading is not None:
+            style, label, rest = heading
+            level = style_levels.setdefault(style, len(style_levels))
+            while stack and stack[-1][0] >= level:
+                stack.pop()
+            stack.append((level, label))
+        elif current is not None and current[0]:
+            current[2].append(line)
+            current[3].append(line)
+            continue
+
+        if current is not None:
+            yield build_clause(index, *current)
+            index += 1
+
+        if heading is not None:
+            current = (label, tuple(label for _, label in stack), [line], [rest])
+        else:
+            current = ("", tuple(label for _, label in stack), [line], [line])
+
+    if current is not None:
+        yield build_clause(index, *current)
+
+# Bump when segmentation output changes, so memoized segmentations are recomputed.
+SEGMENTATION_VERSION = 1
+
+def segment_clauses(text: str) -> List[Clause]:
+    return list(iter_clauses((text or "").split("\n")))
+
+PREFILTER_MIN_PAIRS = 1000
+
+def align_clauses(
+    original: List[Clause],
+    modified: List[Clause],
+    threshold: float = 0.5,
+    kernel: Callable[..., float] = lcs_ratio,
+    minhasher: Optional[MinHasher] = None,
+    min_jaccard: float = 0.15
+) -> List[Tuple[int, int, float]]:
+    # Identical bodies are paired first, in document order. The rest are paired greedily over
+    # the similarity matrix: best score first, nearer position on ties, nothing below threshold.
+    pairs = []
+    by_body: Dict[str, List[int]] = {}
+    for clause in modified:
+        by_body.setdefault(clause.body, []).append(clause.index)
+
+    unmatched_original = []
+    for clause in original:
+        candidates = by_body.get(clause.body)
+        if candidates:
+            pairs.append((clause.index, candidates.pop(0), 1.0))
+        else:
+            unmatched_original.append(clause)
+
+    matched_modified = {j for _, j, _ in pairs}
+    unmatched_modified = [clause for clause in modified if clause.index not in matched_modified]
+
+    # On large remainders, MinHash signatures drop pairs whose shingle sets barely overlap
+    # before the exact kernel runs.
+    if minhasher is not None and len(unmatched_original) * len(unmatched_modified) >= PREFILTER_MIN_PAIRS:
+        candidates = [
+            (unmatched_original[i], unmatched_modified[j])
+            for i, j in minhasher.candidate_pairs(
+                [a.body for a in unmatched_original], [b.body for b in unmatched_modified], min_jaccard
+            )
+        ]
+    else:
+        candidates = [(a, b) for a in unmatched_original for b in unmatched_modified]
+
+    scored = []
+    for a, b in candidates:
+        score = kernel(a.body, b.body, threshold)
+        if score >= threshold:
+            scored.append((-score, abs(a.index - b.index), a.index, b.index))
+    scored.sort()
+
+    used_original, used_modified = set(), set()
+    for negative_score, _, i, j in scored:
+        if i not in used_original and j not in used_modified:
+            used_original.add(i)
+            used_modified.add(j)
+            pairs.append((i, j, -negative_score))
+
+    return sorted(pairs)
+
+def longest_increasing_subsequence(values: List[int]) -> set:
+    # Positions (into values) of one longest strictly increasing subsequence.
+    tails: List[int] = []
+    tail_positions: List[int] = []
+    previous = [-1] * len(values)
+    for position, value in enumerate(values):
+        slot = bisect.bisect_left(tails, value)
+        if slot == len(tails):
+            tails.append(value)
+            tail_positions.append(position)
+        else:
+            tails[slot] = value
+            tail_positions[slot] = position
+        previous[position] = tail_positions[slot - 1] if slot else -1
+
+    kept = set()
+    position = tail_positions[-1] if tail_positions else -1
+    while position != -1:
+        kept.add(position)
+        position = previous[position]
+    return kept
+
+def window_differences(
+    original: List[Clause],
+    modified: List[Clause],
+    pairs: List[Tuple[int, int, float]],
+    in_order: set,
+    original_cut: int,
+    modified_cut: int
+) -> List[Dict[str, Any]]:
+    # Differences for the clauses before the cut on either side; clauses past both cuts are
+    # left for the next window.
+    differences = []
+    matched_original = {}
+    anchors = {}
+    for position, (i, j, score) in enumerate(pairs):
+        matched_original[i] = j
+        moved = position not in in_order
+        if not moved:
+            anchors[i] = j
+        if (score == 1.0 and not moved) or (i >= original_cut and j >= modified_cut):
+            continue
+        differences.append((j, 0, {
+            "original_section": original[i].text,
+            "modified_section": modified[j].text,
+            "similarity": score,
+            "change_type": "moved" if moved else "modified",
+            "original_clause": " > ".join(original[i].path),
+            "modified_clause": " > ".join(modified[j].path),
+        }))
+
+    matched_modified = set(matched_original.values())
+    for clause in modified[:modified_cut]:
+        if clause.index not in matched_modified:
+            differences.append((clause.index, 0, {
+                "original_section": "",
+                "modified_section": clause.text,
+                "similarity": 0.0,
+                "change_type": "added",
+                "original_clause": "",
+                "modified_clause": " > ".join(clause.path),
+            }))
+
+    # A removed clause is reported right after the clause its nearest unmoved predecessor became.
+    anchor = -1
+    for clause in original[:original_cut]:
+        if clause.index in matched_original:
+            anchor = anchors.get(clause.index, anchor)
+            continue
+        differences.append((anchor, 1, {
+            "original_section": clause.text,
+            "modified_section": "",
+            "similarity": 0.0,
+            "change_type": "removed",
+            "original_clause": " > ".join(clause.path),
+            "modified_clause": "",
+        }))
+
+    differences.sort(key=lambda item: (item[0], item[1]))
+    return [diff for _, _, diff in differences]
+
+def fill_window(window: List[Clause], clauses: Iterator[Clause], size: Optional[int]) -> bool:
+    # Returns True once the clause stream is exhausted.
+    while size is None or len(window) < size:
+        clause = next(clauses, None)
+        if clause is None:
+            return True
+        window.append(clause)
+    return False
+
+def stream_clause_differences(
+    original_lines: Iterable[str],
+    modified_lines: Iterable[str],
+    window: Optional[int] = None,
+    threshold: float = 0.5,
+    kernel: Callable[..., float] = lcs_ratio,
+    minhasher: Optional[MinHasher] = None,
+    min_jaccard: float = 0.15
+) -> Iterator[Dict[str, Any]]:
+    return align_clause_streams(
+        iter_clauses(original_lines), iter_clauses(modified_lines),
+        window, threshold, kernel, minhasher, min_jaccard
+    )
+
+def align_clause_streams(
+    original_clauses: Iterable[Clause],
+    modified_clauses: Iterable[Clause],
+    window: Optional[int] = None,
+    threshold: float = 0.5,
+    kernel: Callable[..., float] = lcs_ratio,
+    minhasher: Optional[MinHasher] = None,
+    min_jaccard: float = 0.15
+) -> Iterator[Dict[str, Any]]:
+    # Aligns up to `window` clauses from each side at a time, so memory is bounded by the window
+    # rather than the documents. Each round commits everything up to the last in-order match in
+    # the first half of both windows and carries the rest over; moves are detected within about
+    # one window. Without a window both documents are aligned in a single round.
+    original_clauses = iter(original_clauses)
+    modified_clauses = iter(modified_clauses)
+    if window is not None:
+        window = max(int(window), 2)
+    pending_original: List[Clause] = []
+    pending_modified: List[Clause] = []
+
+    while True:
+        original_done = fill_window(pending_original, original_clauses, window)
+        modified_done = fill_window(pending_modified, modified_clauses, window)
+        if not pending_original and not pending_modified:
+            return
+
+        original = [clause._replace(index=k) for k, clause in enumerate(pending_original)]
+        modified = [clause._replace(index=k) for k, clause in enumerate(pending_modified)]
+        pairs = align_clauses(original, modified, threshold, kernel, minhasher, min_jaccard)
+
+        # Pairs are in original order; the ones outside the longest run that is also in
+        # modified order are the clauses that moved.
+        in_order = longest_increasing_subsequence([j for _, j, _ in pairs])
+
+        if original_done and modified_done:
+            original_cut, modified_cut = len(original), len(modified)
+        else:
+            original_cut, modified_cut = len(original) // 2, len(modified) // 2
+            anchors = [
+                (i, j) for position, (i, j, _) in enumerate(pairs)
+                if position in in_order and i < original_cut and j < modified_cut
+            ]
+            if anchors:
+                original_cut, modified_cut = anchors[-1][0] + 1, anchors[-1][1] + 1
+
+        yield from window_differences(original, modified, pairs, in_order, original_cut, modified_cut)
+
+        consumed_original = set(range(original_cut))
+        consumed_modified = set(range(modified_cut))
+        for i, j, _ in pairs:
+            if i < original_cut or j < modified_cut:
+                consumed_original.add(i)
+                consumed_modified.add(j)
+        pending_original = [pending_original[k] for k in range(len(original)) if k not in consumed_original]
+        pending_modified = [pending_modified[k] for k in range(len(modified)) if k not in consumed_modified]
+
+def clause_differences(
+    original_text: str,
+    modified_text: str,
+    threshold: float = 0.5,
+    kernel: Callable[..., float] = lcs_ratio,
+    minhasher: Optional[MinHasher] = None,
+    min_jaccard: float = 0.15,
+    segment: Callable[[str], List[Clause]] = segment_clauses
+) -> List[Dict[str, Any]]:
+    return list(align_clause_streams(
+        segment(original_text), segment(modified_text),
+        None, threshold, kernel, minhasher, min_jaccard
+    ))
+
+def line_differences(
+    original_text: str,
+    modified_text: str,
+    kernel: Callable[..., float] = lcs_ratio
+) -> List[Dict[str, Any]]:
+    original_lines = [line.strip() for line in original_text.split('\n') if line.strip()]
+    modified_lines = [line.strip() for line in modified_text.split('\n') if line.strip()]
+
+    differences = []
+
+    matcher = difflib.SequenceMatcher(None, original_lines, modified_lines)
+
+    for tag, i1, i2, j1, j2 in matcher.get_opcodes():
+        if tag == 'replace':
+            for i in range(max(len(original_lines[i1:i2]), len(modified_lines[j1:j2]))):
+                orig = original_lines[i1 + i] if i < len(original_lines[i1:i2]) else ""
+                mod = modified_lines[j1 + i] if i < len(modified_lines[j1:j2]) else ""
+                if orig or mod:
+                    similarity = kernel(orig, mod)
+                    differences.append({
+                        "original_section": orig,
+                        "modified_section": mod,
+                        "similarity": similarity,
+                        "change_type": "modified"
+                    })
+        elif tag == 'delete':
+            for orig in original_lines[i1:i2]:
+                differences.append({
+                    "original_section": orig,
+                    "modified_section": "",
+                    "similarity": 0.0,
+                    "change_type": "removed"
+                })
+        elif tag == 'insert':
+            for mod in modified_lines[j1:j2]:
+                differences.append({
+                    "original_section": "",
+                    "modified_section": mod,
+                    "similarity": 0.0,
+                    "change_type": "added"
+                })
+
+    return differences
+
+def get_minhasher_for(analysis_config: Dict[str, Any]) -> Optional[MinHasher]:
+    if analysis_config.get("prefilter", "minhash") != "minhash":
+        return None
+    return get_minhasher(analysis_config.get("minhash_perm", 64), analysis_config.get("minhash_shingle", 2))
+
+def stream_documents(
+    original_chunks: Iterable[str],
+    modified_chunks: Iterable[str],
+    analysis_config: Dict[str, Any]
+) -> Iterator[Dict[str, Any]]:
+    max_chars = analysis_config.get("streaming", {}).get("max_line_chars", MAX_LINE_CHARS)
+    return stream_clause_differences(
+        iter_lines(original_chunks, max_chars),
+        iter_lines(modified_chunks, max_chars),
+        analysis_config.get("streaming", {}).get("window", 200),
+        analysis_config.get("match_threshold", 0.5),
+        get_similarity_kernel(analysis_config.get("similarity", "lcs")),
+        get_minhasher_for(analysis_config),
+        analysis_config.get("minhash_jaccard", 0.15)
+    )
+
+def diff_documents(
+    original_text: str,
+    modified_text: str,
+    analysis_config: Dict[str, Any],
+    segment: Callable[[str], List[Clause]] = segment_clauses
+) -> List[Dict[str, Any]]:
+    kernel = get_similarity_kernel(analysis_config.get("similarity", "lcs"))
+
+    if analysis_config.get("diff_engine", "clause") == "line":
+        return line_differences(original_text, modified_text, kernel)
+
+    return clause_differences(
+        original_text,
+        modified_text,
+        analysis_config.get("match_threshold", 0.5),
+        kernel,
+        get_minhasher_for(analysis_config),
+        analysis_config.get("minhash_jaccard", 0.15),
+        segment
+    )
@@ -1,25 +1,176 @@
 import os
+import math
+import zlib
+import hashlib
+import unicodedata
 import numpy as np
+from collections import Counter
 from typing import List, Dict, Any, Optional
-from langchain_openai import OpenAIEmbeddings
 
-class EmbeddingsService:
+from app.config import get_config
+
+class EmbeddingBackend:
+    name = "base"
+    cacheable = True
+
+    def embed_batch(self, texts: List[str]) -> np.ndarray:
+        raise NotImplementedError
+
+class OpenAIEmbeddingBackend(EmbeddingBackend):
     def __init__(self, model: str = "text-embedding-3-small"):
+        from langchain_openai import OpenAIEmbeddings
+
         api_key = os.getenv("OPENAI_API_KEY")
         if not api_key:
             raise ValueError("OPENAI_API_KEY is not set")
-        
+
+        self.name = f"openai:{model}"
         self.embeddings = OpenAIEmbeddings(
             model=model,
             api_key=api_key
         )
-    
-    def embed_text(self, text: str) -> List[float]:
-        return self.embeddings.embed_query(text)
-    
-    def embed_documents(self, texts: List[str]) -> List[List[float]]:
-        return self.embeddings.embed_documents(texts)
-    
+
+    def embed_batch(self, texts: List[str]) -> np.ndarray:
+        return np.asarray(self.embeddings.embed_documents(texts), dtype=np.float32)
+
+class OllamaEmbeddingBackend(EmbeddingBackend):
+    def __init__(self, model: str = "nomic-embed-text", base_url: str = "http://localhost:11434"):
+        from langchain_community.embeddings import OllamaEmbeddings
+
+        self.name = f"ollama:{model}"
+        self.embeddings = OllamaEmbeddings(model=model, base_url=base_url)
+
+    def embed_batch(self, texts: List[str]) -> np.ndarray:
+        return np.asarray(self.embeddings.embed_documents(texts), dtype=np.float32)
+
+# IDF is kept per hash bucket in a space much larger than the embedding, so n-grams rarely share
+# a document frequency.
+IDF_BUCKETS = 1 << 18
+
+class HashingEmbeddingBackend(EmbeddingBackend):
+    # Signed feature hashing of character n-grams with sublinear TF weighting, and IDF weighting
+    # when fitted on a reference corpus. Works offline and needs no word segmentation, which
+    # suits Chinese contract text. The name covers dimension, n-grams and a digest of the IDF
+    # table, so cached and persisted vectors are never mixed across settings.
+
+    def __init__(self, dim: int = 512, ngram_range: tuple = (1, 3), idf: Optional[np.ndarray] = None):
+        self.dim = dim
+        self.ngram_range = ngram_range
+        self.idf = idf
+        self.name = f"local:hash-{dim}-{ngram_range[0]}{ngram_range[1]}"
+        if idf is not None:
+            self.name += f"-idf{hashlib.sha256(idf.tobytes()).hexdigest()[:12]}"
+
+    @classmethod
+    def fit(cls, corpus: List[str], dim: int = 512, ngram_range: tuple = (1, 3)) -> "HashingEmbeddingBackend":
+        backend = cls(dim, ngram_range)
+        if not corpus:
+            return backend
+
+        document_frequency = np.zeros(IDF_BUCKETS, dtype=np.float64)
+        for text in corpus:
+            buckets = {zlib.crc32(gram.encode("utf-8")) % IDF_BUCKETS for gram in backend.ngram_counts(text)}
+            document_frequency[list(buckets)] += 1
+        idf = np.log((1 + len(corpus)) / (1 + document_frequency)) + 1.0
+        return cls(dim, ngram_range, idf.astype(np.float32))
+
+    def normalize(self, text: str) -> str:
+        text = unicodedata.normalize("NFKC", text).lower()
+        return "".join(ch for ch in text if ch.isalnum())
+
+    def ngram_counts(self, text: str) -> Counter:
+        chars = self.normalize(text)
+        low, high = self.ngram_range
+        return Counter(
+            chars[i:i + n]
+            for n in range(low, high + 1)
+            for i in range(len(chars) - n + 1)
+        )
+
+    def embed_one(self, text: str) -> np.ndarray:
+        vector = np.zeros(self.dim, dtype=np.float32)
+
+        for gram, count in self.ngram_counts(text).items():
+            bucket = zlib.crc32(gram.encode("utf-8"))
+            sign = 1.0 if bucket & 0x80000000 else -1.0
+            weight = (1.0 + math.log(count)) * len(gram)
+            if self.idf is not None:
+                weight *= self.idf[bucket % IDF_BUCKETS]
+            vector[bucket % self.dim] += sign * weight
+
+        norm = np.linalg.norm(vector)
+        return vector / norm if norm > 0 else vector
+
+    def embed_batch(self, texts: List[str]) -> np.ndarray:
+        if not texts:
+            return np.zeros((0, self.dim), dtype=np.float32)
+        return np.stack([self.embed_one(text) for text in texts])
+
+def local_idf_corpus() -> List[str]:
+    # Playbook rules and templates are what the local vectors are compared against.
+    from app.rag.db import get_all_playbook_rules, get_template_texts
+    from app.rag.retriever import playbook_rule_text
+    from app.rag.template_index import template_text
+
+    return [playbook_rule_text(rule) for rule in get_all_playbook_rules()] + [
+        template_text(template) for template in get_template_texts()
+    ]
+
+def create_embedding_backend(embeddings_config: Dict[str, Any]) -> EmbeddingBackend:
+    backend = embeddings_config.get("backend", "openai")
+
+    if backend == "local":
+        dim = embeddings_config.get("local_dim", 512)
+        if not embeddings_config.get("local_idf", True):
+            return HashingEmbeddingBackend(dim=dim)
+        return HashingEmbeddingBackend.fit(local_idf_corpus(), dim=dim)
+    if backend == "ollama":
+        base_url = embeddings_config.get("base_url") or get_config().get("llm", {}).get("base_url", "http://localhost:11434")
+        return OllamaEmbeddingBackend(model=embeddings_config.get("model", "nomic-embed-text"), base_url=base_url)
+    if backend == "openai":
+        return OpenAIEmbeddingBackend(model=embeddings_config.get("model", "text-embedding-3-small"))
+
+    raise ValueError(f"Unsupported embeddings backend: {backend}")
+
+class EmbeddingsService:
+    def __init__(self, backend: EmbeddingBackend = None, batch_size: int = 64, use_cache: bool = True):
+        self.backend = backend or OpenAIEmbeddingBackend()
+        self.model = self.backend.name
+        self.batch_size = max(1, batch_size)
+        self.use_cache = use_cache and self.backend.cacheable
+
+    def text_hash(self, text: str) -> str:
+        return hashlib.sha256(text.encode("utf-8")).hexdigest()
+
+    def embed_documents(self, texts: List[str]) -> np.ndarray:
+        from app.rag.db import get_cached_embeddings, put_cached_embeddings
+
+        texts = list(texts)
+        vectors: List[Optional[np.ndarray]] = [None] * len(texts)
+        hashes = [self.text_hash(text) for text in texts]
+
+        if self.use_cache and texts:
+            cached = get_cached_embeddings(self.model, hashes)
+            for i, text_hash in enumerate(hashes):
+                if text_hash in cached:
+                    vectors[i] = np.frombuffer(cached[text_hash], dtype=np.float32)
+
+        missing = [i for i, vector in enumerate(vectors) if vector is None]
+        for start in range(0, len(missing), self.batch_size):
+            chunk = missing[start:start + self.batch_size]
+            embedded = self.backend.embed_batch([texts[i] for i in chunk]).astype(np.float32)
+            for i, vector in zip(chunk, embedded):
+                vectors[i] = vector
+            if self.use_cache:
+                put_cached_embeddings(self.model, [(hashes[i], vectors[i].tobytes()) for i in chunk])
+
+        if not vectors:
+            return np.zeros((0, 0), dtype=np.float32)
+        return np.stack(vectors)
+
+    def embed_text(self, text: str) -> np.ndarray:
+        return self.embed_documents([text])[0]
+
     def compute_similarity(self, vec1: List[float], vec2: List[float]) -> float:
         v1 = np.array(vec1)
         v2 = np.array(vec2)
@@ -30,8 +181,13 @@ embeddings_service: Optional[EmbeddingsService] = None
 def get_embeddings_service() -> EmbeddingsService:
     global embeddings_service
     if embeddings_service is None:
+        embeddings_config = get_config().get("embeddings", {})
         try:
-            embeddings_service = EmbeddingsService()
+            embeddings_service = EmbeddingsService(
+                backend=create_embedding_backend(embeddings_config),
+                batch_size=embeddings_config.get("batch_size", 64),
+                use_cache=embeddings_config.get("cache", True)
+            )
         except Exception as e:
             return None
     return embeddings_service
@@ -40,3 +196,14 @@ def cosine_similarity(vec1: List[float], vec2: List[float]) -> float:
     v1 = np.array(vec1)
     v2 = np.array(vec2)
     return float(np.dot(v1, v2) / (np.linalg.norm(v1) * np.linalg.norm(v2) + 1e-8))
+
+def normalize_rows(matrix: np.ndarray) -> np.ndarray:
+    matrix = np.asarray(matrix, dtype=np.float32)
+    norms = np.linalg.norm(matrix, axis=-1, keepdims=True)
+    return matrix / np.maximum(norms, 1e-8)
+
+def top_k_indices(scores: np.ndarray, k: int) -> np.ndarray:
+    if k >= len(scores):
+        return np.argsort(-scores)
+    candidates = np.argpartition(-scores, k)[:k]
+    return candidates[np.argsort(-scores[candidates])]
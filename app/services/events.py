@@ -0,0 +1,174 @@
+import json
+import time
+import asyncio
+import logging
+import threading
+from collections import OrderedDict, deque
+from typing import Any, Deque, Dict, List, Optional
+
+from app.config import get_config
+
+logger = logging.getLogger(__name__)
+
+TERMINAL_STATUSES = ("completed", "failed", "cancelled")
+
+class Subscription:
+    # One SSE client. Events are published from worker threads and handed to the subscriber's
+    # event loop, so the queue itself is only touched on that loop.
+
+    def __init__(self, bus: "TaskEventBus", task_id: str):
+        self.bus = bus
+        self.task_id = task_id
+        self.loop = asyncio.get_running_loop()
+        self.queue: asyncio.Queue = asyncio.Queue()
+
+    def push(self, event: Dict[str, Any]):
+        try:
+            self.loop.call_soon_threadsafe(self.queue.put_nowait, event)
+        except RuntimeError:
+            # The subscriber's loop is closed; it will never read again.
+            self.bus.unsubscribe(self)
+
+    async def get(self, timeout: float) -> Optional[Dict[str, Any]]:
+        try:
+            return await asyncio.wait_for(self.queue.get(), timeout)
+        except asyncio.TimeoutError:
+            return None
+
+    def close(self):
+        self.bus.unsubscribe(self)
+
+class TaskEventBus:
+    # In-process pub/sub for task progress. Each watched task keeps a short history so a client
+    # that reconnects with Last-Event-ID sees what it missed. Nothing is kept while the process
+    # has no subscribers at all (e.g. a standalone worker); clients that connect later start from
+    # the database. History of finished tasks is dropped after `retention_seconds`, that of tasks
+    # with no event for `idle_seconds` (waiting for a reviewer, abandoned) and that of the least
+    # recently active tasks beyond `max_tasks` as well.
+
+    def __init__(
+        self,
+        history_size: int = 256,
+        retention_seconds: float = 300,
+        idle_seconds: float = 3600,
+        max_tasks: int = 1024
+    ):
+        self.history_size = history_size
+        self.retention_seconds = retention_seconds
+        self.idle_seconds = idle_seconds
+        self.max_tasks = max_tasks
+        self._lock = threading.Lock()
+        self._subscribers: Dict[str, List[Subscription]] = {}
+        self._history: Dict[str, Deque[Dict[str, Any]]] = {}
+        self._sequence: Dict[str, int] = {}
+        self._finished: Dict[str, float] = {}
+        # task_id -> time of its last event, least recently active first.
+        self._active: "OrderedDict[str, float]" = OrderedDict()
+
+    def publish(self, task_id: str, event_type: str, data: Dict[str, Any]) -> Optional[Dict[str, Any]]:
+        with self._lock:
+            if not self._subscribers and task_id not in self._history:
+                return None
+            
+            sequence = self._sequence.get(task_id, 0) + 1
+            self._sequence[task_id] = sequence
+            event = {"id": sequence, "type": event_type, "data": data}
+            self._history.setdefault(task_id, deque(maxlen=self.history_size)).append(event)
+            self._active[task_id] = time.monotonic()
+            self._active.move_to_end(task_id)
+            subscribers = list(self._subscribers.get(task_id, ()))
+
+            if event_type == "status":
+                if data.get("status") in TERMINAL_STATUSES:
+                    self._finished[task_id] = time.monotonic()
+                else:
+                    self._finished.pop(task_id, None)
+            self._expire()
+
+        for subscription in subscribers:
+            subscription.push(event)
+        return event
+
+    def subscribe(self, task_id: str, last_event_id: Optional[int] = None) -> Subscription:
+        subscription = Subscription(self, task_id)
+        with self._lock:
+            self._subscribers.setdefault(task_id, []).append(subscription)
+            missed = [
+                event for event in self._history.get(task_id, ())
+                if last_event_id is None or event["id"] > last_event_id
+            ]
+        for event in missed:
+            subscription.queue.put_nowait(event)
+        return subscription
+
+    def unsubscribe(self, subscription: Subscription):
+        with self._lock:
+            subscribers = self._subscribers.get(subscription.task_id, [])
+            if subscription in subscribers:
+                subscribers.remove(subscription)
+            if not subscribers:
+                self._subscribers.pop(subscription.task_id, None)
+
+    def subscriber_count(self, task_id: str) -> int:
+        with self._lock:
+            return len(self._subscribers.get(task_id, ()))
+
+    def history_count(self) -> int:
+        with self._lock:
+            return len(self._history)
+
+    def _forget(self, task_id: str):
+        self._finished.pop(task_id, None)
+        self._active.pop(task_id, None)
+        self._history.pop(task_id, None)
+        self._sequence.pop(task_id, None)
+
+    def _expire(self):
+        now = time.monotonic()
+        cutoff = now - self.retention_seconds
+        for task_id in [task_id for task_id, finished in self._finished.items() if finished < cutoff]:
+            self._forget(task_id)
+        
+        idle_cutoff = now - self.idle_seconds
+        excess = len(self._active) - self.max_tasks
+        for task_id, last_event in list(self._active.items()):
+            if last_event >= idle_cutoff and excess <= 0:
+                break
+            if task_id in self._subscribers:
+                # Dropping a watched task's history would restart its event ids under the client.
+                continue
+            self._forget(task_id)
+            excess -= 1
+
+_event_bus: Optional[TaskEventBus] = None
+_event_bus_lock = threading.Lock()
+
+def get_event_bus() -> TaskEventBus:
+    global _event_bus
+    with _event_bus_lock:
+        if _event_bus is None:
+            events_config = get_config().get("events", {})
+            _event_bus = TaskEventBus(
+                history_size=events_config.get("history_size", 256),
+                retention_seconds=events_config.get("retention_seconds", 300),
+                idle_seconds=events_config.get("idle_seconds", 3600),
+                max_tasks=events_config.get("max_tasks", 1024)
+            )
+        return _event_bus
+
+def publish_task_event(task_id: Optional[str], event_type: str, **data) -> None:
+    # Progress reporting must never break a review.
+    if not task_id:
+        return
+    try:
+        get_event_bus().publish(task_id, event_type, data)
+    except Exception as e:
+        logger.warning(f"Failed to publish {event_type} event for task {task_id}: {str(e)}")
+
+def format_sse(event_type: str, data: Dict[str, Any], event_id: Optional[int] = None) -> str:
+    lines = []
+    if event_id is not None:
+        lines.append(f"id: {event_id}")
+    lines.append(f"event: {event_type}")
+    lines.append(f"data: {json.dumps(data, ensure_ascii=False)}")
+    return "\n".join(lines) + "\n\n"
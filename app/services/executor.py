@@ -0,0 +1,123 @@
+import logging
+import threading
+from concurrent.futures import Future, ThreadPoolExecutor
+from typing import Callable, Dict, Optional
+
+from app.config import get_config
+
+logger = logging.getLogger(__name__)
+
+class QueueFullError(Exception):
+    pass
+
+class TaskCancelledError(Exception):
+    pass
+
+class ReviewExecutor:
+    def __init__(self, mode: str = "thread", max_workers: int = 2, max_queue: int = 16):
+        # Reviews run in threads: cancel events and task events only reach this process. To spread
+        # reviews over processes, set task.dispatch to queue and start several workers instead.
+        if mode != "thread":
+            raise ValueError(f"Unsupported executor mode: {mode} (use task.dispatch: queue for multiple processes)")
+
+        self.mode = mode
+        self.max_workers = max(1, int(max_workers))
+        self.max_queue = max(0, int(max_queue))
+
+        self._pool = None
+        self._lock = threading.Lock()
+        self._futures: Dict[str, Future] = {}
+        self._cancel_events: Dict[str, threading.Event] = {}
+
+    @property
+    def pool(self):
+        if self._pool is None:
+            self._pool = ThreadPoolExecutor(
+                max_workers=self.max_workers,
+                thread_name_prefix="review-worker"
+            )
+        return self._pool
+
+    @property
+    def capacity(self) -> int:
+        return self.max_workers + self.max_queue
+
+    def depth(self) -> int:
+        with self._lock:
+            return len(self._futures)
+
+    def has_capacity(self) -> bool:
+        return self.depth() < self.capacity
+
+    def is_active(self, task_id: str) -> bool:
+        with self._lock:
+            return task_id in self._futures
+
+    def submit(self, task_id: str, fn: Callable, *args, **kwargs) -> Future:
+        with self._lock:
+            if task_id in self._futures:
+                return self._futures[task_id]
+
+            if len(self._futures) >= self.capacity:
+                raise QueueFullError(f"Review queue is full ({self.capacity} tasks)")
+
+            cancel_event = threading.Event()
+            kwargs["cancel_event"] = cancel_event
+            self._cancel_events[task_id] = cancel_event
+
+            future = self.pool.submit(fn, *args, **kwargs)
+            self._futures[task_id] = future
+
+        future.add_done_callback(lambda f: self._release(task_id, f))
+        return future
+
+    def cancel(self, task_id: str) -> bool:
+        with self._lock:
+            future = self._futures.get(task_id)
+            cancel_event = self._cancel_events.get(task_id)
+
+        if future is None:
+            return False
+
+        if future.cancel():
+            logger.info(f"Task {task_id} cancelled before start")
+            return True
+
+        if cancel_event is not None:
+            cancel_event.set()
+            logger.info(f"Cancellation requested for running task {task_id}")
+            return True
+
+        return False
+
+    def shutdown(self, wait: bool = False):
+        with self._lock:
+            for cancel_event in self._cancel_events.values():
+                cancel_event.set()
+            pool = self._pool
+            self._pool = None
+
+        if pool is not None:
+            pool.shutdown(wait=wait, cancel_futures=True)
+
+    def _release(self, task_id: str, future: Future):
+        with self._lock:
+            if self._futures.get(task_id) is future:
+                del self._futures[task_id]
+                self._cancel_events.pop(task_id, None)
+
+        if not future.cancelled() and future.exception() is not None:
+            logger.error(f"Task {task_id} raised in executor: {future.exception()}")
+
+review_executor: Optional[ReviewExecutor] = None
+
+def get_review_executor() -> ReviewExecutor:
+    global review_executor
+    if review_executor is None:
+        executor_config = get_config().get("executor", {})
+        review_executor = ReviewExecutor(
+            mode=executor_config.get("mode", "thread"),
+            max_workers=executor_config.get("max_workers", 2),
+            max_queue=executor_config.get("max_queue", 16)
+        )
+    return review_executor
@@ -1,9 +1,13 @@
 import os
+import json
 from typing import Optional, List, Dict, Any
 from langchain_community.chat_models import ChatOllama
 from langchain_core.messages import HumanMessage, SystemMessage
 
 from app.config import get_config
+from app.services.llm_cache import get_llm_cache
+
+PROMPT_RULE_LIMIT = 5
 
 class LLMService:
     def __init__(self, model: str = None, temperature: float = None, base_url: str = None):
@@ -13,11 +17,13 @@ class LLMService:
         self.model = model or llm_config.get("model", "llama3.2")
         self.temperature = temperature or llm_config.get("temperature", 0.3)
         self.base_url = base_url or llm_config.get("base_url", "http://localhost:11434")
+        self.timeout = llm_config.get("timeout", 60)
         
         self.llm = ChatOllama(
             model=self.model,
             temperature=self.temperature,
-            base_url=self.base_url
+            base_url=self.base_url,
+            timeout=self.timeout
         )
         
         self.system_prompt = """你是一位专业的法务合同审查专家。你的职责是：
@@ -36,6 +42,58 @@ class LLMService:
 - yellow: 需要人工确认，可能存在风险
 - red: 违反合规要求，存在重大风险"""
 
+    def format_rules(self, playbook_rules: List[Dict[str, Any]] = None) -> str:
+        rules_text = ""
+        if playbook_rules:
+            rules_text = "\n参考规则:\n"
+            for rule in playbook_rules[:PROMPT_RULE_LIMIT]:
+                rules_text += f"- {rule.get('rule_name', '')}: {rule.get('description', '')} (风险:{rule.get('risk_level', '')}), 建议:{rule.get('action', '')}\n"
+        return rules_text
+
+    def invoke_json(self, user_prompt: str) -> Any:
+        messages = [
+            SystemMessage(content=self.system_prompt),
+            HumanMessage(content=user_prompt)
+        ]
+        
+        response = self.llm.invoke(messages)
+        content = response.content
+        
+        if isinstance(content, list):
+            content = content[0].get("text", str(content)) if content else str(content)
+        
+        if isinstance(content, str):
+            if content.startswith("```json"):
+                content = content[7:]
+            if content.startswith("```"):
+                content = content[3:]
+            if content.endswith("```"):
+                content = content[:-3]
+            content = content.strip()
+        
+        return json.loads(content)
+
+    def normalize_result(self, result: Dict[str, Any]) -> Dict[str, Any]:
+        return {
+            "risk_level": result.get("risk_level", "yellow"),
+            "explanation": result.get("explanation", "需要人工确认"),
+            "suggestion": result.get("suggestion", "请人工审核"),
+            "matched_rule": result.get("matched_rule")
+        }
+
+    def cache_key(
+        self,
+        original_section: str,
+        modified_section: str,
+        change_type: str,
+        playbook_rules: List[Dict[str, Any]] = None
+    ) -> str:
+        rule_ids = [rule.get("id") for rule in (playbook_rules or [])[:PROMPT_RULE_LIMIT]]
+        return get_llm_cache().make_key(
+            self.model, self.temperature, self.system_prompt,
+            original_section, modified_section, change_type, rule_ids
+        )
+
     def analyze_contract_difference(
         self, 
         original_section: str, 
@@ -43,11 +101,15 @@ class LLMService:
         change_type: str,
         playbook_rules: List[Dict[str, Any]] = None
     ) -> Dict[str, Any]:
-        rules_text = ""
-        if playbook_rules:
-            rules_text = "\n参考规则:\n"
-            for rule in playbook_rules[:5]:
-                rules_text += f"- {rule.get('rule_name', '')}: {rule.get('description', '')} (风险:{rule.get('risk_level', '')}), 建议:{rule.get('action', '')}\n"
+        cache = get_llm_cache()
+        cache_key = None
+        if cache is not None:
+            cache_key = self.cache_key(original_section, modified_section, change_type, playbook_rules)
+            cached = cache.get(cache_key)
+            if cached is not None:
+                return cached
+        
+        rules_text = self.format_rules(playbook_rules)
         
         user_prompt = f"""请分析以下合同条款修改：
 
@@ -62,35 +124,8 @@ class LLMService:
 
 请分析这个修改是否存在风险，并给出评估。"""
 
-        messages = [
-            SystemMessage(content=self.system_prompt),
-            HumanMessage(content=user_prompt)
-        ]
-        
         try:
-            response = self.llm.invoke(messages)
-            content = response.content
-            
-            if isinstance(content, list):
-                content = content[0].get("text", str(content)) if content else str(content)
-            
-            if isinstance(content, str):
-                if content.startswith("```json"):
-                    content = content[7:]
-                if content.startswith("```"):
-                    content = content[3:]
-                if content.endswith("```"):
-                    content = content[:-3]
-                content = content.strip()
-            
-            import json
-            result = json.loads(content)
-            return {
-                "risk_level": result.get("risk_level", "yellow"),
-                "explanation": result.get("explanation", "需要人工确认"),
-                "suggestion": result.get("suggestion", "请人工审核"),
-                "matched_rule": result.get("matched_rule")
-            }
+            result = self.normalize_result(self.invoke_json(user_prompt))
         except Exception as e:
             return {
                 "risk_level": "yellow",
@@ -98,6 +133,79 @@ class LLMService:
                 "suggestion": "请人工审核此修改",
                 "matched_rule": None
             }
+        
+        if cache_key is not None:
+            cache.set(cache_key, result)
+        return result
+
+    def analyze_contract_differences_batch(
+        self,
+        differences: List[Dict[str, Any]],
+        playbook_rules: List[Dict[str, Any]] = None,
+        item_rules: List[List[Dict[str, Any]]] = None
+    ) -> List[Optional[Dict[str, Any]]]:
+        results: List[Optional[Dict[str, Any]]] = [None] * len(differences)
+        rules_for = (lambda index: item_rules[index]) if item_rules is not None else (lambda index: playbook_rules)
+        
+        cache = get_llm_cache()
+        cache_keys = [None] * len(differences)
+        if cache is not None:
+            for index, diff in enumerate(differences):
+                cache_keys[index] = self.cache_key(
+                    diff.get("original_section", ""),
+                    diff.get("modified_section", ""),
+                    diff.get("change_type", "modified"),
+                    rules_for(index)
+                )
+                results[index] = cache.get(cache_keys[index])
+        
+        pending = [index for index, result in enumerate(results) if result is None]
+        if not pending:
+            return results
+        
+        rules_text = self.format_rules(playbook_rules) if item_rules is None else ""
+        
+        items_text = ""
+        for position, index in enumerate(pending):
+            diff = differences[index]
+            item_rules_text = self.format_rules(item_rules[index]) if item_rules is not None else ""
+            items_text += f"""
+[{position}]
+原始条款:
+{diff.get("original_section", "")}
+
+修改后条款:
+{diff.get("modified_section", "")}
+
+修改类型: {diff.get("change_type", "modified")}
+{item_rules_text}"""
+        
+        user_prompt = f"""请逐条分析以下{len(pending)}处合同条款修改：
+{items_text}
+{rules_text}
+
+请返回一个JSON数组，每个元素对应一处修改，并额外包含 index 字段（与上面方括号中的编号一致）。"""
+
+        try:
+            parsed = self.invoke_json(user_prompt)
+        except Exception:
+            return results
+        
+        if isinstance(parsed, dict):
+            parsed = parsed.get("results", [])
+        if not isinstance(parsed, list):
+            return results
+        
+        for position, item in enumerate(parsed):
+            if not isinstance(item, dict):
+                continue
+            item_position = item.get("index", position)
+            if isinstance(item_position, int) and 0 <= item_position < len(pending):
+                index = pending[item_position]
+                results[index] = self.normalize_result(item)
+                if cache_keys[index] is not None:
+                    cache.set(cache_keys[index], results[index])
+        return results
 
     def generate_final_report(
         self,
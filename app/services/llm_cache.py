@@ -0,0 +1,110 @@
+import json
+import time
+import hashlib
+import logging
+import threading
+from typing import Optional, List, Dict, Any
+
+from app.config import get_config
+from app.rag.db import (
+    get_playbook_version, get_llm_cache_entry, touch_llm_cache_entry, put_llm_cache_entry,
+    delete_llm_cache_entry, purge_llm_cache, evict_llm_cache
+)
+
+logger = logging.getLogger(__name__)
+
+EVICTION_INTERVAL = 100
+
+class LLMResultCache:
+    def __init__(self, max_entries: int = 10000, ttl_seconds: float = 30 * 24 * 3600):
+        self.max_entries = max_entries
+        self.ttl_seconds = ttl_seconds
+        self.hits = 0
+        self.misses = 0
+        self._writes = 0
+        self._playbook_version = None
+        self._lock = threading.Lock()
+
+    def make_key(
+        self,
+        model: str,
+        temperature: float,
+        system_prompt: str,
+        original_section: str,
+        modified_section: str,
+        change_type: str,
+        rule_ids: List[Any]
+    ) -> str:
+        payload = json.dumps(
+            [model, temperature, system_prompt, original_section, modified_section, change_type, rule_ids],
+            ensure_ascii=False
+        )
+        return hashlib.sha256(payload.encode("utf-8")).hexdigest()
+
+    def current_playbook_version(self) -> int:
+        version = get_playbook_version()
+        with self._lock:
+            changed = self._playbook_version is not None and version != self._playbook_version
+            self._playbook_version = version
+        if changed:
+            removed = purge_llm_cache(playbook_version=version)
+            logger.info(f"Playbook changed, invalidated {removed} cached LLM assessments")
+        return version
+
+    def get(self, key: str) -> Optional[Dict[str, Any]]:
+        version = self.current_playbook_version()
+        entry = get_llm_cache_entry(key)
+
+        if entry is not None and (
+            entry["playbook_version"] != version or time.time() - entry["created_at"] > self.ttl_seconds
+        ):
+            delete_llm_cache_entry(key)
+            entry = None
+
+        with self._lock:
+            if entry is None:
+                self.misses += 1
+                return None
+            self.hits += 1
+
+        touch_llm_cache_entry(key)
+        return entry["result"]
+
+    def set(self, key: str, result: Dict[str, Any]):
+        put_llm_cache_entry(key, result, self.current_playbook_version())
+
+        with self._lock:
+            self._writes += 1
+            should_evict = self._writes % EVICTION_INTERVAL == 0
+
+        if should_evict:
+            purge_llm_cache(created_before=time.time() - self.ttl_seconds)
+            evict_llm_cache(self.max_entries)
+
+    def invalidate(self):
+        purge_llm_cache()
+
+    def stats(self) -> Dict[str, Any]:
+        with self._lock:
+            total = self.hits + self.misses
+            return {
+                "hits": self.hits,
+                "misses": self.misses,
+                "hit_rate": self.hits / total if total else 0.0,
+                "max_entries": self.max_entries,
+                "ttl_seconds": self.ttl_seconds
+            }
+
+llm_cache: Optional[LLMResultCache] = None
+
+def get_llm_cache() -> Optional[LLMResultCache]:
+    global llm_cache
+    cache_config = get_config().get("llm_cache", {})
+    if not cache_config.get("enabled", True):
+        return None
+    if llm_cache is None:
+        llm_cache = LLMResultCache(
+            max_entries=cache_config.get("max_entries", 10000),
+            ttl_seconds=cache_config.get("ttl_seconds", 30 * 24 * 3600)
+        )
+    return llm_cache
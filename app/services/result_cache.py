@@ -0,0 +1,57 @@
+import os
+import json
+import hashlib
+import logging
+from typing import Optional
+
+from app.config import get_config
+from app.rag.db import document_hash, get_playbook_version, get_templates_version, find_reusable_task, clone_task
+from app.services.diff_engine import SEGMENTATION_VERSION
+
+logger = logging.getLogger(__name__)
+
+# Config sections whose settings can change what a review produces.
+RESULT_CONFIG_SECTIONS = ("llm", "embeddings", "analysis", "retrieval", "vector_index")
+
+def get_result_cache_config() -> dict:
+    return get_config().get("result_cache", {})
+
+def analysis_version() -> list:
+    # Anything besides the inputs that a finished review depends on; a change here makes every
+    # earlier review a miss.
+    config = get_config()
+    return [
+        SEGMENTATION_VERSION,
+        get_playbook_version(),
+        get_templates_version(),
+        os.getenv("USE_LLM", "false").lower() == "true",
+        {section: config.get(section, {}) for section in RESULT_CONFIG_SECTIONS}
+    ]
+
+def result_key(original_hash: str, modified_hash: str, category: Optional[str], version: list) -> str:
+    payload = json.dumps([original_hash, modified_hash, category, version], ensure_ascii=False, sort_keys=True)
+    return hashlib.sha256(payload.encode("utf-8")).hexdigest()
+
+def make_result_key(original_text: str, modified_text: str, category: Optional[str]) -> str:
+    return result_key(document_hash(original_text), document_hash(modified_text), category, analysis_version())
+
+def reuse_review(task_id: str, result_key: str) -> Optional[str]:
+    # Creates task_id as a copy of the newest reusable review with the same key and returns its
+    # status, or None when there is nothing to reuse.
+    source_task_id = find_reusable_task(result_key, get_result_cache_config().get("ttl_seconds", 2592000))
+    if source_task_id is None:
+        return None
+    
+    status = clone_task(source_task_id, task_id)
+    if status == "waiting_human":
+        from app.graph.workflow import copy_paused_review
+        
+        try:
+            copy_paused_review(source_task_id, task_id)
+        except Exception as e:
+            # resume_contract_review rebuilds the paused state from the stored task instead.
+            logger.warning(f"Failed to copy paused review {source_task_id} to {task_id}: {str(e)}")
+    
+    if status is not None:
+        logger.info(f"Task {task_id} reused the review of task {source_task_id}")
+    return status
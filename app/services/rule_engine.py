@@ -0,0 +1,204 @@
+import re
+import math
+import logging
+import threading
+from typing import List, Dict, Any, Optional, Tuple, NamedTuple
+
+logger = logging.getLogger(__name__)
+
+CN_DIGITS = {"零": 0, "〇": 0, "一": 1, "二": 2, "两": 2, "三": 3, "四": 4, "五": 5, "六": 6, "七": 7, "八": 8, "九": 9}
+CN_UNITS = {"十": 10, "百": 100, "千": 1000}
+CN_SECTIONS = {"万": 10 ** 4, "亿": 10 ** 8}
+
+NUMBER = r"\d+(?:[.,]\d+)*|[零〇一二两三四五六七八九十百千万亿]+"
+
+VALUE_PATTERN = re.compile(rf"""
+    (?P<date>\d{{2,4}}\s*年\s*\d{{1,2}}\s*月(?:\s*\d{{1,2}}\s*[日号])?|\d{{1,2}}\s*月\s*\d{{1,2}}\s*[日号])
+  | 百分之(?P<percent_cn>{NUMBER})
+  | (?P<percent>{NUMBER})\s*[%％]
+  | (?P<tenths>{NUMBER})\s*成
+  | (?P<forever>永久|无限期)
+  | (?P<half_year>半年)
+  | (?P<duration>{NUMBER})\s*(?P<duration_unit>个月|月|年|天|日|周)
+  | (?P<amount>{NUMBER})\s*(?P<amount_unit>亿元|万元|元|亿|万)
+""", re.VERBOSE)
+
+SEGMENT_PATTERN = re.compile(r"[。；;，,、\n]")
+
+DURATION_MONTHS = {"个月": 1, "月": 1, "年": 12, "天": 1 / 30, "日": 1 / 30, "周": 7 / 30}
+AMOUNT_YUAN = {"元": 1, "万元": 10 ** 4, "万": 10 ** 4, "亿元": 10 ** 8, "亿": 10 ** 8}
+
+OPERATORS = {
+    "<": lambda value, threshold: value < threshold,
+    "<=": lambda value, threshold: value <= threshold,
+    ">": lambda value, threshold: value > threshold,
+    ">=": lambda value, threshold: value >= threshold,
+    "=": lambda value, threshold: value == threshold,
+}
+
+UNIT_LABELS = {"percent": "%", "month": "个月", "yuan": "元"}
+
+SEVERITY = {"green": 0, "yellow": 1, "red": 2}
+
+RISK_LEVEL_ALIASES = {"绿色": "green", "黄色": "yellow", "红色": "red"}
+
+def normalize_risk_level(risk_level: str) -> str:
+    return RISK_LEVEL_ALIASES.get(risk_level, risk_level)
+
+def parse_chinese_number(text: str) -> Optional[float]:
+    total, section, number = 0, 0, 0
+    for ch in text:
+        if ch in CN_DIGITS:
+            number = CN_DIGITS[ch]
+        elif ch in CN_UNITS:
+            section += (number or 1) * CN_UNITS[ch]
+            number = 0
+        elif ch in CN_SECTIONS:
+            total = (total + section + number) * CN_SECTIONS[ch]
+            section, number = 0, 0
+        else:
+            return None
+    return float(total + section + number)
+
+def parse_number(text: str) -> Optional[float]:
+    if text[0].isdigit():
+        try:
+            return float(text.replace(",", ""))
+        except ValueError:
+            return None
+    return parse_chinese_number(text)
+
+class Quantity(NamedTuple):
+    position: int
+    value: float
+    unit: str
+
+def extract_quantities(text: str) -> List[Quantity]:
+    quantities = []
+    for match in VALUE_PATTERN.finditer(text):
+        groups = match.groupdict()
+        if groups["date"]:
+            continue
+
+        if groups["forever"]:
+            value, unit = math.inf, "month"
+        elif groups["half_year"]:
+            value, unit = 6.0, "month"
+        else:
+            raw = next(groups[name] for name in ("percent_cn", "percent", "tenths", "duration", "amount") if groups[name])
+            number = parse_number(raw)
+            if number is None:
+                continue
+            if groups["percent_cn"] or groups["percent"]:
+                value, unit = number, "percent"
+            elif groups["tenths"]:
+                value, unit = number * 10, "percent"
+            elif groups["duration"]:
+                value, unit = number * DURATION_MONTHS[groups["duration_unit"]], "month"
+            else:
+                value, unit = number * AMOUNT_YUAN[groups["amount_unit"]], "yuan"
+
+        quantities.append(Quantity(match.start(), value, unit))
+    return quantities
+
+def format_value(value: float, unit: str) -> str:
+    if math.isinf(value):
+        return "永久"
+    number = f"{value:.2f}".rstrip("0").rstrip(".")
+    return f"{number}{UNIT_LABELS.get(unit, unit)}"
+
+class ThresholdMatch(NamedTuple):
+    rule: Dict[str, Any]
+    facts: List[str]
+
+class ThresholdRuleEngine:
+    # Compiled once per playbook version. Each condition names a field (aliases separated by
+    # "|"); a quantity in the clause is attributed to the nearest field mention in the same
+    # sentence segment. Conditions in a group are ANDed over the fields the clause mentions,
+    # groups are ORed, and the most severe matching rule wins.
+
+    def __init__(self, conditions: List[Dict[str, Any]]):
+        self.groups: Dict[Any, Dict[int, List[Dict[str, Any]]]] = {}
+        alias_fields: Dict[str, set] = {}
+
+        for condition in conditions:
+            self.groups.setdefault(condition["rule_id"], {}).setdefault(condition["group_no"], []).append(condition)
+            for alias in condition["field"].split("|"):
+                alias_fields.setdefault(alias.strip(), set()).add(condition["field"])
+
+        aliases = sorted((alias for alias in alias_fields if alias), key=len, reverse=True)
+        self.alias_fields = alias_fields
+        self.field_pattern = re.compile("|".join(re.escape(alias) for alias in aliases)) if aliases else None
+
+    def extract_fields(self, text: str) -> Dict[str, List[Tuple[float, str]]]:
+        if self.field_pattern is None or not text:
+            return {}
+
+        facts: Dict[str, List[Tuple[float, str]]] = {}
+        for segment in SEGMENT_PATTERN.split(text):
+            mentions = [(m.start(), m.group()) for m in self.field_pattern.finditer(segment)]
+            if mentions:
+                for quantity in extract_quantities(segment):
+                    _, alias = min(mentions, key=lambda mention: (abs(mention[0] - quantity.position), mention[0] > quantity.position))
+                    for field in self.alias_fields[alias]:
+                        facts.setdefault(field, []).append((quantity.value, quantity.unit))
+        return facts
+
+    def group_matches(self, conditions: List[Dict[str, Any]], facts: Dict[str, List[Tuple[float, str]]], require_all: bool) -> Optional[List[str]]:
+        evidence = []
+        for condition in conditions:
+            values = [value for value, unit in facts.get(condition["field"], []) if unit == condition["unit"]]
+            if not values:
+                continue
+
+            check = OPERATORS[condition["operator"]]
+            passed = [value for value in values if check(value, condition["threshold"])]
+            if not passed or (require_all and len(passed) != len(values)):
+                return None
+
+            field = condition["field"].split("|")[0]
+            evidence.append(
+                f"{field} {format_value(passed[0], condition['unit'])} {condition['operator']} "
+                f"{format_value(condition['threshold'], condition['unit'])}"
+            )
+        return evidence or None
+
+    def classify(self, text: str, rules: List[Dict[str, Any]]) -> Optional[ThresholdMatch]:
+        candidates = [rule for rule in rules if rule.get("id") in self.groups]
+        if not candidates:
+            return None
+
+        facts = self.extract_fields(text)
+        if not facts:
+            return None
+
+        best, best_severity = None, -1
+        for rule in candidates:
+            # A clause is compliant only if every value is within bounds; it is flagged as
+            # soon as any value crosses a red/yellow threshold.
+            severity = SEVERITY.get(normalize_risk_level(rule.get("risk_level", "")), 1)
+            for conditions in self.groups[rule["id"]].values():
+                evidence = self.group_matches(conditions, facts, require_all=severity == 0)
+                if evidence is not None and severity > best_severity:
+                    best, best_severity = ThresholdMatch(rule, evidence), severity
+                    break
+        return best
+
+_engine: Optional[ThresholdRuleEngine] = None
+_engine_version = None
+_engine_lock = threading.Lock()
+
+def get_threshold_engine() -> Optional[ThresholdRuleEngine]:
+    global _engine, _engine_version
+    from app.rag.db import get_playbook_version, get_playbook_conditions
+
+    try:
+        version = get_playbook_version()
+        with _engine_lock:
+            if _engine is None or _engine_version != version:
+                _engine = ThresholdRuleEngine(get_playbook_conditions())
+                _engine_version = version
+            return _engine
+    except Exception as e:
+        logger.warning(f"Threshold rules unavailable: {str(e)}")
+        return None
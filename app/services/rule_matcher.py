@@ -0,0 +1,187 @@
+import json
+import hashlib
+import threading
+from collections import deque, OrderedDict
+from typing import List, Dict, Any, Optional, Iterable, Tuple
+
+MATCHER_CACHE_SIZE = 8
+
+class AhoCorasick:
+    def __init__(self, patterns: List[str]):
+        self.goto: List[Dict[str, int]] = [{}]
+        self.fail: List[int] = [0]
+        self.output: List[List[int]] = [[]]
+
+        for index, pattern in enumerate(patterns):
+            node = 0
+            for ch in pattern:
+                child = self.goto[node].get(ch)
+                if child is None:
+                    child = len(self.goto)
+                    self.goto.append({})
+                    self.fail.append(0)
+                    self.output.append([])
+                    self.goto[node][ch] = child
+                node = child
+            self.output[node].append(index)
+
+        queue = deque(self.goto[0].values())
+        while queue:
+            node = queue.popleft()
+            for ch, child in self.goto[node].items():
+                queue.append(child)
+                state = self.fail[node]
+                while state and ch not in self.goto[state]:
+                    state = self.fail[state]
+                self.fail[child] = self.goto[state].get(ch, 0)
+                self.output[child] = self.output[child] + self.output[self.fail[child]]
+
+    def find_all(self, text: str) -> set:
+        goto, fail, output = self.goto, self.fail, self.output
+        found = set()
+        node = 0
+        for ch in text:
+            while node and ch not in goto[node]:
+                node = fail[node]
+            node = goto[node].get(ch, 0)
+            if output[node]:
+                found.update(output[node])
+        return found
+
+def rule_keywords(rule: Dict[str, Any]) -> List[str]:
+    keywords = (rule.get("keywords") or "").lower()
+    if not keywords:
+        return []
+    return [k.strip() for k in keywords.split(",")]
+
+class RuleMatcher:
+    # Scores rules exactly like the original keyword loop: +1 per keyword found in the diff text
+    # and +0.5 per keyword found in the rule's own description. The description part never
+    # depends on the diff, so it is computed once here; the diff part comes from a single
+    # automaton scan over all keywords.
+
+    def __init__(self, rules: List[Dict[str, Any]]):
+        self.rules = rules
+        self.positions = {}
+        self.static_scores = [0.0] * len(rules)
+        keyword_index: Dict[str, int] = {}
+        self.keyword_rules: List[List[Tuple[int, int]]] = []
+
+        for position, rule in enumerate(rules):
+            self.positions[rule.get("id")] = position
+            description = (rule.get("description") or "").lower()
+
+            counts: Dict[str, int] = {}
+            for keyword in rule_keywords(rule):
+                counts[keyword] = counts.get(keyword, 0) + 1
+                if keyword in description:
+                    self.static_scores[position] += 0.5
+
+            for keyword, count in counts.items():
+                if keyword not in keyword_index:
+                    keyword_index[keyword] = len(self.keyword_rules)
+                    self.keyword_rules.append([])
+                self.keyword_rules[keyword_index[keyword]].append((position, count))
+
+        # An empty keyword (from "a,,b") matches any text, as `"" in text` does.
+        self.always_matched = keyword_index.pop("", None)
+        self.automaton = AhoCorasick(list(keyword_index))
+        self.automaton_keywords = list(keyword_index.values())
+
+        self.static_best = None
+        for position, score in enumerate(self.static_scores):
+            if score > 0 and (self.static_best is None or score > self.static_scores[self.static_best]):
+                self.static_best = position
+
+    def text_scores(self, text: str) -> Dict[int, float]:
+        matched = [self.automaton_keywords[i] for i in self.automaton.find_all(text)]
+        if self.always_matched is not None:
+            matched.append(self.always_matched)
+
+        scores: Dict[int, float] = {}
+        for keyword in matched:
+            for position, count in self.keyword_rules[keyword]:
+                scores[position] = scores.get(position, 0.0) + count
+        return scores
+
+    def scores(self, text: str) -> Dict[int, float]:
+        scores = {
+            position: self.static_scores[position] + score
+            for position, score in self.text_scores(text).items()
+        }
+        for position, score in enumerate(self.static_scores):
+            if score > 0:
+                scores.setdefault(position, score)
+        return scores
+
+    def candidate_positions(self, rules: Iterable[Dict[str, Any]]) -> Optional[List[int]]:
+        # Maps a subset of the compiled rules (e.g. those retrieved for one difference) to
+        # positions, keeping its order so ties resolve as they would in a plain loop.
+        if len(self.positions) != len(self.rules):
+            return None
+        positions = []
+        for rule in rules:
+            position = self.positions.get(rule.get("id"))
+            if position is None:
+                return None
+            positions.append(position)
+        return positions
+
+    def best_match(self, text: str, candidates: Optional[List[int]] = None) -> Tuple[Optional[Dict[str, Any]], float]:
+        text_scores = self.text_scores(text)
+
+        if candidates is None:
+            candidates = sorted(text_scores)
+            if self.static_best is not None:
+                candidates = sorted(set(candidates) | {self.static_best})
+
+        best_position, best_score = None, 0
+        for position in candidates:
+            score = self.static_scores[position] + text_scores.get(position, 0.0)
+            if score > best_score:
+                best_position, best_score = position, score
+
+        if best_position is None:
+            return None, 0
+        return self.rules[best_position], best_score
+
+def rules_fingerprint(rules: List[Dict[str, Any]]) -> str:
+    payload = json.dumps(rules, ensure_ascii=False, sort_keys=True, default=str)
+    return hashlib.sha256(payload.encode("utf-8")).hexdigest()
+
+_matchers: "OrderedDict[str, RuleMatcher]" = OrderedDict()
+_matchers_lock = threading.Lock()
+
+def get_rule_matcher(rules: List[Dict[str, Any]]) -> RuleMatcher:
+    fingerprint = rules_fingerprint(rules)
+    with _matchers_lock:
+        matcher = _matchers.get(fingerprint)
+        if matcher is not None:
+            _matchers.move_to_end(fingerprint)
+            return matcher
+
+    matcher = RuleMatcher(rules)
+    with _matchers_lock:
+        _matchers[fingerprint] = matcher
+        while len(_matchers) > MATCHER_CACHE_SIZE:
+            _matchers.popitem(last=False)
+    return matcher
+
+_playbook_matchers: Dict[Optional[str], Tuple[int, RuleMatcher]] = {}
+
+def get_playbook_matcher(category: Optional[str] = None) -> RuleMatcher:
+    # One matcher over a category's whole rulebook, rebuilt only when the playbook changes. Each
+    # task's retrieved rules differ, so compiling them per task would not be shared; subsets are
+    # scored through candidate_positions instead.
+    from app.rag.db import get_playbook_version, get_all_playbook_rules
+
+    version = get_playbook_version()
+    with _matchers_lock:
+        cached = _playbook_matchers.get(category)
+        if cached is not None and cached[0] == version:
+            return cached[1]
+
+    matcher = RuleMatcher(get_all_playbook_rules(category))
+    with _matchers_lock:
+        _playbook_matchers[category] = (version, matcher)
+    return matcher
@@ -0,0 +1,108 @@
+import difflib
+from typing import List, Tuple, Callable
+
+import numpy as np
+
+MINHASH_SEED = 0x5EED
+SHINGLE_BASE = np.uint64(0x100000001B3)
+PAIR_CHUNK = 256
+
+def difflib_ratio(a: str, b: str, threshold: float = 0.0) -> float:
+    matcher = difflib.SequenceMatcher(None, a, b, autojunk=False)
+    if matcher.real_quick_ratio() < threshold or matcher.quick_ratio() < threshold:
+        return 0.0
+    return matcher.ratio()
+
+def max_ratio(a_length: int, b_length: int) -> float:
+    # Upper bound of a similarity ratio from lengths alone.
+    total = a_length + b_length
+    return 2.0 * min(a_length, b_length) / total if total else 1.0
+
+def lcs_length(a: str, b: str) -> int:
+    # Bit-parallel LCS (Allison-Dix / Hyyro): one big-int step per character of the shorter
+    # string, each step working on all positions of the longer one at once.
+    if len(a) < len(b):
+        a, b = b, a
+    if not b:
+        return 0
+
+    masks = {}
+    for position, ch in enumerate(a):
+        masks[ch] = masks.get(ch, 0) | (1 << position)
+
+    full = (1 << len(a)) - 1
+    v = full
+    for ch in b:
+        u = v & masks.get(ch, 0)
+        v = ((v + u) | (v - u)) & full
+    return len(a) - v.bit_count()
+
+def lcs_ratio(a: str, b: str, threshold: float = 0.0) -> float:
+    # Same scale as SequenceMatcher.ratio(): 2 * matched characters / total length.
+    total = len(a) + len(b)
+    if not total:
+        return 1.0
+    if max_ratio(len(a), len(b)) < threshold:
+        return 0.0
+    return 2.0 * lcs_length(a, b) / total
+
+SIMILARITY_KERNELS = {
+    "lcs": lcs_ratio,
+    "difflib": difflib_ratio,
+}
+
+def get_similarity_kernel(name: str) -> Callable[..., float]:
+    if name not in SIMILARITY_KERNELS:
+        raise ValueError(f"Unknown similarity kernel: {name}")
+    return SIMILARITY_KERNELS[name]
+
+class MinHasher:
+    # Character shingles hashed with numpy and reduced to num_perm minima under multiply-add
+    # hashes (mod 2**64). The fraction of equal minima estimates the Jaccard similarity of two
+    # shingle sets, which lets alignment skip pairs that cannot be similar.
+
+    def __init__(self, num_perm: int = 64, shingle_size: int = 2, seed: int = MINHASH_SEED):
+        rng = np.random.default_rng(seed)
+        self.num_perm = num_perm
+        self.shingle_size = shingle_size
+        self.a = rng.integers(1, 2 ** 63, size=num_perm, dtype=np.uint64) | np.uint64(1)
+        self.b = rng.integers(0, 2 ** 63, size=num_perm, dtype=np.uint64)
+
+    def shingles(self, text: str) -> np.ndarray:
+        codes = np.frombuffer(text.encode("utf-32-le"), dtype=np.uint32).astype(np.uint64)
+        if len(codes) < self.shingle_size:
+            return codes
+        hashes = np.zeros(len(codes) - self.shingle_size + 1, dtype=np.uint64)
+        for offset in range(self.shingle_size):
+            hashes = hashes * SHINGLE_BASE + codes[offset:offset + len(hashes)]
+        return np.unique(hashes)
+
+    def signatures(self, texts: List[str]) -> np.ndarray:
+        signatures = np.full((len(texts), self.num_perm), np.iinfo(np.uint64).max, dtype=np.uint64)
+        for row, text in enumerate(texts):
+            shingles = self.shingles(text)
+            if len(shingles):
+                signatures[row] = (np.outer(shingles, self.a) + self.b).min(axis=0)
+        return signatures
+
+    def candidate_pairs(self, a_texts: List[str], b_texts: List[str], min_jaccard: float) -> List[Tuple[int, int]]:
+        if not a_texts or not b_texts:
+            return []
+        a_signatures = self.signatures(a_texts)
+        b_signatures = self.signatures(b_texts)
+
+        pairs = []
+        for start in range(0, len(a_texts), PAIR_CHUNK):
+            chunk = a_signatures[start:start + PAIR_CHUNK]
+            agreement = (chunk[:, None, :] == b_signatures[None, :, :]).mean(axis=2)
+            rows, cols = np.nonzero(agreement >= min_jaccard)
+            pairs.extend(zip((rows + start).tolist(), cols.tolist()))
+        return pairs
+
+_minhashers = {}
+
+def get_minhasher(num_perm: int = 64, shingle_size: int = 2) -> MinHasher:
+    key = (num_perm, shingle_size)
+    if key not in _minhashers:
+        _minhashers[key] = MinHasher(num_perm, shingle_size)
+    return _minhashers[key]
@@ -0,0 +1,210 @@
+import os
+import uuid
+import time
+import signal
+import socket
+import logging
+import argparse
+import threading
+from typing import Optional
+
+from app.config import get_config
+from app.rag.db import (
+    init_db, claim_task, claim_next_task, heartbeat_task, finish_task, requeue_task,
+    get_task_texts, get_task_text_sizes, has_pending_batch_tasks
+)
+from app.services.executor import TaskCancelledError
+from app.services.events import publish_task_event
+
+logger = logging.getLogger(__name__)
+
+def get_queue_config() -> dict:
+    config = get_config()
+    task_config = config.get("task", {})
+    queue_config = config.get("queue", {})
+    return {
+        "max_retries": task_config.get("max_retries", 3),
+        "retry_delay": task_config.get("retry_delay", 2),
+        "lease_seconds": queue_config.get("lease_seconds", 60),
+        "heartbeat_interval": queue_config.get("heartbeat_interval", 15),
+        "poll_interval": queue_config.get("poll_interval", 1),
+    }
+
+def uses_streaming_analysis(task_id: str) -> bool:
+    streaming_config = get_config().get("analysis", {}).get("streaming", {})
+    if not streaming_config.get("enabled", True):
+        return False
+    threshold = streaming_config.get("threshold_bytes", 2 * 1024 * 1024)
+    return max(get_task_text_sizes(task_id).values()) >= threshold
+
+def new_worker_id() -> str:
+    return f"{socket.gethostname()}-{os.getpid()}-{uuid.uuid4().hex[:6]}"
+
+def heartbeat_loop(task_id: str, worker_id: str, lease_seconds: float, interval: float,
+                   stop_event: threading.Event, cancel_event: threading.Event):
+    while not stop_event.wait(interval):
+        if not heartbeat_task(task_id, worker_id, lease_seconds):
+            logger.warning(f"Task {task_id} lease lost or task cancelled, stopping")
+            cancel_event.set()
+            return
+
+def process_claimed_task(task: dict, worker_id: str, cancel_event: Optional[threading.Event] = None) -> str:
+    from app.graph.workflow import run_contract_review
+
+    queue_config = get_queue_config()
+    task_id = task["task_id"]
+    cancel_event = cancel_event or threading.Event()
+
+    stop_heartbeat = threading.Event()
+    heartbeat = threading.Thread(
+        target=heartbeat_loop,
+        args=(task_id, worker_id, queue_config["lease_seconds"], queue_config["heartbeat_interval"],
+              stop_heartbeat, cancel_event),
+        daemon=True
+    )
+    heartbeat.start()
+
+    logger.info(f"Task {task_id} started processing (attempt {task['attempts']})")
+    publish_task_event(task_id, "status", status="in_progress", attempt=task["attempts"])
+
+    try:
+        # Large contracts are never loaded whole: the analyzer streams them from the tasks row
+        # and appends differences to task_differences as it goes.
+        streaming = uses_streaming_analysis(task_id)
+        original_text, modified_text = ("", "") if streaming else get_task_texts(task_id)
+        
+        result = run_contract_review(
+            task_id=task_id,
+            original_text=original_text,
+            modified_text=modified_text,
+            category=task.get("category") or "",
+            cancel_event=cancel_event,
+            streaming=streaming
+        )
+
+        if cancel_event.is_set():
+            raise TaskCancelledError(f"Task {task_id} was cancelled")
+
+        results = {
+            "evaluations": result.get("evaluations", []),
+            "human_reviews": result.get("human_reviews", []),
+            "final_report": result.get("final_report")
+        }
+        if not streaming:
+            # Streamed differences are already stored by the analyzer.
+            results["differences"] = result.get("differences", [])
+        
+        finish_task(task_id, worker_id, result["status"], **results)
+        logger.info(f"Task {task_id} completed with status: {result['status']}")
+        publish_task_event(task_id, "status", status=result["status"])
+        return result["status"]
+
+    except TaskCancelledError:
+        logger.info(f"Task {task_id} cancelled")
+        finish_task(task_id, worker_id, "cancelled")
+        publish_task_event(task_id, "status", status="cancelled")
+        return "cancelled"
+
+    except Exception as e:
+        logger.error(f"Task {task_id} failed: {str(e)}")
+
+        if task["attempts"] < queue_config["max_retries"]:
+            logger.info(f"Requeueing task {task_id} in {queue_config['retry_delay']} seconds...")
+            requeue_task(task_id, delay=queue_config["retry_delay"])
+            publish_task_event(task_id, "status", status="pending", error=str(e))
+            return "retry"
+
+        logger.error(f"Task {task_id} failed after {task['attempts']} attempts")
+        finish_task(task_id, worker_id, "failed", error=str(e))
+        publish_task_event(task_id, "status", status="failed", error=str(e))
+        return "failed"
+
+    finally:
+        stop_heartbeat.set()
+
+def run_task(task_id: str, cancel_event: Optional[threading.Event] = None) -> Optional[str]:
+    queue_config = get_queue_config()
+    worker_id = new_worker_id()
+
+    while True:
+        task = claim_task(task_id, worker_id, queue_config["lease_seconds"], queue_config["max_retries"])
+        if task is None:
+            logger.info(f"Task {task_id} is not claimable, skipping")
+            return None
+
+        outcome = process_claimed_task(task, worker_id, cancel_event)
+        if outcome != "retry":
+            return outcome
+
+        if cancel_event is not None:
+            if cancel_event.wait(queue_config["retry_delay"]):
+                return "cancelled"
+        else:
+            time.sleep(queue_config["retry_delay"])
+
+def run_batch(batch_id: str, cancel_event: Optional[threading.Event] = None) -> int:
+    # Drains one batch from a single executor slot, so a large batch cannot take over the pool.
+    # A cancelled task only stops itself; cancel_event stops the whole drain between tasks.
+    queue_config = get_queue_config()
+    worker_id = new_worker_id()
+    cancel_event = cancel_event or threading.Event()
+    processed = 0
+    
+    while not cancel_event.is_set():
+        task = claim_next_task(
+            worker_id, queue_config["lease_seconds"], batch_id=batch_id, max_attempts=queue_config["max_retries"]
+        )
+        if task is None:
+            if not has_pending_batch_tasks(batch_id):
+                break
+            # Only retries waiting out their delay are left.
+            cancel_event.wait(queue_config["poll_interval"])
+            continue
+        
+        process_claimed_task(task, worker_id)
+        processed += 1
+    
+    logger.info(f"Batch {batch_id}: worker {worker_id} processed {processed} tasks")
+    return processed
+
+def run_worker(worker_id: Optional[str] = None, stop_event: Optional[threading.Event] = None, once: bool = False):
+    queue_config = get_queue_config()
+    worker_id = worker_id or new_worker_id()
+    stop_event = stop_event or threading.Event()
+
+    logger.info(f"Worker {worker_id} started")
+
+    while not stop_event.is_set():
+        task = claim_next_task(worker_id, queue_config["lease_seconds"], max_attempts=queue_config["max_retries"])
+
+        if task is None:
+            if once:
+                break
+            stop_event.wait(queue_config["poll_interval"])
+            continue
+
+        process_claimed_task(task, worker_id)
+
+    logger.info(f"Worker {worker_id} stopped")
+
+def main():
+    parser = argparse.ArgumentParser(description="ContractGuardAgent review worker")
+    parser.add_argument("--once", action="store_true", help="drain the queue and exit")
+    args = parser.parse_args()
+
+    config = get_config()
+    logging.basicConfig(
+        level=getattr(logging, config.get("logging", {}).get("level", "INFO")),
+        format=config.get("logging", {}).get("format", "%(asctime)s - %(name)s - %(levelname)s - %(message)s")
+    )
+
+    init_db()
+
+    stop_event = threading.Event()
+    signal.signal(signal.SIGTERM, lambda signum, frame: stop_event.set())
+    signal.signal(signal.SIGINT, lambda signum, frame: stop_event.set())
+
+    run_worker(stop_event=stop_event, once=args.once)
+
+if __name__ == "__main__":
+    main()
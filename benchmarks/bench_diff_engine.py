@@ -0,0 +1,96 @@
+"""Clause diff on synthetic ~1 MB contract pairs: similarity kernel and MinHash prefilter.
+
+    python -m benchmarks.bench_diff_engine --clauses 2800 --edited 0.2
+"""
+import time
+import random
+import argparse
+
+from app.services.diff_engine import clause_differences
+from app.services.similarity import get_similarity_kernel, get_minhasher
+
+COMMON_PHRASES = [
+    "甲方应当", "乙方应于", "合同签订后", "验收合格之日起", "按照国家有关规定", "支付合同总额的",
+    "违约金", "承担赔偿责任", "书面通知对方", "不可抗力", "保密义务", "知识产权归属",
+    "争议提交", "人民法院管辖", "质保期内", "免费维修", "工作日内", "双方协商一致",
+]
+
+# Boilerplate phrases plus a larger pool of clause-specific terms, so clauses share some
+# vocabulary without being near-duplicates of each other.
+VOCABULARY_RNG = random.Random(42)
+PHRASES = COMMON_PHRASES + [
+    "".join(chr(VOCABULARY_RNG.randint(0x4E00, 0x4E00 + 2500)) for _ in range(VOCABULARY_RNG.randint(2, 4)))
+    for _ in range(2000)
+]
+
+def make_clause(rng: random.Random) -> str:
+    return "".join(
+        rng.choice(COMMON_PHRASES) if rng.random() < 0.3 else rng.choice(PHRASES)
+        for _ in range(rng.randint(25, 45))
+    ) + "。"
+
+def edit_clause(rng: random.Random, text: str) -> str:
+    chars = list(text)
+    for _ in range(rng.randint(3, 12)):
+        position = rng.randrange(len(chars))
+        chars[position:position + rng.randint(0, 4)] = rng.choice(PHRASES)
+    return "".join(chars)
+
+def make_pair(rng: random.Random, count: int, edited: float):
+    bodies = [make_clause(rng) for _ in range(count)]
+    modified = []
+    for body in bodies:
+        roll = rng.random()
+        if roll < 0.02:
+            continue
+        modified.append(edit_clause(rng, body) if roll < edited else body)
+        if rng.random() < 0.02:
+            modified.append(make_clause(rng))
+    for _ in range(count // 50):
+        modified.insert(rng.randrange(len(modified)), modified.pop(rng.randrange(len(modified))))
+
+    render = lambda clauses: "\n".join(f"第{i}条 {body}" for i, body in enumerate(clauses, 1))
+    return render(bodies), render(modified)
+
+def main():
+    parser = argparse.ArgumentParser()
+    parser.add_argument("--clauses", type=int, default=2800)
+    parser.add_argument("--edited", type=float, default=0.2)
+    args = parser.parse_args()
+
+    original, modified = make_pair(random.Random(0), args.clauses, args.edited)
+    size = len(original.encode("utf-8")) / 2 ** 20
+    print(f"{args.clauses} clauses, original {size:.2f} MB, modified {len(modified.encode('utf-8')) / 2 ** 20:.2f} MB")
+
+    baseline = None
+    for kernel_name, prefilter in [("difflib", False), ("lcs", False), ("difflib", True), ("lcs", True)]:
+        minhasher = get_minhasher() if prefilter else None
+        start = time.perf_counter()
+        differences = clause_differences(original, modified, 0.5, get_similarity_kernel(kernel_name), minhasher, 0.15)
+        seconds = time.perf_counter() - start
+
+        counts = {}
+        for diff in differences:
+            counts[diff["change_type"]] = counts.get(diff["change_type"], 0) + 1
+        if baseline is None:
+            baseline = seconds
+        label = f"{kernel_name}{' + minhash' if prefilter else ''}"
+        print(f"{label:18} {seconds:8.2f} s   {baseline / seconds:6.1f}x   {counts}")
+
+    # Kernel cost on a single long clause pair, where SequenceMatcher is quadratic.
+    rng = random.Random(1)
+    for length in (10, 40):
+        a = "".join(make_clause(rng) for _ in range(length))
+        b = a
+        for _ in range(length):
+            b = edit_clause(rng, b)
+        timings = []
+        for kernel_name in ("difflib", "lcs"):
+            kernel = get_similarity_kernel(kernel_name)
+            start = time.perf_counter()
+            ratio = kernel(a, b)
+            timings.append(f"{kernel_name} {(time.perf_counter() - start) * 1000:6.1f} ms (ratio {ratio:.3f})")
+        print(f"{len(a):5} chars       " + "   ".join(timings))
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,62 @@
+"""Storage for one template compared against many redlines: inline texts vs the document store.
+
+    python -m benchmarks.bench_document_store --clauses 2800 --tasks 100
+
+Prints the bytes the old schema kept inline per task against what documents holds, the save
+time per task and template segmentation with and without the memo.
+"""
+import os
+import time
+import random
+import argparse
+import tempfile
+
+from benchmarks.bench_diff_engine import make_pair, edit_clause
+
+def make_redline(rng: random.Random, template: str, edited: float) -> str:
+    lines = template.split("\n")
+    return "\n".join(edit_clause(rng, line) if rng.random() < edited else line for line in lines)
+
+def main():
+    parser = argparse.ArgumentParser()
+    parser.add_argument("--clauses", type=int, default=2800)
+    parser.add_argument("--tasks", type=int, default=100)
+    parser.add_argument("--edited", type=float, default=0.05)
+    args = parser.parse_args()
+
+    from app.rag import db
+    from app.graph import nodes
+
+    rng = random.Random(0)
+    template, _ = make_pair(rng, args.clauses, 0.0)
+    redlines = [make_redline(rng, template, args.edited) for _ in range(args.tasks)]
+
+    with tempfile.TemporaryDirectory() as tmp:
+        db.DB_PATH = os.path.join(tmp, "bench.db")
+        db.init_db()
+
+        start = time.perf_counter()
+        for k, redline in enumerate(redlines):
+            db.save_task(f"bench-{k}", {"original_text": template, "modified_text": redline})
+        save_ms = (time.perf_counter() - start) * 1000 / args.tasks
+
+        inline = sum(len(template.encode("utf-8")) + len(redline.encode("utf-8")) for redline in redlines)
+        stored, codec = db.get_connection().execute(
+            "SELECT SUM(length(content)), group_concat(DISTINCT codec) FROM documents"
+        ).fetchone()
+        print(f"template {len(template.encode('utf-8')) / 2 ** 20:.2f} MB, {args.tasks} redlines")
+        print(f"inline texts   {inline / 2 ** 20:8.1f} MB")
+        print(f"documents      {stored / 2 ** 20:8.1f} MB   ({codec}, {inline / stored:.1f}x smaller)")
+        print(f"save_task      {save_ms:8.1f} ms per task")
+
+        # The template is shared by every task, so the first document_clauses call stores its clauses.
+        nodes.document_clauses(template)
+        for label, segment in (("segment", nodes.segment_clauses), ("memoized", nodes.document_clauses)):
+            start = time.perf_counter()
+            for _ in range(10):
+                segment(template)
+            print(f"{label:14} {(time.perf_counter() - start) * 100:8.1f} ms per template segmentation")
+        db.close_connections()
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,118 @@
+"""FTS relevance and latency on a synthetic Chinese clause corpus: legacy unicode61 +
+whitespace query vs bigram segmentation + weighted BM25, with and without common-term pruning.
+
+    python -m benchmarks.bench_fts_search --docs 20000 --queries 200
+"""
+import os
+import re
+import time
+import random
+import sqlite3
+import argparse
+import tempfile
+import numpy as np
+
+from app.rag import db
+
+TOPICS = {
+    "付款方式": ["预付款比例", "验收后支付尾款", "分期付款安排", "合同总金额", "付款期限"],
+    "违约责任": ["违约金上限", "逾期交付赔偿", "损失赔偿范围", "违约金比例", "解除合同责任"],
+    "保密条款": ["商业秘密保护", "保密期限届满", "泄露保密信息", "保密义务人员", "永久保密"],
+    "知识产权": ["成果知识产权归属", "专利申请权", "著作权共有", "侵权责任承担", "许可使用范围"],
+    "竞业限制": ["竞业限制期限", "竞业限制补偿金", "离职后同业竞争", "竞业地域范围", "违反竞业赔偿"],
+    "租赁押金": ["押金退还期限", "押金金额上限", "租金支付周期", "房屋维修责任", "提前退租违约"],
+    "争议解决": ["仲裁委员会管辖", "诉讼管辖法院", "适用法律选择", "友好协商解决", "争议期间履行"],
+    "交付验收": ["交付地点约定", "验收标准确认", "质量异议期限", "验收不合格处理", "所有权转移"],
+}
+FILLER = ["双方", "本合同", "应当", "按照", "约定", "履行", "书面通知", "相关", "条款", "之日起", "有效", "甲方", "乙方"]
+
+def make_clause(rng: random.Random, topic: str) -> tuple:
+    phrases = rng.sample(TOPICS[topic], 2)
+    words = phrases + rng.sample(FILLER, 6)
+    rng.shuffle(words)
+    return f"{topic}条款{rng.randint(1, 999)}", "通用", "，".join(words) + "。"
+
+def make_query(rng: random.Random, topic: str) -> str:
+    return f"关于{rng.choice(TOPICS[topic])}的约定是否合理"
+
+def legacy_escape(query: str) -> str:
+    words = re.sub(r"[^\w\s一-鿿]", " ", query).split()
+    return " OR ".join(f'"{w}"' for w in words[:10]) if words else '"*"'
+
+def build_legacy(path: str, corpus: list) -> sqlite3.Connection:
+    conn = sqlite3.connect(path, isolation_level=None)
+    conn.execute("CREATE TABLE templates (id INTEGER PRIMARY KEY, title TEXT, category TEXT, content TEXT)")
+    conn.execute("CREATE VIRTUAL TABLE templates_fts USING fts5(title, category, content, content=templates, content_rowid=id)")
+    conn.execute("BEGIN")
+    conn.executemany("INSERT INTO templates (title, category, content) VALUES (?, ?, ?)", corpus)
+    conn.execute("INSERT INTO templates_fts(templates_fts) VALUES ('rebuild')")
+    conn.execute("COMMIT")
+    return conn
+
+def legacy_search(conn, query: str, top_k: int) -> list:
+    return [row[0] for row in conn.execute("""
+        SELECT t.title FROM templates t JOIN templates_fts fts ON t.id = fts.rowid
+        WHERE templates_fts MATCH ? ORDER BY rank LIMIT ?
+    """, (legacy_escape(query), top_k))]
+
+def build_current(path: str, corpus: list):
+    db.DB_PATH = path
+    db.init_db()
+    with db.transaction() as conn:
+        conn.execute("DELETE FROM templates")
+        conn.executemany("INSERT INTO templates (title, category, content) VALUES (?, ?, ?)", corpus)
+
+def current_search(query: str, top_k: int) -> list:
+    return [t["title"] for t in db.search_templates(query, top_k)]
+
+def evaluate(search, queries: list, top_k: int) -> dict:
+    precisions, reciprocal_ranks, latencies = [], [], []
+    for topic, query in queries:
+        start = time.perf_counter()
+        titles = search(query, top_k)
+        latencies.append((time.perf_counter() - start) * 1000)
+
+        relevant = [title.startswith(topic) for title in titles]
+        precisions.append(sum(relevant) / top_k)
+        reciprocal_ranks.append(next((1 / (i + 1) for i, hit in enumerate(relevant) if hit), 0.0))
+    return {
+        "p@k": np.mean(precisions),
+        "mrr": np.mean(reciprocal_ranks),
+        "avg_ms": np.mean(latencies),
+        "p99_ms": np.percentile(latencies, 99),
+    }
+
+def main():
+    parser = argparse.ArgumentParser()
+    parser.add_argument("--docs", type=int, default=20000)
+    parser.add_argument("--queries", type=int, default=200)
+    parser.add_argument("--top-k", type=int, default=5)
+    args = parser.parse_args()
+
+    rng = random.Random(0)
+    topics = list(TOPICS)
+    corpus = [make_clause(rng, rng.choice(topics)) for _ in range(args.docs)]
+    queries = [(topic, make_query(rng, topic)) for topic in (rng.choice(topics) for _ in range(args.queries))]
+
+    with tempfile.TemporaryDirectory() as tmp:
+        legacy_conn = build_legacy(os.path.join(tmp, "legacy.db"), corpus)
+        build_current(os.path.join(tmp, "current.db"), corpus)
+
+        results = {"legacy unicode61": evaluate(lambda q, k: legacy_search(legacy_conn, q, k), queries, args.top_k)}
+
+        common_term_ratio = db.COMMON_TERM_RATIO
+        db.COMMON_TERM_RATIO = float("inf")
+        results["bigram, all terms"] = evaluate(current_search, queries, args.top_k)
+        db.COMMON_TERM_RATIO = common_term_ratio
+        results["bigram + pruning"] = evaluate(current_search, queries, args.top_k)
+
+        legacy_conn.close()
+        db.close_connections()
+
+    print(f"{args.docs} clauses, {args.queries} queries, k={args.top_k}")
+    print(f"{'pipeline':<20}{'p@k':>8}{'mrr':>8}{'avg ms':>10}{'p99 ms':>10}")
+    for name, r in results.items():
+        print(f"{name:<20}{r['p@k']:>8.3f}{r['mrr']:>8.3f}{r['avg_ms']:>10.2f}{r['p99_ms']:>10.2f}")
+
+if __name__ == "__main__":
+    main()
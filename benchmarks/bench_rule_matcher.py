@@ -0,0 +1,85 @@
+"""Rule-based evaluator: the original per-rule keyword loop vs the compiled Aho-Corasick matcher.
+
+    python -m benchmarks.bench_rule_matcher --rules 10000 --diffs 1000
+"""
+import time
+import random
+import argparse
+
+from app.services.rule_matcher import RuleMatcher
+
+SYLLABLES = "甲乙丙丁押金违约保密竞业知识产权付款期限比例租赁采购服务劳动赔偿责任合同条款"
+
+def random_word(rng: random.Random) -> str:
+    return "".join(rng.choice(SYLLABLES) for _ in range(rng.randint(2, 4)))
+
+def make_rules(rng: random.Random, count: int) -> list:
+    return [{
+        "id": i,
+        "rule_name": f"rule-{i}",
+        "keywords": ",".join(random_word(rng) for _ in range(rng.randint(1, 4))),
+        "description": "".join(random_word(rng) for _ in range(5)),
+        "risk_level": "黄色",
+        "action": "",
+    } for i in range(count)]
+
+def make_diffs(rng: random.Random, count: int) -> list:
+    return [{
+        "original_section": "".join(random_word(rng) for _ in range(20)),
+        "modified_section": "".join(random_word(rng) for _ in range(20)),
+    } for _ in range(count)]
+
+def legacy_best_match(diff: dict, rules: list):
+    modified_text = diff.get("modified_section", "")
+    original_text = diff.get("original_section", "")
+    best_match_rule, best_score = None, 0
+    for rule in rules:
+        keywords = rule.get("keywords", "").lower()
+        rule_desc = rule.get("description", "").lower()
+        text_to_check = (modified_text + " " + original_text).lower()
+        score = 0
+        if keywords:
+            for kw in [k.strip() for k in keywords.split(",")]:
+                if kw in text_to_check:
+                    score += 1
+                if kw in rule_desc:
+                    score += 0.5
+        if score > best_score:
+            best_score, best_match_rule = score, rule
+    return best_match_rule, best_score
+
+def main():
+    parser = argparse.ArgumentParser()
+    parser.add_argument("--rules", type=int, default=10000)
+    parser.add_argument("--diffs", type=int, default=1000)
+    args = parser.parse_args()
+
+    rng = random.Random(0)
+    rules = make_rules(rng, args.rules)
+    diffs = make_diffs(rng, args.diffs)
+
+    start = time.perf_counter()
+    legacy = [legacy_best_match(diff, rules) for diff in diffs]
+    legacy_seconds = time.perf_counter() - start
+
+    start = time.perf_counter()
+    matcher = RuleMatcher(rules)
+    build_seconds = time.perf_counter() - start
+
+    start = time.perf_counter()
+    compiled = [
+        matcher.best_match((diff["modified_section"] + " " + diff["original_section"]).lower())
+        for diff in diffs
+    ]
+    scan_seconds = time.perf_counter() - start
+
+    assert [(r and r["id"], s) for r, s in legacy] == [(r and r["id"], s) for r, s in compiled]
+
+    print(f"{args.rules} rules x {args.diffs} diffs (results identical)")
+    print(f"legacy loop        {legacy_seconds:8.2f} s   {legacy_seconds / args.diffs * 1000:8.2f} ms/diff")
+    print(f"matcher build      {build_seconds:8.2f} s")
+    print(f"matcher scan       {scan_seconds:8.2f} s   {scan_seconds / args.diffs * 1000:8.2f} ms/diff")
+    print(f"speedup (scan)     {legacy_seconds / scan_seconds:8.1f}x")
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,103 @@
+"""Status-poll throughput: connect-per-call (legacy) vs pooled WAL connections.
+
+    python -m benchmarks.bench_status_poll --threads 8 --seconds 3
+"""
+import os
+import json
+import time
+import random
+import sqlite3
+import argparse
+import tempfile
+import threading
+
+from app.rag import db
+
+def legacy_get_task(task_id: str):
+    conn = sqlite3.connect(db.get_db_path())
+    conn.row_factory = sqlite3.Row
+    cursor = conn.cursor()
+    cursor.execute("SELECT * FROM tasks WHERE task_id = ?", (task_id,))
+    row = cursor.fetchone()
+    conn.close()
+    task = dict(row)
+    task["differences"] = json.loads(task.get("differences") or "[]")
+    task["evaluations"] = json.loads(task.get("evaluations") or "[]")
+    task["human_reviews"] = json.loads(task.get("human_reviews") or "[]")
+    return task
+
+def legacy_update_task_status(task_id: str, status: str):
+    conn = sqlite3.connect(db.get_db_path())
+    conn.execute("UPDATE tasks SET status = ?, updated_at = CURRENT_TIMESTAMP WHERE task_id = ?", (status, task_id))
+    conn.commit()
+    conn.close()
+
+def run(get_fn, update_fn, task_ids, threads: int, seconds: float) -> dict:
+    stop = threading.Event()
+    latencies = [[] for _ in range(threads)]
+
+    def poller(slot):
+        rng = random.Random(slot)
+        while not stop.is_set():
+            start = time.perf_counter()
+            get_fn(rng.choice(task_ids))
+            latencies[slot].append(time.perf_counter() - start)
+
+    def writer():
+        rng = random.Random(-1)
+        while not stop.is_set():
+            update_fn(rng.choice(task_ids), rng.choice(["pending", "in_progress"]))
+            time.sleep(0.005)
+
+    workers = [threading.Thread(target=poller, args=(i,)) for i in range(threads)]
+    workers.append(threading.Thread(target=writer))
+    for w in workers:
+        w.start()
+    time.sleep(seconds)
+    stop.set()
+    for w in workers:
+        w.join()
+
+    merged = sorted(l for slot in latencies for l in slot)
+    return {
+        "qps": len(merged) / seconds,
+        "p50_ms": merged[len(merged) // 2] * 1000,
+        "p99_ms": merged[int(len(merged) * 0.99)] * 1000,
+    }
+
+def main():
+    parser = argparse.ArgumentParser()
+    parser.add_argument("--tasks", type=int, default=500)
+    parser.add_argument("--threads", type=int, default=8)
+    parser.add_argument("--seconds", type=float, default=3.0)
+    args = parser.parse_args()
+
+    tmp = tempfile.NamedTemporaryFile(delete=False, suffix=".db")
+    db.DB_PATH = tmp.name
+    db.init_db()
+
+    task_ids = [f"bench-{i}" for i in range(args.tasks)]
+    payload = "第一条 合同条款内容。" * 200
+    for task_id in task_ids:
+        db.save_task(task_id, {"status": "in_progress", "original_text": payload, "modified_text": payload})
+
+    # Legacy numbers are measured in rollback-journal mode, as the schema was before pooling.
+    db.close_connections()
+    conn = sqlite3.connect(tmp.name)
+    conn.execute("PRAGMA journal_mode = DELETE")
+    conn.close()
+    before = run(legacy_get_task, legacy_update_task_status, task_ids, args.threads, args.seconds)
+
+    after = run(db.get_task, db.update_task_status, task_ids, args.threads, args.seconds)
+
+    print(f"{'mode':<28}{'qps':>10}{'p50 ms':>10}{'p99 ms':>10}")
+    for name, result in (("connect-per-call (before)", before), ("pooled WAL (after)", after)):
+        print(f"{name:<28}{result['qps']:>10.0f}{result['p50_ms']:>10.3f}{result['p99_ms']:>10.3f}")
+
+    db.close_connections()
+    for suffix in ("", "-wal", "-shm"):
+        if os.path.exists(tmp.name + suffix):
+            os.unlink(tmp.name + suffix)
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,66 @@
+"""Peak memory of the analyzer on a large contract pair: in-memory vs streamed from the tasks row.
+
+    python -m benchmarks.bench_streaming_analysis --clauses 52000
+
+Each mode runs in its own process so ru_maxrss is not shared between them.
+"""
+import os
+import sys
+import time
+import random
+import argparse
+import resource
+import tempfile
+import subprocess
+
+from benchmarks.bench_diff_engine import make_pair
+
+ANALYSIS_CONFIG = {"streaming": {"window": 200, "batch_size": 100}}
+
+def peak_rss_mb() -> float:
+    return resource.getrusage(resource.RUSAGE_SELF).ru_maxrss / 1024
+
+def prepare(db_path: str, clauses: int):
+    from app.rag import db
+    db.DB_PATH = db_path
+    db.init_db()
+    original, modified = make_pair(random.Random(0), clauses, 0.05)
+    db.save_task("bench", {"original_text": original, "modified_text": modified})
+    db.close_connections()
+    print(f"original {len(original.encode('utf-8')) / 2 ** 20:.1f} MB, modified {len(modified.encode('utf-8')) / 2 ** 20:.1f} MB")
+
+def run(db_path: str, mode: str):
+    from app.rag import db
+    from app.graph import nodes
+    db.DB_PATH = db_path
+    baseline = peak_rss_mb()
+
+    start = time.perf_counter()
+    if mode == "streaming":
+        differences = nodes.stream_differences("bench", ANALYSIS_CONFIG)
+    else:
+        original, modified = db.get_task_texts("bench")
+        differences = nodes.diff_documents(original, modified, ANALYSIS_CONFIG)
+    seconds = time.perf_counter() - start
+
+    print(f"{mode:10} {seconds:7.2f} s   peak RSS {peak_rss_mb():7.1f} MB (+{peak_rss_mb() - baseline:.1f} MB over imports)   {len(differences)} differences")
+
+def main():
+    parser = argparse.ArgumentParser()
+    parser.add_argument("--clauses", type=int, default=52000)
+    parser.add_argument("--mode", choices=["memory", "streaming"])
+    parser.add_argument("--db")
+    args = parser.parse_args()
+
+    if args.mode:
+        run(args.db, args.mode)
+        return
+
+    with tempfile.TemporaryDirectory() as tmp:
+        db_path = os.path.join(tmp, "bench.db")
+        prepare(db_path, args.clauses)
+        for mode in ("memory", "streaming"):
+            subprocess.run([sys.executable, "-m", "benchmarks.bench_streaming_analysis", "--mode", mode, "--db", db_path], check=True)
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,63 @@
+"""Recall@k vs latency for the IVF template index against an exact flat scan.
+
+    python -m benchmarks.bench_vector_index --size 50000 --dim 256 --nlist 256
+"""
+import time
+import argparse
+import tempfile
+import numpy as np
+
+from app.rag.vector_index import FlatIndex, IVFIndex
+
+def clustered_vectors(n: int, dim: int, clusters: int, seed: int) -> np.ndarray:
+    rng = np.random.default_rng(seed)
+    centers = rng.normal(size=(clusters, dim))
+    labels = rng.integers(0, clusters, size=n)
+    return (centers[labels] + 1.5 * rng.normal(size=(n, dim))).astype(np.float32)
+
+def timed_search(index, queries, k, **kwargs):
+    results, latencies = [], []
+    for query in queries:
+        start = time.perf_counter()
+        results.append({i for i, _ in index.search(query, k, **kwargs)})
+        latencies.append(time.perf_counter() - start)
+    return results, np.array(latencies) * 1000
+
+def main():
+    parser = argparse.ArgumentParser()
+    parser.add_argument("--size", type=int, default=50000)
+    parser.add_argument("--dim", type=int, default=256)
+    parser.add_argument("--nlist", type=int, default=256)
+    parser.add_argument("--queries", type=int, default=200)
+    parser.add_argument("--k", type=int, default=10)
+    args = parser.parse_args()
+
+    data = clustered_vectors(args.size, args.dim, clusters=args.nlist // 4, seed=0)
+    queries = clustered_vectors(args.queries, args.dim, clusters=args.nlist // 4, seed=0)[::-1]
+    queries = queries + 0.2 * np.random.default_rng(1).normal(size=queries.shape).astype(np.float32)
+
+    flat = FlatIndex(args.dim)
+    flat.add(range(args.size), data)
+
+    start = time.perf_counter()
+    ivf = IVFIndex(args.dim, nlist=args.nlist)
+    ivf.add(range(args.size), data)
+    build_seconds = time.perf_counter() - start
+
+    with tempfile.TemporaryDirectory() as path:
+        ivf.save(path)
+        mapped = IVFIndex.load(path)
+
+        truth, flat_ms = timed_search(flat, queries, args.k)
+        print(f"{args.size} vectors x {args.dim}d, nlist={args.nlist}, build {build_seconds:.1f}s")
+        print(f"{'index':<16}{'recall@' + str(args.k):>10}{'avg ms':>10}{'p99 ms':>10}")
+        print(f"{'flat':<16}{1.0:>10.3f}{flat_ms.mean():>10.2f}{np.percentile(flat_ms, 99):>10.2f}")
+
+        for nprobe in (1, 4, 8, 16, 32):
+            found, ivf_ms = timed_search(mapped, queries, args.k, nprobe=nprobe)
+            recall = np.mean([len(a & b) / args.k for a, b in zip(truth, found)])
+            label = f"ivf nprobe={nprobe}"
+            print(f"{label:<16}{recall:>10.3f}{ivf_ms.mean():>10.2f}{np.percentile(ivf_ms, 99):>10.2f}")
+
+if __name__ == "__main__":
+    main()
@@ -158,26 +158,81 @@ document.getElementById('compareForm')?.addEventListener('submit', async functio
     }
 });
 
-async function updateTaskStatus(taskId) {
+const TERMINAL_STATUSES = ['completed', 'failed', 'cancelled'];
+
+const NODE_NAMES = {
+    'analyzer': '条款比对',
+    'retriever': '检索模板与规则',
+    'evaluator': '风险评估',
+    'human_loop': '人工确认',
+    'finalizer': '生成报告'
+};
+
+function subscribeTaskEvents(taskId, handlers) {
+    const source = new EventSource(API_BASE + '/api/contracts/events/' + taskId);
+    
+    ['status', 'node', 'evaluation'].forEach(type => {
+        if (handlers[type]) {
+            source.addEventListener(type, event => handlers[type](JSON.parse(event.data)));
+        }
+    });
+    
+    source.addEventListener('status', event => {
+        if (TERMINAL_STATUSES.includes(JSON.parse(event.data).status)) {
+            source.close();
+        }
+    });
+    
+    return source;
+}
+
+function renderTaskStatus(taskId, status) {
+    const statusBadge = document.getElementById('statusBadge');
+    const statusText = document.getElementById('statusText');
+    const statusMessage = document.getElementById('statusMessage');
+    const viewResultLink = document.getElementById('viewResultLink');
+    
+    statusBadge.className = 'badge ' + status.status;
+    statusBadge.textContent = getStatusText(status.status);
+    statusText.textContent = '状态: ';
+    statusMessage.textContent = status.message || '';
+    
+    if (TERMINAL_STATUSES.includes(status.status)) {
+        viewResultLink.href = '/compare?task_id=' + taskId;
+        viewResultLink.style.display = 'inline-block';
+    }
+}
+
+function updateTaskStatus(taskId) {
+    if (!window.EventSource) {
+        pollTaskStatus(taskId);
+        return;
+    }
+    
+    let evaluated = 0;
+    subscribeTaskEvents(taskId, {
+        status: status => renderTaskStatus(taskId, status),
+        node: progress => {
+            document.getElementById('statusMessage').textContent =
+                (NODE_NAMES[progress.node] || progress.node) + '完成，发现 ' + progress.differences + ' 处差异';
+        },
+        evaluation: () => {
+            evaluated++;
+            document.getElementById('statusMessage').textContent = '已评估 ' + evaluated + ' 处差异';
+        }
+    });
+}
+
+async function pollTaskStatus(taskId) {
     const pollInterval = setInterval(async () => {
         try {
             const response = await fetch(API_BASE + '/api/contracts/status/' + taskId);
             const status = await response.json();
             
-            const statusBadge = document.getElementById('statusBadge');
-            const statusText = document.getElementById('statusText');
-            const statusMessage = document.getElementById('statusMessage');
-            const viewResultLink = document.getElementById('viewResultLink');
+            renderTaskStatus(taskId, status);
             
-            statusBadge.className = 'badge ' + status.status;
-            statusBadge.textContent = getStatusText(status.status);
-            statusText.textContent = '状态: ';
-            statusMessage.textContent = status.message || '';
-            
-            if (status.status === 'completed' || status.status === 'failed') {
+            if (TERMINAL_STATUSES.includes(status.status)) {
                 clearInterval(pollInterval);
-                viewResultLink.href = '/compare?task_id=' + taskId;
-                viewResultLink.style.display = 'inline-block';
             }
             
         } catch (error) {
@@ -192,12 +247,53 @@ function getStatusText(status) {
         'in_progress': '分析中',
         'waiting_human': '需人工确认',
         'completed': '已完成',
-        'failed': '失败'
+        'failed': '失败',
+        'cancelled': '已取消'
     };
     return statusMap[status] || status;
 }
 
-async function checkTaskStatus(taskId) {
+async function loadResult(taskId) {
+    try {
+        const response = await fetch(API_BASE + '/api/contracts/result/' + taskId);
+        showResult(await response.json());
+    } catch (error) {
+        console.error('获取结果失败:', error);
+    }
+}
+
+function checkTaskStatus(taskId) {
+    if (!window.EventSource) {
+        pollTaskResult(taskId);
+        return;
+    }
+    
+    const loadingText = document.querySelector('#loading p');
+    let evaluated = 0;
+    const source = subscribeTaskEvents(taskId, {
+        status: status => {
+            if (status.status === 'waiting_human' || TERMINAL_STATUSES.includes(status.status)) {
+                source.close();
+                loadResult(taskId);
+            } else if (loadingText) {
+                loadingText.textContent = status.message || getStatusText(status.status);
+            }
+        },
+        node: progress => {
+            if (loadingText) {
+                loadingText.textContent = (NODE_NAMES[progress.node] || progress.node) + '完成，发现 ' + progress.differences + ' 处差异';
+            }
+        },
+        evaluation: () => {
+            evaluated++;
+            if (loadingText) {
+                loadingText.textContent = '正在评估风险，已完成 ' + evaluated + ' 处';
+            }
+        }
+    });
+}
+
+async function pollTaskResult(taskId) {
     let attempts = 0;
     const maxAttempts = 60;
     
@@ -208,7 +304,7 @@ async function checkTaskStatus(taskId) {
             const response = await fetch(API_BASE + '/api/contracts/result/' + taskId);
             const result = await response.json();
             
-            if (result.status === 'completed' || result.status === 'waiting_human' || result.status === 'failed') {
+            if (result.status === 'completed' || result.status === 'waiting_human' || result.status === 'failed' || result.status === 'cancelled') {
                 clearInterval(pollInterval);
                 showResult(result);
             }
@@ -1,13 +1,25 @@
 import pytest
 from fastapi.testclient import TestClient
 from app.main import app
-from app.rag.db import init_db
+from app.rag import db
+from app.rag.db import get_document, document_hash
+from app.graph import workflow
 
 client = TestClient(app)
 
 @pytest.fixture(scope="module", autouse=True)
-def setup_db():
-    init_db()
+def setup_db(tmp_path_factory):
+    # Reviews run end to end here, so they get their own task and checkpoint databases.
+    tmp_path = tmp_path_factory.mktemp("api")
+    original_db_path, original_checkpoint_path = db.DB_PATH, workflow.CHECKPOINT_DB_PATH
+    db.DB_PATH = str(tmp_path / "contracts.db")
+    workflow.CHECKPOINT_DB_PATH = str(tmp_path / "checkpoints.db")
+    workflow._compiled_graph = None
+    db.init_db()
+    yield
+    db.close_connections()
+    workflow._compiled_graph = None
+    db.DB_PATH, workflow.CHECKPOINT_DB_PATH = original_db_path, original_checkpoint_path
 
 def test_health_check():
     response = client.get("/health")
@@ -21,12 +33,44 @@ def test_compare_contracts():
         "category": "采购"
     }
     
-    response = client.post("/api/contracts/compare", json=payload)
+    response = client.post("/api/contracts/compare", json=payload, params={"reuse": "false"})
     assert response.status_code == 200
     data = response.json()
     assert "task_id" in data
     assert data["status"] == "pending"
 
+def test_identical_comparison_reuses_finished_review():
+    import time
+    import uuid
+    
+    payload = {
+        "original_text": f"合同编号：{uuid.uuid4().hex}\n合同金额：100元",
+        "modified_text": "合同金额：200元",
+        "category": "采购"
+    }
+    first = client.post("/api/contracts/compare", json=payload).json()
+    
+    deadline = time.time() + 30
+    while time.time() < deadline:
+        status = client.get(f"/api/contracts/status/{first['task_id']}").json()["status"]
+        if status in ("completed", "waiting_human", "failed"):
+            break
+        time.sleep(0.1)
+    assert status in ("completed", "waiting_human")
+    
+    second = client.post("/api/contracts/compare", json=payload).json()
+    assert second["task_id"] != first["task_id"]
+    assert second["status"] == status
+    
+    original = client.get(f"/api/contracts/result/{first['task_id']}").json()
+    reused = client.get(f"/api/contracts/result/{second['task_id']}").json()
+    assert reused["cloned_from"] == first["task_id"]
+    assert reused["evaluations"] == original["evaluations"]
+    assert reused["modified_text"] == payload["modified_text"]
+    
+    fresh = client.post("/api/contracts/compare", json=payload, params={"reuse": "false"}).json()
+    assert fresh["status"] == "pending"
+
 def test_get_task_status_not_found():
     response = client.get("/api/contracts/status/nonexistent")
     assert response.status_code == 404
@@ -34,3 +78,203 @@ def test_get_task_status_not_found():
 def test_get_task_result_not_found():
     response = client.get("/api/contracts/result/nonexistent")
     assert response.status_code == 404
+
+def test_cancel_task_not_found():
+    response = client.post("/api/contracts/cancel/nonexistent")
+    assert response.status_code == 404
+
+def test_task_events_not_found():
+    response = client.get("/api/contracts/events/nonexistent")
+    assert response.status_code == 404
+
+def test_task_events_stream_until_terminal_status():
+    import time
+    import threading
+    from app.rag.db import save_task
+    from app.services.events import get_event_bus
+    
+    task_id = "events-api-1"
+    save_task(task_id, {
+        "task_id": task_id,
+        "status": "in_progress",
+        "original_text": "甲",
+        "modified_text": "乙",
+        "category": None,
+        "differences": [],
+        "evaluations": [],
+        "human_reviews": [],
+        "final_report": None,
+        "error": None
+    })
+    bus = get_event_bus()
+    
+    def publish_once_subscribed():
+        # The bus keeps no history while nobody is watching.
+        deadline = time.time() + 5
+        while not bus.subscriber_count(task_id) and time.time() < deadline:
+            time.sleep(0.01)
+        bus.publish(task_id, "node", {"node": "analyzer", "differences": 1})
+        bus.publish(task_id, "status", {"status": "completed"})
+    
+    publisher = threading.Thread(target=publish_once_subscribed)
+    publisher.start()
+    with client.stream("GET", f"/api/contracts/events/{task_id}") as response:
+        assert response.status_code == 200
+        assert response.headers["content-type"].startswith("text/event-stream")
+        body = "".join(response.iter_text())
+    publisher.join()
+    
+    events = [line.split(": ", 1)[1] for line in body.splitlines() if line.startswith("event: ")]
+    assert events == ["status", "node", "status"]
+    assert '"status": "completed"' in body
+
+def test_failed_review_returns_task_to_reviewers(monkeypatch):
+    from app.rag.db import save_task, get_task
+    
+    def fail(task, reviews):
+        raise RuntimeError("checkpoint unavailable")
+    
+    task_id = "review-api-1"
+    save_task(task_id, {
+        "task_id": task_id,
+        "status": "waiting_human",
+        "original_text": "甲",
+        "modified_text": "乙",
+        "category": None,
+        "differences": [],
+        "evaluations": [],
+        "human_reviews": [],
+        "final_report": None,
+        "error": None
+    })
+    monkeypatch.setattr(workflow, "resume_contract_review", fail)
+    
+    response = client.post("/api/contracts/review", json={
+        "task_id": task_id,
+        "reviews": [{"evaluation_id": 0, "approved": True}]
+    })
+    assert response.status_code == 500
+    
+    task = get_task(task_id)
+    assert task["status"] == "waiting_human"
+    assert task["error"] == "checkpoint unavailable"
+    assert task["human_reviews"] == []
+
+def test_task_result_cursor_returns_new_evaluations():
+    from app.rag.db import save_task, append_task_evaluations
+    
+    import uuid
+    task_id = f"result-cursor-{uuid.uuid4().hex}"
+    save_task(task_id, {"task_id": task_id, "status": "in_progress", "original_text": "甲", "modified_text": "乙"})
+    append_task_evaluations(task_id, 0, [{"id": 0, "risk_level": "red"}, {"id": 1, "risk_level": "green"}])
+    
+    first = client.get(f"/api/contracts/result/{task_id}", params={"cursor": 0, "limit": 1}).json()
+    assert [entry["evaluation"]["id"] for entry in first["evaluations"]] == [0]
+    
+    rest = client.get(f"/api/contracts/result/{task_id}", params={"cursor": first["cursor"]}).json()
+    assert [entry["evaluation"]["id"] for entry in rest["evaluations"]] == [1]
+    assert rest["status"] == "in_progress"
+    
+    # The full result already includes the evaluations stored so far.
+    full = client.get(f"/api/contracts/result/{task_id}").json()
+    assert [evaluation["id"] for evaluation in full["evaluations"]] == [0, 1]
+
+def test_polling_endpoints_answer_unchanged_tasks_with_304():
+    import uuid
+    from app.rag.db import save_task, update_task_status
+    
+    task_id = f"etag-{uuid.uuid4().hex}"
+    save_task(task_id, {"task_id": task_id, "status": "in_progress", "original_text": "甲", "modified_text": "乙"})
+    
+    for path in (f"/api/contracts/status/{task_id}", f"/api/contracts/result/{task_id}"):
+        first = client.get(path)
+        etag = first.headers["etag"]
+        
+        assert client.get(path, headers={"If-None-Match": etag}).status_code == 304
+        
+        update_task_status(task_id, "in_progress", final_report=path)
+        changed = client.get(path, headers={"If-None-Match": etag})
+        assert changed.status_code == 200
+        assert changed.headers["etag"] != etag
+
+def wait_for_batch(batch_id: str, timeout: float = 30) -> dict:
+    import time
+    
+    deadline = time.time() + timeout
+    while time.time() < deadline:
+        batch = client.get(f"/api/contracts/batch/{batch_id}").json()
+        if batch["status"] == "completed":
+            return batch
+        time.sleep(0.1)
+    raise AssertionError(f"Batch {batch_id} did not finish: {batch}")
+
+def test_batch_manifest_is_reviewed_with_progress_and_summary():
+    import uuid
+    
+    marker = uuid.uuid4().hex
+    pair = {"original_text": f"合同编号：{marker}\n合同金额：100元", "modified_text": "合同金额：200元"}
+    manifest = {
+        "category": "采购",
+        "items": [
+            dict(pair, reference="v-1"),
+            dict(pair, reference="v-2"),
+            {"original_text": f"合同编号：{marker}\n押金：1个月", "modified_text": "押金：3个月", "reference": "v-3"},
+        ]
+    }
+    
+    created = client.post("/api/contracts/batch", json=manifest)
+    assert created.status_code == 200
+    assert created.json()["total"] == 3
+    
+    batch_id = created.json()["batch_id"]
+    batch = wait_for_batch(batch_id)
+    assert sum(batch["counts"].values()) == 3
+    assert sum(batch["risk_counts"].values()) > 0
+    
+    etag = client.get(f"/api/contracts/batch/{batch_id}").headers["etag"]
+    assert client.get(f"/api/contracts/batch/{batch_id}", headers={"If-None-Match": etag}).status_code == 304
+    
+    first = client.get(f"/api/contracts/batch/{batch_id}/items", params={"limit": 2}).json()
+    assert [item["reference"] for item in first["items"]] == ["v-1", "v-2"]
+    # Identical pairs in one batch share a task.
+    assert first["items"][0]["task_id"] == first["items"][1]["task_id"]
+    
+    rest = client.get(f"/api/contracts/batch/{batch_id}/items", params={"cursor": first["cursor"]}).json()
+    assert [item["position"] for item in rest["items"]] == [3]
+
+def test_batch_accepts_ndjson_and_rejects_bad_lines():
+    import json
+    import uuid
+    
+    marker = uuid.uuid4().hex
+    lines = [
+        json.dumps({"original_text": f"{marker} 甲", "modified_text": "乙", "category": "采购"}, ensure_ascii=False),
+        json.dumps({"original_text": f"{marker} 丙", "modified_text": "丁"}, ensure_ascii=False),
+    ]
+    headers = {"Content-Type": "application/x-ndjson"}
+    
+    response = client.post("/api/contracts/batch", content="\n".join(lines) + "\n", headers=headers)
+    assert response.status_code == 200
+    assert response.json()["total"] == 2
+    wait_for_batch(response.json()["batch_id"])
+    
+    rejected_line = json.dumps({"original_text": f"{marker} 戊", "modified_text": "己"}, ensure_ascii=False)
+    bad = client.post("/api/contracts/batch", content=rejected_line + "\n{\"original_text\": 1}\n", headers=headers)
+    assert bad.status_code == 400
+    assert "第 2 行" in bad.json()["detail"]
+    # Texts of a rejected batch are not left in the document store.
+    assert get_document(document_hash(f"{marker} 戊")) is None
+    assert get_document(document_hash(f"{marker} 甲")) is not None
+
+def test_batch_is_rejected_when_no_worker_can_start(monkeypatch):
+    import uuid
+    from app.api import routes
+    
+    monkeypatch.setattr(routes, "start_batch_workers", lambda batch_id: 0)
+    manifest = {"items": [{"original_text": f"{uuid.uuid4().hex} 甲", "modified_text": "乙"}]}
+    
+    response = client.post("/api/contracts/batch", json=manifest, params={"reuse": "false"})
+    assert response.status_code == 429
+
+def test_batch_not_found():
+    assert client.get("/api/contracts/batch/nonexistent").status_code == 404
@@ -1,5 +1,6 @@
 import pytest
 import os
+import asyncio
 import tempfile
 from app.rag import db
 
@@ -11,12 +12,35 @@ def test_db():
     db.DB_PATH = TEST_DB.name
     db.init_db()
     yield
+    db.close_connections()
     db.DB_PATH = original_db_path
     os.unlink(TEST_DB.name)
 
 def test_init_db(test_db):
     assert os.path.exists(db.DB_PATH)
 
+def test_database_path_comes_from_config(tmp_path, monkeypatch):
+    import sys
+    import subprocess
+    from app.config import BASE_DIR
+    
+    monkeypatch.setattr(db, "get_config", lambda: {"database": {"path": "data/x.db"}})
+    assert db.configured_db_path() == str(BASE_DIR / "data" / "x.db")
+    
+    # A fresh process picks the path up at import and creates the database and checkpoints there.
+    db_path = tmp_path / "volume" / "contracts.db"
+    script = (
+        "from app.config import get_config\n"
+        f"get_config()['database']['path'] = {str(db_path)!r}\n"
+        "from app.rag import db\n"
+        "from app.graph import workflow\n"
+        "db.init_db()\n"
+        "workflow.get_contract_review_graph()\n"
+    )
+    subprocess.run([sys.executable, "-c", script], cwd=BASE_DIR, check=True)
+    assert db_path.exists()
+    assert (tmp_path / "volume" / "checkpoints.db").exists()
+
 def test_save_and_get_task(test_db):
     task_data = {
         "task_id": "test-123",
@@ -61,3 +85,249 @@ def test_update_task_status(test_db):
 def test_get_nonexistent_task(test_db):
     task = db.get_task("nonexistent")
     assert task is None
+
+def make_task(task_id):
+    return {
+        "task_id": task_id,
+        "status": "pending",
+        "original_text": "原始合同",
+        "modified_text": "修改后合同",
+        "category": None,
+        "differences": [],
+        "evaluations": [],
+        "human_reviews": [],
+        "final_report": None,
+        "error": None
+    }
+
+def test_claim_next_task_is_exclusive(test_db):
+    db.save_task("queue-1", make_task("queue-1"))
+    
+    task = db.claim_next_task("worker-a", lease_seconds=60)
+    assert task["task_id"] == "queue-1"
+    assert task["status"] == "in_progress"
+    assert task["attempts"] == 1
+    
+    assert db.claim_next_task("worker-b", lease_seconds=60) is None
+    assert db.heartbeat_task("queue-1", "worker-a")
+    assert not db.heartbeat_task("queue-1", "worker-b")
+
+def test_expired_lease_is_reclaimed(test_db):
+    db.save_task("queue-2", make_task("queue-2"))
+    
+    db.claim_task("queue-2", "worker-a", lease_seconds=-1)
+    task = db.claim_next_task("worker-b", lease_seconds=60)
+    
+    assert task["task_id"] == "queue-2"
+    assert task["lease_owner"] == "worker-b"
+    assert task["attempts"] == 2
+    assert not db.finish_task("queue-2", "worker-a", "completed")
+    assert db.finish_task("queue-2", "worker-b", "completed", final_report="ok")
+    assert db.get_task("queue-2")["status"] == "completed"
+
+def test_task_failing_its_workers_stops_being_reclaimed(test_db):
+    db.save_task("queue-4", make_task("queue-4"))
+    
+    # Every worker dies holding the lease, so the worker's own retry check never runs.
+    for attempt in range(1, 4):
+        task = db.claim_next_task(f"worker-{attempt}", lease_seconds=-1, max_attempts=3)
+        assert task["attempts"] == attempt
+    
+    assert db.claim_next_task("worker-4", max_attempts=3) is None
+    task = db.get_task("queue-4")
+    assert task["status"] == "failed"
+    assert task["lease_owner"] is None
+    assert "3 attempts" in task["error"]
+
+def test_requeue_task_respects_delay(test_db):
+    db.save_task("queue-3", make_task("queue-3"))
+    db.claim_task("queue-3", "worker-a")
+    
+    db.requeue_task("queue-3", delay=60)
+    assert db.claim_next_task("worker-a") is None
+    
+    db.requeue_task("queue-3", reset_attempts=True)
+    task = db.claim_next_task("worker-a")
+    assert task["attempts"] == 1
+
+def test_connection_is_pooled_per_thread(test_db):
+    conn = db.get_connection()
+    
+    assert db.get_connection() is conn
+    assert conn.execute("PRAGMA journal_mode").fetchone()[0] == "wal"
+
+def test_async_task_repository(test_db):
+    async def run():
+        await db.async_save_task("async-1", make_task("async-1"))
+        await db.async_update_task_status("async-1", "in_progress", evaluations=[{"id": 0}])
+        tasks = await asyncio.gather(*[db.async_get_task("async-1") for _ in range(20)])
+        missing = await db.async_get_task("nonexistent")
+        await db.close_async_connections()
+        return tasks, missing
+    
+    tasks, missing = asyncio.run(run())
+    
+    assert all(task["status"] == "in_progress" for task in tasks)
+    assert tasks[0]["evaluations"] == [{"id": 0}]
+    assert missing is None
+    assert db.get_task("async-1")["status"] == "in_progress"
+
+def test_task_text_is_streamed_in_chunks(test_db):
+    task = make_task("stream-1")
+    task["modified_text"] = "第一条 甲方\n第二条 乙方" * 50
+    db.save_task("stream-1", task)
+    
+    # 7-byte chunks split the 3-byte characters across reads.
+    chunks = list(db.iter_task_text("stream-1", "modified_text", chunk_size=7))
+    
+    assert len(chunks) > 1
+    assert "".join(chunks) == task["modified_text"]
+    assert db.read_task_text_head("stream-1", "modified_text", 3) == "第一条"
+    assert db.get_task_text_sizes("stream-1")["modified_text"] == len(task["modified_text"].encode("utf-8"))
+
+def test_streamed_differences_are_returned_with_task(test_db):
+    db.save_task("stream-2", make_task("stream-2"))
+    db.append_task_differences("stream-2", 0, [{"seq": 0}, {"seq": 1}])
+    db.append_task_differences("stream-2", 2, [{"seq": 2}])
+    
+    assert db.get_task("stream-2")["differences"] == [{"seq": 0}, {"seq": 1}, {"seq": 2}]
+    assert asyncio.run(db.async_get_task("stream-2"))["differences"] == [{"seq": 0}, {"seq": 1}, {"seq": 2}]
+    asyncio.run(db.close_async_connections())
+
+def test_task_children_are_stored_in_their_own_tables(test_db):
+    task = make_task("child-1")
+    task["differences"] = [{"change_type": "modified"}, {"change_type": "added"}]
+    task["evaluations"] = [{"id": 0, "risk_level": "red"}, {"id": 1, "risk_level": "green"}]
+    db.save_task("child-1", task)
+    
+    db.update_task_status(
+        "child-1", "waiting_human",
+        evaluations=[{"id": 0, "risk_level": "red"}, {"id": 1, "risk_level": "red"}],
+        human_reviews=[{"evaluation_id": 0, "approved": True, "comment": "同意"}]
+    )
+    
+    assert db.get_task_status("child-1") == "waiting_human"
+    assert db.count_task_risk_levels("child-1") == {"red": 2}
+    assert [e["id"] for e in db.get_task_evaluation_results("child-1", "red")] == [0, 1]
+    
+    stored = db.get_task("child-1")
+    assert stored["differences"] == task["differences"]
+    assert stored["human_reviews"] == [{"evaluation_id": 0, "approved": True, "modified_suggestion": None, "comment": "同意"}]
+
+def test_task_version_tracks_visible_changes_only(test_db):
+    db.save_task("version-1", make_task("version-1"))
+    assert db.get_task_state("version-1") == {"status": "pending", "version": 1}
+    
+    db.claim_task("version-1", "worker-a")
+    version = db.get_task_state("version-1")["version"]
+    db.heartbeat_task("version-1", "worker-a")
+    assert db.get_task_state("version-1")["version"] == version
+    
+    db.append_task_evaluations("version-1", 0, [{"id": 0, "risk_level": "green"}])
+    assert db.get_task_state("version-1")["version"] == version + 1
+
+def test_reusable_task_is_cloned_until_reviewed(test_db):
+    task = make_task("reuse-1")
+    task.update({"status": "waiting_human", "result_key": "key-1", "differences": [{"change_type": "modified"}]})
+    db.save_task("reuse-1", task)
+    db.append_task_evaluations("reuse-1", 0, [{"id": 0, "risk_level": "red"}])
+    
+    assert db.find_reusable_task("key-1", 3600) == "reuse-1"
+    assert db.clone_task("reuse-1", "reuse-2") == "waiting_human"
+    
+    clone = db.get_task("reuse-2")
+    assert clone["cloned_from"] == "reuse-1"
+    assert clone["original_hash"] == db.get_task("reuse-1")["original_hash"]
+    assert clone["differences"] == task["differences"]
+    assert [entry["evaluation"] for entry in db.get_task_evaluations("reuse-2")] == [{"id": 0, "risk_level": "red"}]
+    
+    # Once a reviewer has answered, the analysis carries their decisions and is not handed out.
+    db.update_task_status("reuse-1", "completed", human_reviews=[{"evaluation_id": 0, "approved": True}])
+    db.update_task_status("reuse-2", "completed", human_reviews=[{"evaluation_id": 0, "approved": False}])
+    assert db.find_reusable_task("key-1", 3600) is None
+    assert db.clone_task("reuse-1", "reuse-3") is None
+    assert db.get_task("reuse-3") is None
+
+@pytest.mark.parametrize("codec", ["zlib", "zstd", "none"])
+def test_documents_are_deduplicated_and_compressed(test_db, monkeypatch, codec):
+    monkeypatch.setattr(db, "get_config", lambda: {"documents": {"compression": codec, "min_size": 64}})
+    template = "第一条 甲方应按约定支付服务费用。\n" * 200
+    for task_id in ("doc-1", "doc-2"):
+        task = make_task(task_id)
+        task["original_text"] = template
+        db.save_task(task_id, task)
+    
+    conn = db.get_connection()
+    assert conn.execute("SELECT COUNT(*) FROM documents").fetchone()[0] == 2
+    stored_codec, stored_size = conn.execute(
+        "SELECT codec, length(content) FROM documents WHERE hash = ?", (db.document_hash(template),)
+    ).fetchone()
+    assert stored_codec == db.resolve_codec(codec)
+    assert (stored_size < len(template.encode("utf-8"))) == (codec != "none")
+    
+    assert db.get_task("doc-2")["original_text"] == template
+    assert "".join(db.iter_task_text("doc-2", "original_text", chunk_size=5)) == template
+    assert db.get_task_text_sizes("doc-2")["original_text"] == len(template.encode("utf-8"))
+
+def test_json_task_columns_are_migrated(test_db):
+    conn = db.get_connection()
+    conn.execute("DROP TABLE tasks")
+    conn.execute("""
+        CREATE TABLE tasks (
+            task_id TEXT PRIMARY KEY, status TEXT NOT NULL DEFAULT 'pending',
+            original_text TEXT NOT NULL, modified_text TEXT NOT NULL, category TEXT,
+            differences TEXT, evaluations TEXT, human_reviews TEXT, final_report TEXT, error TEXT,
+            created_at TIMESTAMP DEFAULT CURRENT_TIMESTAMP, updated_at TIMESTAMP DEFAULT CURRENT_TIMESTAMP
+        )
+    """)
+    conn.execute(
+        "INSERT INTO tasks (task_id, status, original_text, modified_text, differences, evaluations, human_reviews) "
+        "VALUES (?, 'completed', '甲', '乙', ?, ?, ?)",
+        ("legacy-1", '[{"change_type": "modified"}]', '[{"id": 0, "risk_level": "yellow"}]',
+         '[{"evaluation_id": 0, "approved": false}]')
+    )
+    
+    db.init_db()
+    
+    columns = {row[1] for row in conn.execute("PRAGMA table_info(tasks)")}
+    assert not columns & {"differences", "evaluations", "human_reviews"}
+    task = db.get_task("legacy-1")
+    assert task["differences"] == [{"change_type": "modified"}]
+    assert task["evaluations"] == [{"id": 0, "risk_level": "yellow"}]
+    assert task["human_reviews"][0]["approved"] is False
+    assert (task["original_text"], task["modified_text"]) == ("甲", "乙")
+    assert [entry["seq"] for entry in db.get_task_evaluations("legacy-1")] == [1]
+
+def test_chinese_query_matches_without_spaces(test_db):
+    rules = db.search_playbook("竞业限制期限3年且无补偿", top_k=2)
+    
+    assert [r["rule_name"] for r in rules] == ["竞业限制", "竞业限制"]
+    assert rules[0]["description"] == "竞业限制期限超过3年或无补偿"
+    assert db.search_templates("房屋租赁", top_k=1)[0]["category"] == "租赁"
+
+def test_search_index_follows_updates_and_deletes(test_db):
+    conn = db.get_connection()
+    conn.execute("UPDATE playbook SET description = '定金不超过合同金额的20%' WHERE id = 1")
+    conn.execute("DELETE FROM templates WHERE category = '租赁'")
+    
+    assert [r["id"] for r in db.search_playbook("定金", top_k=3)] == [1]
+    assert all(t["category"] != "租赁" for t in db.search_templates("房屋租赁", top_k=3))
+
+def test_legacy_search_index_is_rebuilt(test_db):
+    conn = db.get_connection()
+    conn.execute("DROP TABLE templates_fts")
+    conn.execute("CREATE VIRTUAL TABLE templates_fts USING fts5(title, category, content, content=templates, content_rowid=id)")
+    conn.execute("UPDATE meta SET value = 1 WHERE key = 'search_index_version'")
+    
+    db.init_db()
+    
+    assert db.get_meta_value("search_index_version") == db.SEARCH_INDEX_VERSION
+    assert db.search_templates("房屋租赁", top_k=1)[0]["category"] == "租赁"
+
+def test_search_playbook_batch_ranks_each_query(test_db):
+    results = db.search_playbook_batch(["押金超过3个月租金", "", "保密期限永久"], top_k=2)
+    
+    assert [r["description"] for r in results[0]] == ["押金超过3个月租金", "押金不超过2个月租金"]
+    assert results[1] == []
+    assert results[2][0]["description"] == "保密期限为永久或过长"
+    assert all(r["category"] == "劳动" for r in db.search_playbook_batch(["押金超过3个月租金"], category="劳动")[0])
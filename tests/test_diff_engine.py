@@ -0,0 +1,66 @@
+from app.services.diff_engine import (
+    segment_clauses, clause_differences, stream_clause_differences, iter_lines, longest_increasing_subsequence
+)
+
+CONTRACT = """第一章 总则
+第一条 甲方委托乙方提供软件开发服务，服务范围见附件一。
+第二条 合同总金额为人民币100万元，含税。
+第二章 付款
+第三条 合同签订后甲方支付30%预付款。
+（一）验收合格后支付60%验收款。
+（二）质保期满后支付10%尾款。
+第四条 乙方应对甲方的商业秘密承担保密义务。"""
+
+def test_segments_heading_hierarchy():
+    clauses = segment_clauses(CONTRACT)
+    
+    assert [c.label for c in clauses] == ["第一章", "第一条", "第二条", "第二章", "第三条", "（一）", "（二）", "第四条"]
+    assert clauses[5].path == ("第二章", "第三条", "（一）")
+    assert clauses[7].path == ("第二章", "第四条")
+    assert clauses[2].body == "合同总金额为人民币100万元，含税。"
+
+def test_renumbered_clauses_are_not_differences():
+    renumbered = CONTRACT.replace("第一条", "1.").replace("第二条", "2.").replace("第三条", "3.").replace("第四条", "4.")
+    
+    assert clause_differences(CONTRACT, renumbered) == []
+
+def test_moved_and_modified_clauses():
+    lines = CONTRACT.split("\n")
+    modified = "\n".join(lines[:1] + lines[2:] + [lines[1]])
+    modified = modified.replace("30%预付款", "50%预付款").replace("合同总金额为人民币100万元，含税。", "本合同适用中华人民共和国法律。")
+    
+    differences = clause_differences(CONTRACT, modified)
+    
+    assert [d["change_type"] for d in differences] == ["removed", "added", "modified", "moved"]
+    assert "50%预付款" in differences[2]["modified_section"]
+    assert differences[3]["similarity"] == 1.0
+    assert differences[3]["original_clause"] == "第一章 > 第一条"
+    assert differences[3]["modified_clause"] == "第二章 > 第一条"
+
+def test_iter_lines_cuts_lines_without_breaks():
+    text = "甲方应付款。" * 5 + "乙方" * 10
+    chunks = [text[i:i + 7] for i in range(0, len(text), 7)]
+    
+    lines = list(iter_lines(chunks, max_chars=16))
+    
+    assert "".join(lines) == text
+    assert all(len(line) <= 16 for line in lines)
+    assert lines[0] == "甲方应付款。甲方应付款。"
+
+def test_longest_increasing_subsequence():
+    assert longest_increasing_subsequence([0, 2, 1, 3, 4]) in ({0, 1, 3, 4}, {0, 2, 3, 4})
+    assert longest_increasing_subsequence([]) == set()
+
+def test_windowed_alignment_matches_single_pass_for_local_changes():
+    clauses = [f"第{i}条 第{i}项约定：乙方应当按照附件{i}的要求履行第{i * 7}号义务。" for i in range(1, 61)]
+    modified = clauses[:]
+    modified.insert(20, modified.pop(17))
+    modified[40] = modified[40].replace("履行", "按期履行")
+    del modified[50]
+    original_text, modified_text = "\n".join(clauses), "\n".join(modified)
+    
+    chunks = [modified_text[i:i + 37] for i in range(0, len(modified_text), 37)]
+    streamed = list(stream_clause_differences(original_text.split("\n"), iter_lines(chunks), window=10))
+    
+    assert streamed == clause_differences(original_text, modified_text)
+    assert [d["change_type"] for d in streamed] == ["moved", "modified", "removed"]
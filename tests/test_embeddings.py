@@ -0,0 +1,72 @@
+import pytest
+import numpy as np
+from app.rag import db
+from app.services.embeddings import EmbeddingBackend, EmbeddingsService, HashingEmbeddingBackend
+
+class CountingBackend(EmbeddingBackend):
+    name = "counting"
+    
+    def __init__(self):
+        self.batches = []
+    
+    def embed_batch(self, texts):
+        self.batches.append(list(texts))
+        return np.array([[len(t), 1.0] for t in texts], dtype=np.float64)
+
+@pytest.fixture
+def embeddings_db(tmp_path):
+    original_db_path = db.DB_PATH
+    db.DB_PATH = str(tmp_path / "contracts.db")
+    db.init_db()
+    yield
+    db.close_connections()
+    db.DB_PATH = original_db_path
+
+def test_local_backend_is_deterministic_float32():
+    backend = HashingEmbeddingBackend(dim=256)
+    vectors = backend.embed_batch(["预付款不超过合同金额的30%", "预付款不超过合同金额的30%"])
+    
+    assert vectors.dtype == np.float32
+    assert vectors.shape == (2, 256)
+    assert np.allclose(vectors[0], vectors[1])
+    assert np.isclose(np.linalg.norm(vectors[0]), 1.0)
+
+def test_local_backend_ranks_related_chinese_text_higher():
+    service = EmbeddingsService(backend=HashingEmbeddingBackend(), use_cache=False)
+    query, related, unrelated = service.embed_documents([
+        "乙方支付合同总金额的50%作为预付款",
+        "预付款超过合同金额的40%",
+        "保密期限为劳动关系解除后2年"
+    ])
+    
+    assert float(query @ related) > float(query @ unrelated)
+
+def test_service_batches_and_caches_on_disk(embeddings_db):
+    backend = CountingBackend()
+    service = EmbeddingsService(backend=backend, batch_size=2)
+    
+    first = service.embed_documents(["a", "bb", "ccc"])
+    second = EmbeddingsService(backend=backend, batch_size=2).embed_documents(["bb", "dddd"])
+    
+    assert first.dtype == np.float32
+    assert backend.batches == [["a", "bb"], ["ccc"], ["dddd"]]
+    assert np.allclose(second[0], first[1])
+    assert service.embed_text("ccc").tolist() == [3.0, 1.0]
+
+def test_local_backend_is_cached_and_idf_weighted(embeddings_db):
+    corpus = ["本合同约定甲方的付款义务", "本合同约定乙方的交付义务", "本合同约定预付款比例"]
+    plain = HashingEmbeddingBackend(dim=256)
+    fitted = HashingEmbeddingBackend.fit(corpus, dim=256)
+    
+    assert EmbeddingsService(backend=fitted).use_cache
+    assert fitted.name.startswith(plain.name + "-idf")
+    
+    # Words every document shares count for less once IDF is applied.
+    a, b = "本合同约定甲方义务", "本合同约定乙方责任"
+    plain_a, plain_b = plain.embed_batch([a, b])
+    fitted_a, fitted_b = fitted.embed_batch([a, b])
+    assert float(fitted_a @ fitted_b) < float(plain_a @ plain_b)
+    
+    service = EmbeddingsService(backend=fitted)
+    service.embed_documents([a])
+    assert service.text_hash(a) in db.get_cached_embeddings(fitted.name, [service.text_hash(a)])
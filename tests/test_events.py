@@ -0,0 +1,79 @@
+import asyncio
+from app.services.events import TaskEventBus, format_sse
+
+def test_subscriber_receives_published_events():
+    bus = TaskEventBus()
+    
+    async def run():
+        subscription = bus.subscribe("task-1")
+        bus.publish("task-1", "node", {"node": "analyzer"})
+        bus.publish("task-2", "node", {"node": "retriever"})
+        event = await subscription.get(1)
+        other = await subscription.get(0.05)
+        subscription.close()
+        return event, other
+    
+    event, other = asyncio.run(run())
+    
+    assert event == {"id": 1, "type": "node", "data": {"node": "analyzer"}}
+    assert other is None
+    assert bus.subscriber_count("task-1") == 0
+
+def replay(bus: TaskEventBus, task_id: str, last_event_id=None) -> list:
+    async def run():
+        subscription = bus.subscribe(task_id, last_event_id)
+        events = []
+        while (event := await subscription.get(0.05)) is not None:
+            events.append(event["id"])
+        subscription.close()
+        return events
+    return asyncio.run(run())
+
+def test_reconnect_replays_missed_events():
+    bus = TaskEventBus(history_size=2)
+    
+    async def run():
+        watcher = bus.subscribe("task-1")
+        for position in range(3):
+            bus.publish("task-1", "evaluation", {"position": position})
+        watcher.close()
+    
+    asyncio.run(run())
+    # Only the last two events are kept, and the task stays recorded after its watcher left.
+    assert replay(bus, "task-1") == [2, 3]
+    assert replay(bus, "task-1", 2) == [3]
+    bus.publish("task-1", "evaluation", {"position": 3})
+    assert replay(bus, "task-1", 3) == [4]
+
+def test_no_history_without_subscribers():
+    bus = TaskEventBus()
+    assert bus.publish("task-1", "status", {"status": "in_progress"}) is None
+    assert bus.history_count() == 0
+    assert replay(bus, "task-1") == []
+
+def test_finished_idle_and_surplus_history_expires():
+    async def run(bus, publishes, pause=0):
+        watcher = bus.subscribe("watcher")
+        for task_id, status in publishes:
+            bus.publish(task_id, "status", {"status": status})
+            await asyncio.sleep(pause)
+        watcher.close()
+    
+    bus = TaskEventBus(retention_seconds=0)
+    asyncio.run(run(bus, [("task-1", "completed"), ("task-2", "in_progress")]))
+    assert replay(bus, "task-1") == []
+    assert replay(bus, "task-2") == [1]
+    
+    # A task waiting for a reviewer publishes nothing for a long time.
+    bus = TaskEventBus(idle_seconds=0.05)
+    asyncio.run(run(bus, [("task-1", "waiting_human"), ("task-2", "in_progress")], pause=0.1))
+    assert replay(bus, "task-1") == []
+    assert replay(bus, "task-2") == [1]
+    
+    bus = TaskEventBus(max_tasks=2)
+    asyncio.run(run(bus, [(f"task-{n}", "in_progress") for n in range(5)]))
+    assert bus.history_count() == 2
+    assert replay(bus, "task-4") == [1]
+
+def test_format_sse():
+    assert format_sse("status", {"status": "完成"}, 3) == 'id: 3\nevent: status\ndata: {"status": "完成"}\n\n'
@@ -0,0 +1,48 @@
+import threading
+import pytest
+from app.services.executor import ReviewExecutor, QueueFullError
+
+def test_executor_runs_task():
+    executor = ReviewExecutor(mode="thread", max_workers=1, max_queue=1)
+    future = executor.submit("task-1", lambda cancel_event=None: "done")
+    
+    assert future.result(timeout=5) == "done"
+    executor.shutdown(wait=True)
+
+def test_executor_rejects_when_queue_full():
+    executor = ReviewExecutor(mode="thread", max_workers=1, max_queue=1)
+    release = threading.Event()
+    
+    executor.submit("task-1", lambda cancel_event=None: release.wait(5))
+    executor.submit("task-2", lambda cancel_event=None: release.wait(5))
+    
+    assert not executor.has_capacity()
+    with pytest.raises(QueueFullError):
+        executor.submit("task-3", lambda cancel_event=None: None)
+    
+    release.set()
+    executor.shutdown(wait=True)
+
+def test_executor_cancels_queued_and_running_tasks():
+    executor = ReviewExecutor(mode="thread", max_workers=1, max_queue=1)
+    started = threading.Event()
+    
+    def running(cancel_event=None):
+        started.set()
+        return cancel_event.wait(5)
+    
+    running_future = executor.submit("task-1", running)
+    queued_future = executor.submit("task-2", lambda cancel_event=None: "never")
+    started.wait(5)
+    
+    assert executor.cancel("task-2")
+    assert queued_future.cancelled()
+    
+    assert executor.cancel("task-1")
+    assert running_future.result(timeout=5) is True
+    assert not executor.cancel("missing")
+    executor.shutdown(wait=True)
+
+def test_process_mode_is_rejected():
+    with pytest.raises(ValueError):
+        ReviewExecutor(mode="process")
@@ -0,0 +1,72 @@
+import pytest
+from app.rag import db
+from app.services import llm_cache
+from app.services.llm import LLMService
+from app.services.llm_cache import LLMResultCache
+
+RESULT = {"risk_level": "green", "explanation": "ok", "suggestion": "ok", "matched_rule": None}
+
+@pytest.fixture
+def cache_db(tmp_path, monkeypatch):
+    original_db_path = db.DB_PATH
+    db.DB_PATH = str(tmp_path / "contracts.db")
+    db.init_db()
+    monkeypatch.setattr(llm_cache, "llm_cache", None)
+    yield
+    db.close_connections()
+    db.DB_PATH = original_db_path
+
+def test_cache_hit_and_miss_counters(cache_db):
+    cache = LLMResultCache()
+    key = cache.make_key("m", 0.3, "sys", "原文", "修改", "modified", [1, 2])
+    
+    assert cache.get(key) is None
+    cache.set(key, RESULT)
+    assert cache.get(key) == RESULT
+    assert cache.stats()["hits"] == 1
+    assert cache.stats()["misses"] == 1
+    assert key != cache.make_key("m", 0.3, "sys", "原文", "修改", "modified", [1, 3])
+
+def test_cache_expires_after_ttl(cache_db):
+    cache = LLMResultCache(ttl_seconds=-1)
+    key = cache.make_key("m", 0.3, "sys", "a", "b", "modified", [])
+    cache.set(key, RESULT)
+    
+    assert cache.get(key) is None
+
+def test_cache_invalidated_when_playbook_changes(cache_db):
+    cache = LLMResultCache()
+    key = cache.make_key("m", 0.3, "sys", "a", "b", "modified", [])
+    cache.set(key, RESULT)
+    
+    db.get_connection().execute("UPDATE playbook SET action = 'changed' WHERE id = 1")
+    
+    assert cache.get(key) is None
+
+def test_cache_evicts_least_recently_used(cache_db):
+    cache = LLMResultCache(max_entries=2)
+    keys = [cache.make_key("m", 0.3, "sys", str(i), "b", "modified", []) for i in range(3)]
+    for key in keys:
+        cache.set(key, RESULT)
+    cache.get(keys[0])
+    
+    assert db.evict_llm_cache(2) == 1
+    assert cache.get(keys[0]) == RESULT
+    assert cache.get(keys[1]) is None
+
+def test_llm_service_reuses_cached_assessment(cache_db, monkeypatch):
+    service = LLMService()
+    calls = []
+    
+    def fake_invoke(prompt):
+        calls.append(prompt)
+        return RESULT
+    
+    monkeypatch.setattr(service, "invoke_json", fake_invoke)
+    rules = [{"id": 1, "rule_name": "付款比例", "description": "预付款不超过30%"}]
+    
+    first = service.analyze_contract_difference("预付款30%", "预付款50%", "modified", rules)
+    second = service.analyze_contract_difference("预付款30%", "预付款50%", "modified", rules)
+    
+    assert first == second == RESULT
+    assert len(calls) == 1
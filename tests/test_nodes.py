@@ -1,12 +1,28 @@
 import pytest
 from app.graph.nodes import node_retriever, node_analyzer, node_evaluator
+from app.graph import workflow
+from app.rag import db
+from app.rag.db import save_documents
+
+@pytest.fixture(autouse=True)
+def setup_db(monkeypatch, tmp_path):
+    monkeypatch.setattr(db, "DB_PATH", str(tmp_path / "contracts.db"))
+    monkeypatch.setattr(workflow, "CHECKPOINT_DB_PATH", str(tmp_path / "checkpoints.db"))
+    db.close_connections()
+    db.init_db()
+    yield
+    db.close_connections()
 
 def test_node_analyzer():
+    (original_hash, modified_hash), _ = save_documents([
+        "第一条 合同金额：100元\n第二条 付款方式：分期付款",
+        "第一条 合同金额：200元\n第二条 付款方式：一次性付款\n第三条 违约责任：严格"
+    ])
     state = {
         "task_id": "test",
         "status": "pending",
-        "original_text": "第一条 合同金额：100元\n第二条 付款方式：分期付款",
-        "modified_text": "第一条 合同金额：200元\n第二条 付款方式：一次性付款\n第三条 违约责任：严格",
+        "original_hash": original_hash,
+        "modified_hash": modified_hash,
         "category": "采购",
         "retrieved_templates": [],
         "playbook_rules": [],
@@ -26,8 +42,8 @@ def test_node_evaluator_no_rules():
     state = {
         "task_id": "test",
         "status": "in_progress",
-        "original_text": "",
-        "modified_text": "",
+        "original_hash": None,
+        "modified_hash": None,
         "category": None,
         "retrieved_templates": [],
         "playbook_rules": [],
@@ -67,8 +83,8 @@ def test_node_evaluator_with_rules():
     state = {
         "task_id": "test",
         "status": "in_progress",
-        "original_text": "",
-        "modified_text": "预付款30%",
+        "original_hash": None,
+        "modified_hash": None,
         "category": "采购",
         "retrieved_templates": [],
         "playbook_rules": playbook_rules,
@@ -91,3 +107,178 @@ def test_node_evaluator_with_rules():
     
     assert len(result["evaluations"]) > 0
     assert result["evaluations"][0]["matched_rule"] is not None
+
+def test_node_evaluator_uses_rules_retrieved_for_each_difference():
+    playbook_rules = [
+        {"id": 1, "rule_name": "押金", "description": "押金超过3个月租金", "risk_level": "黄色", "action": "押金过高", "keywords": "押金"},
+        {"id": 2, "rule_name": "竞业限制", "description": "竞业限制期限超过3年", "risk_level": "红色", "action": "期限过长", "keywords": "竞业"},
+    ]
+    differences = [
+        {"original_section": "", "modified_section": "押金与竞业限制", "similarity": 0.0, "change_type": "added", "rule_ids": [2]},
+        {"original_section": "", "modified_section": "押金与竞业限制", "similarity": 0.0, "change_type": "added", "rule_ids": []},
+    ]
+    
+    result = node_evaluator({"differences": differences, "playbook_rules": playbook_rules})
+    
+    assert result["evaluations"][0]["matched_rule"]["id"] == 2
+    assert result["evaluations"][0]["risk_level"] == "red"
+    assert result["evaluations"][1]["matched_rule"] is None
+
+class FakeLLM:
+    def __init__(self, delays=None, batch_results=None):
+        self.delays = delays or {}
+        self.batch_results = batch_results
+        self.batch_calls = 0
+    
+    def analyze_contract_difference(self, original_section, modified_section, change_type, playbook_rules=None):
+        import time
+        time.sleep(self.delays.get(modified_section, 0))
+        return {"risk_level": "green", "explanation": modified_section, "suggestion": "ok", "matched_rule": None}
+    
+    def analyze_contract_differences_batch(self, differences, playbook_rules=None, item_rules=None):
+        self.batch_calls += 1
+        if self.batch_results is None:
+            return [None] * len(differences)
+        return [{"risk_level": "red", "explanation": d["modified_section"], "suggestion": "batch", "matched_rule": None}
+                for d in differences]
+
+def llm_state(sections):
+    return {
+        "task_id": "test",
+        "status": "in_progress",
+        "original_hash": None,
+        "modified_hash": None,
+        "category": None,
+        "retrieved_templates": [],
+        "playbook_rules": [],
+        "differences": [
+            {"original_section": "", "modified_section": s, "similarity": 0.0, "change_type": "added"}
+            for s in sections
+        ],
+        "evaluations": [],
+        "human_reviews": [],
+        "needs_human_review": False,
+        "final_report": None,
+        "error": None
+    }
+
+def use_fake_llm(monkeypatch, fake, **llm_config):
+    from app.services import llm as llm_module
+    from app.graph import nodes
+    monkeypatch.setenv("USE_LLM", "true")
+    monkeypatch.setattr(llm_module, "get_llm_service", lambda: fake)
+    monkeypatch.setattr(nodes, "get_config", lambda: {"llm": llm_config})
+
+def test_node_evaluator_llm_preserves_order_and_times_out(monkeypatch):
+    fake = FakeLLM(delays={"条款A": 0.2, "条款C": 2})
+    use_fake_llm(monkeypatch, fake, max_concurrency=3, timeout=0.5, batch_size=1)
+    
+    result = node_evaluator(llm_state(["条款A", "条款B", "条款C"]))
+    evaluations = result["evaluations"]
+    
+    assert [e["id"] for e in evaluations] == [0, 1, 2]
+    assert [e["explanation"] for e in evaluations[:2]] == ["条款A", "条款B"]
+    assert evaluations[2]["explanation"] == "新增条款，未匹配到明确的合规规则"
+
+def test_node_evaluator_llm_gives_up_on_calls_that_never_start(monkeypatch):
+    import time
+    # One slot, held by a call that hangs well past the timeout.
+    fake = FakeLLM(delays={"条款A": 3})
+    use_fake_llm(monkeypatch, fake, max_concurrency=1, timeout=0.3, batch_size=1)
+    
+    started = time.monotonic()
+    evaluations = node_evaluator(llm_state(["条款A", "条款B", "条款C"]))["evaluations"]
+    
+    assert time.monotonic() - started < 1.5
+    assert [e["explanation"] for e in evaluations] == ["新增条款，未匹配到明确的合规规则"] * 3
+
+def test_node_evaluator_llm_batch_mode(monkeypatch):
+    fake = FakeLLM(batch_results=True)
+    use_fake_llm(monkeypatch, fake, max_concurrency=2, timeout=5, batch_size=2)
+    
+    result = node_evaluator(llm_state(["条款A", "条款B", "条款C"]))
+    
+    assert fake.batch_calls == 2
+    assert [e["explanation"] for e in result["evaluations"]] == ["条款A", "条款B", "条款C"]
+    assert all(e["suggestion"] == "batch" for e in result["evaluations"])
+
+def test_node_evaluator_llm_batch_falls_back_to_single_calls(monkeypatch):
+    fake = FakeLLM(batch_results=None)
+    use_fake_llm(monkeypatch, fake, max_concurrency=2, timeout=5, batch_size=3)
+    
+    result = node_evaluator(llm_state(["条款A", "条款B"]))
+    
+    assert [e["suggestion"] for e in result["evaluations"]] == ["ok", "ok"]
+
+def test_node_evaluator_skips_llm_for_threshold_rules(monkeypatch):
+    from app.graph import nodes
+    from app.services.rule_engine import ThresholdRuleEngine
+    fake = FakeLLM(batch_results=True)
+    use_fake_llm(monkeypatch, fake, max_concurrency=2, timeout=5, batch_size=5)
+    monkeypatch.setattr(nodes, "get_threshold_engine", lambda: ThresholdRuleEngine([
+        {"rule_id": 1, "group_no": 0, "field": "预付款", "operator": ">", "threshold": 40, "unit": "percent"}
+    ]))
+    state = llm_state(["预付款50%", "条款B"])
+    state["playbook_rules"] = [{"id": 1, "description": "预付款超过40%", "risk_level": "红色", "action": "需要修改", "keywords": "预付款"}]
+    
+    evaluations = node_evaluator(state)["evaluations"]
+    
+    assert evaluations[0]["risk_level"] == "red"
+    assert evaluations[0]["explanation"] == "预付款超过40%（预付款 50% > 40%）"
+    assert evaluations[1]["suggestion"] == "batch"
+    assert fake.batch_calls == 1
+
+def test_node_evaluator_does_not_send_unchanged_moves_to_llm(monkeypatch):
+    fake = FakeLLM(batch_results=True)
+    use_fake_llm(monkeypatch, fake, max_concurrency=2, timeout=5, batch_size=5)
+    state = llm_state([])
+    state["differences"] = [{
+        "original_section": "第一条 乙方承担保密义务", "modified_section": "第五条 乙方承担保密义务",
+        "similarity": 1.0, "change_type": "moved", "original_clause": "第一条", "modified_clause": "第五条"
+    }]
+    
+    evaluations = node_evaluator(state)["evaluations"]
+    
+    assert evaluations[0]["risk_level"] == "green"
+    assert evaluations[0]["explanation"] == "条款内容未变，仅由第一条调整至第五条"
+    assert fake.batch_calls == 0
+
+def test_node_analyzer_streams_differences_into_storage(monkeypatch, tmp_path):
+    from app.rag import db
+    from app.graph import nodes
+    monkeypatch.setattr(db, "DB_PATH", str(tmp_path / "stream.db"))
+    db.close_connections()
+    db.init_db()
+    monkeypatch.setattr(nodes, "get_config", lambda: {"analysis": {"streaming": {"window": 4, "batch_size": 2}}})
+    original = "\n".join(f"第{i}条 乙方应当在第{i}个工作日内完成第{i}阶段交付。" for i in range(1, 21))
+    modified = original.replace("第5个工作日", "第15个工作日").replace("第12阶段", "第十二阶段")
+    db.save_task("stream-task", {"original_text": original, "modified_text": modified})
+    
+    try:
+        result = node_analyzer({"task_id": "stream-task", "original_hash": None, "modified_hash": None, "streaming": True})
+        stored = db.get_task_differences("stream-task")
+    finally:
+        db.close_connections()
+    
+    assert [d["change_type"] for d in result["differences"]] == ["modified", "modified"]
+    assert stored == result["differences"]
+
+def test_document_segmentation_is_memoized_by_hash(monkeypatch, tmp_path):
+    from app.rag import db
+    from app.graph import nodes
+    monkeypatch.setattr(db, "DB_PATH", str(tmp_path / "artifacts.db"))
+    db.close_connections()
+    db.init_db()
+    text = "第一条 甲方\n付款\n第二条 乙方\n交付"
+    for task_id in ("memo-1", "memo-2"):
+        db.save_task(task_id, {"original_text": text, "modified_text": task_id})
+    
+    try:
+        first = nodes.document_clauses(text)
+        monkeypatch.setattr(nodes, "segment_clauses", lambda text: pytest.fail("segmented twice"))
+        second = nodes.document_clauses(text)
+    finally:
+        db.close_connections()
+    
+    assert second == first
+    assert [clause.path for clause in second] == [("第一条",), ("第二条",)]
@@ -0,0 +1,186 @@
+import pytest
+import numpy as np
+from app.rag import db
+from app.rag.retriever import Retriever
+
+class FakeEmbeddings:
+    model = "fake"
+    
+    def __init__(self):
+        self.document_calls = []
+        self.query_calls = 0
+    
+    def vector(self, text):
+        vec = np.zeros(8, dtype=np.float32)
+        for ch in text:
+            vec[ord(ch) % 8] += 1
+        return vec
+    
+    def embed_text(self, text):
+        self.query_calls += 1
+        return self.vector(text).tolist()
+    
+    def embed_documents(self, texts):
+        self.document_calls.append(list(texts))
+        return [self.vector(t).tolist() for t in texts]
+
+@pytest.fixture
+def retriever_db(tmp_path):
+    original_db_path = db.DB_PATH
+    db.DB_PATH = str(tmp_path / "contracts.db")
+    db.init_db()
+    yield
+    db.close_connections()
+    db.DB_PATH = original_db_path
+
+def make_retriever(fake):
+    retriever = Retriever()
+    retriever.use_embeddings = True
+    retriever._embeddings_service = fake
+    return retriever
+
+def test_rule_embeddings_are_computed_once_and_persisted(retriever_db):
+    fake = FakeEmbeddings()
+    retriever = make_retriever(fake)
+    
+    first = retriever.semantic_search_playbook("预付款比例", top_k=3)
+    second = retriever.semantic_search_playbook("违约金上限", top_k=3)
+    
+    assert len(first) == 3 and len(second) == 3
+    assert len(fake.document_calls) == 1
+    assert len(fake.document_calls[0]) == len(db.get_all_playbook_rules())
+    assert fake.query_calls == 2
+    
+    fresh = FakeEmbeddings()
+    make_retriever(fresh).semantic_search_playbook("押金", top_k=2)
+    assert fresh.document_calls == []
+
+def test_changed_rule_is_reembedded(retriever_db):
+    fake = FakeEmbeddings()
+    retriever = make_retriever(fake)
+    retriever.semantic_search_playbook("押金", top_k=2)
+    
+    db.get_connection().execute("UPDATE playbook SET description = '押金不超过1个月租金' WHERE id = 13")
+    retriever.semantic_search_playbook("押金", top_k=2)
+    
+    assert len(fake.document_calls) == 2
+    assert fake.document_calls[1] == ["押金 押金不超过1个月租金"]
+
+def test_semantic_search_ranks_by_cosine(retriever_db):
+    fake = FakeEmbeddings()
+    retriever = make_retriever(fake)
+    rules = db.get_all_playbook_rules()
+    target = rules[4]
+    
+    result = retriever.semantic_search_playbook(f"{target['rule_name']} {target['description']}", top_k=1)
+    
+    assert result[0]["id"] == target["id"]
+
+def test_template_vector_index_tracks_table_changes(retriever_db, tmp_path, monkeypatch):
+    from app.rag import retriever as retriever_module
+    monkeypatch.setitem(retriever_module.get_config(), "vector_index", {
+        "enabled": True, "path": str(tmp_path / "index"), "nlist": 4, "nprobe": 4
+    })
+    fake = FakeEmbeddings()
+    retriever = make_retriever(fake)
+    
+    templates = retriever.retrieve_templates("采购合同", top_k=2)
+    assert len(templates) == 2
+    assert len(fake.document_calls[0]) == 5
+    
+    conn = db.get_connection()
+    conn.execute("INSERT INTO templates (title, category, content) VALUES ('新模板', '其他', 'zzzz')")
+    conn.execute("DELETE FROM templates WHERE id = 1")
+    retriever.retrieve_templates("采购合同", top_k=2)
+    assert fake.document_calls[1] == ["新模板 zzzz"]
+    
+    ids = [t["id"] for t in retriever.retrieve_templates("新模板 zzzz", top_k=10)]
+    assert ids[0] == 6 and 1 not in ids
+    
+    fresh = FakeEmbeddings()
+    make_retriever(fresh).retrieve_templates("采购合同", top_k=2)
+    assert fresh.document_calls == []
+
+def test_template_vector_index_smaller_than_nlist_survives_restart(retriever_db, tmp_path):
+    from app.rag.template_index import TemplateVectorIndex
+    path = str(tmp_path / "index")
+    
+    before = TemplateVectorIndex(path, FakeEmbeddings(), nlist=64).search("采购合同", top_k=2)
+    fresh = FakeEmbeddings()
+    after = TemplateVectorIndex(path, fresh, nlist=64).search("采购合同", top_k=2)
+    
+    assert len(before) == 2
+    assert after == before
+    assert fresh.document_calls == []
+
+def test_reciprocal_rank_fusion_dedupes_and_rewards_agreement():
+    from app.rag.retriever import reciprocal_rank_fusion
+    fts = [{"id": 1}, {"id": 2}, {"id": 3}]
+    vector = [{"id": 3}, {"id": 4}, {"id": 1}]
+    
+    fused = reciprocal_rank_fusion({"fts": fts, "vector": vector}, k=60)
+    
+    assert [r["id"] for r in fused] == [1, 3, 2, 4]
+    assert [r["id"] for r in reciprocal_rank_fusion({"fts": fts, "vector": vector}, weights={"fts": 0.0}, top_k=2)] == [3, 4]
+
+def test_hybrid_retrieval_fuses_both_stages_with_timings(retriever_db):
+    retriever = make_retriever(FakeEmbeddings())
+    
+    result = retriever.retrieve_for_contract("竞业限制期限为3年且无补偿", "劳动")
+    
+    assert result["mode"] == "hybrid"
+    ids = [r["id"] for r in result["playbook_rules"]]
+    assert len(ids) == len(set(ids))
+    assert result["playbook_rules"][0]["rule_name"] == "竞业限制"
+    assert {"fts_ms", "vector_ms", "fusion_ms", "total_ms"} <= set(result["timings"])
+
+def test_hybrid_retrieval_survives_failing_vector_stage(retriever_db, caplog):
+    class BrokenEmbeddings(FakeEmbeddings):
+        def embed_text(self, text):
+            raise RuntimeError("embedding backend down")
+    
+    retriever = make_retriever(BrokenEmbeddings())
+    
+    result = retriever.retrieve_for_contract("押金超过3个月租金", "租赁")
+    
+    assert [r["rule_name"] for r in result["playbook_rules"]] == ["押金", "押金"]
+    assert "vector_ms" not in result["timings"]
+    assert "embedding backend down" in caplog.text
+
+def test_retrieve_for_differences_batches_every_difference(retriever_db):
+    fake = FakeEmbeddings()
+    retriever = make_retriever(fake)
+    differences = [
+        {"original_section": "押金为2个月租金", "modified_section": "押金为4个月租金"},
+        {"original_section": "", "modified_section": "竞业限制期限为5年"},
+    ]
+    
+    result = retriever.retrieve_for_differences(differences, top_k=3)
+    
+    assert len(fake.document_calls) == 2
+    assert fake.document_calls[1] == ["押金为2个月租金 押金为4个月租金", "竞业限制期限为5年"]
+    rules = {r["id"]: r for r in result["playbook_rules"]}
+    assert [len(ids) for ids in result["rule_ids"]] == [3, 3]
+    assert rules[result["rule_ids"][0][0]]["rule_name"] == "押金"
+    assert rules[result["rule_ids"][1][0]]["rule_name"] == "竞业限制"
+
+def test_repeated_difference_queries_are_served_from_cache(retriever_db):
+    fake = FakeEmbeddings()
+    retriever = make_retriever(fake)
+    differences = [
+        {"original_section": "押金为2个月租金", "modified_section": "押金为4个月租金"},
+        {"original_section": "押金为2个月租金", "modified_section": "押金为4个月租金"},
+    ]
+    
+    first = retriever.retrieve_for_differences(differences, top_k=3)
+    calls = len(fake.document_calls)
+    second = retriever.retrieve_for_differences(differences[:1] + [{"original_section": "", "modified_section": "竞业限制期限为5年"}], top_k=3)
+    
+    assert first["rule_ids"][0] == first["rule_ids"][1] == second["rule_ids"][0]
+    assert first["timings"]["cached_queries"] == 0
+    assert second["timings"]["cached_queries"] == 1
+    # Only the new query was embedded.
+    assert fake.document_calls[calls:] == [["竞业限制期限为5年"]]
+    
+    db.get_connection().execute("UPDATE playbook SET description = description || '。' WHERE id = 1")
+    assert retriever.retrieve_for_differences(differences, top_k=3)["timings"]["cached_queries"] == 0
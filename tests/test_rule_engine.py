@@ -0,0 +1,44 @@
+import math
+from app.services.rule_engine import ThresholdRuleEngine, extract_quantities, parse_chinese_number
+
+PAYMENT_RULES = [
+    {"id": 1, "description": "预付款不超过30%，验收款不超过60%", "risk_level": "green", "action": "符合标准"},
+    {"id": 2, "description": "预付款超过40%或验收款超过70%", "risk_level": "red", "action": "需要修改"},
+    {"id": 3, "description": "保密期限超过2年", "risk_level": "yellow", "action": "需要协商"},
+]
+
+CONDITIONS = [
+    {"rule_id": 1, "group_no": 0, "field": "预付款", "operator": "<=", "threshold": 30, "unit": "percent"},
+    {"rule_id": 1, "group_no": 0, "field": "验收款", "operator": "<=", "threshold": 60, "unit": "percent"},
+    {"rule_id": 2, "group_no": 0, "field": "预付款", "operator": ">", "threshold": 40, "unit": "percent"},
+    {"rule_id": 2, "group_no": 1, "field": "验收款", "operator": ">", "threshold": 70, "unit": "percent"},
+    {"rule_id": 3, "group_no": 0, "field": "保密期限|保密期", "operator": ">", "threshold": 24, "unit": "month"},
+]
+
+def test_extracts_numbers_percentages_and_durations():
+    assert parse_chinese_number("一百零五") == 105
+    assert parse_chinese_number("三十万") == 300000
+    
+    quantities = [(q.value, q.unit) for q in extract_quantities("预付款百分之五十，质保期两年，押金三成，违约金120万元，2024年3月1日前付清")]
+    assert quantities == [(50, "percent"), (24, "month"), (30, "percent"), (1200000, "yuan")]
+    assert math.isinf(extract_quantities("保密期限为永久")[0].value)
+
+def test_classifies_payment_terms_by_threshold():
+    engine = ThresholdRuleEngine(CONDITIONS)
+    
+    assert engine.classify("预付款30%，验收款60%", PAYMENT_RULES).rule["id"] == 1
+    match = engine.classify("合同签订后支付50%作为预付款", PAYMENT_RULES)
+    assert match.rule["id"] == 2
+    assert match.facts == ["预付款 50% > 40%"]
+    assert engine.classify("验收款百分之八十", PAYMENT_RULES).rule["id"] == 2
+    # 35% is neither compliant nor over the red line, so it is left to the LLM.
+    assert engine.classify("预付款35%", PAYMENT_RULES) is None
+    assert engine.classify("预付款于2024年5月1日前支付", PAYMENT_RULES) is None
+    assert engine.classify("预付款30%", PAYMENT_RULES[1:]) is None
+
+def test_classifies_durations_in_chinese_numerals():
+    engine = ThresholdRuleEngine(CONDITIONS)
+    
+    assert engine.classify("保密期为永久", PAYMENT_RULES).rule["id"] == 3
+    assert engine.classify("保密期限三年", PAYMENT_RULES).facts == ["保密期限 36个月 > 24个月"]
+    assert engine.classify("保密期限十八个月", PAYMENT_RULES) is None
@@ -0,0 +1,52 @@
+import random
+from app.services.rule_matcher import AhoCorasick, RuleMatcher, get_rule_matcher
+
+def legacy_best_match(text, rules):
+    best_rule, best_score = None, 0
+    for rule in rules:
+        keywords = rule.get("keywords", "").lower()
+        rule_desc = rule.get("description", "").lower()
+        score = 0
+        if keywords:
+            for kw in [k.strip() for k in keywords.split(",")]:
+                if kw in text:
+                    score += 1
+                if kw in rule_desc:
+                    score += 0.5
+        if score > best_score:
+            best_score, best_rule = score, rule
+    return (best_rule, best_score) if best_rule and best_score > 0 else (None, 0)
+
+def test_automaton_finds_overlapping_patterns():
+    automaton = AhoCorasick(["he", "she", "his", "hers", "押金", "金额"])
+    
+    assert automaton.find_all("ushers") == {0, 1, 3}
+    assert automaton.find_all("押金额度") == {4, 5}
+    assert automaton.find_all("无关") == set()
+
+def test_matcher_agrees_with_keyword_loop():
+    rng = random.Random(7)
+    vocab = ["押金", "违约金", "30%", "2年", "保密", "竞业", "知识产权", "付款", "乙方", "Ab"]
+    rules = []
+    for rule_id in range(60):
+        keywords = ",".join(rng.sample(vocab, rng.randint(0, 3)) + ([""] if rng.random() < 0.05 else []))
+        rules.append({
+            "id": rule_id,
+            "keywords": keywords,
+            "description": "".join(rng.sample(vocab, 2)),
+            "risk_level": "green"
+        })
+    matcher = RuleMatcher(rules)
+    
+    for _ in range(300):
+        text = " ".join(rng.sample(vocab + ["合同", "甲方"], rng.randint(0, 4))).lower()
+        subset = rng.sample(rules, rng.randint(1, 8))
+        
+        assert matcher.best_match(text) == legacy_best_match(text, rules)
+        assert matcher.best_match(text, matcher.candidate_positions(subset)) == legacy_best_match(text, subset)
+
+def test_matcher_is_cached_by_rule_content():
+    rules = [{"id": 1, "keywords": "押金", "description": "押金", "risk_level": "黄色"}]
+    
+    assert get_rule_matcher(rules) is get_rule_matcher([dict(rule) for rule in rules])
+    assert get_rule_matcher(rules) is not get_rule_matcher([dict(rules[0], risk_level="红色")])
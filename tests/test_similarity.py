@@ -0,0 +1,32 @@
+import random
+from app.services.similarity import MinHasher, lcs_length, lcs_ratio, difflib_ratio
+
+def dp_lcs(a, b):
+    row = [0] * (len(b) + 1)
+    for ch in a:
+        previous = 0
+        for j, other in enumerate(b, 1):
+            previous, row[j] = row[j], previous + 1 if ch == other else max(row[j], row[j - 1])
+    return row[-1]
+
+def test_bit_parallel_lcs_matches_dynamic_programming():
+    rng = random.Random(3)
+    for _ in range(200):
+        a = "".join(rng.choice("甲乙丙ab") for _ in range(rng.randint(0, 40)))
+        b = "".join(rng.choice("甲乙丙ab") for _ in range(rng.randint(0, 40)))
+        assert lcs_length(a, b) == dp_lcs(a, b)
+
+def test_lcs_ratio_tracks_difflib():
+    a = "合同签订后甲方向乙方支付合同总额的30%作为预付款"
+    b = "合同签订后十个工作日内甲方向乙方支付合同总额的50%作为预付款"
+    
+    assert lcs_ratio(a, a) == 1.0
+    assert abs(lcs_ratio(a, b) - difflib_ratio(a, b)) < 0.05
+    assert lcs_ratio("预付款", "预付款" * 10, threshold=0.5) == 0.0
+
+def test_minhash_keeps_similar_pairs_only():
+    hasher = MinHasher(num_perm=64)
+    originals = ["乙方应对甲方的商业秘密承担保密义务，保密期限为两年", "本合同适用中华人民共和国法律"]
+    modified = ["争议提交甲方所在地人民法院管辖", "乙方应对甲方的商业秘密承担保密义务，保密期限为三年"]
+    
+    assert hasher.candidate_pairs(originals, modified, min_jaccard=0.3) == [(0, 1)]
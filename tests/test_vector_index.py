@@ -0,0 +1,76 @@
+import numpy as np
+from app.rag.vector_index import FlatIndex, IVFIndex
+
+def clustered_vectors(n, dim=32, clusters=20, seed=0):
+    rng = np.random.default_rng(seed)
+    centers = rng.normal(size=(clusters, dim))
+    labels = rng.integers(0, clusters, size=n)
+    return (centers[labels] + 0.3 * rng.normal(size=(n, dim))).astype(np.float32)
+
+def test_ivf_recall_against_flat_scan():
+    data = clustered_vectors(3000)
+    queries = clustered_vectors(50, seed=1)
+    flat = FlatIndex(32)
+    flat.add(range(len(data)), data)
+    ivf = IVFIndex(32, nlist=16, nprobe=4)
+    ivf.add(range(len(data)), data)
+    
+    assert ivf.is_trained
+    hits = 0
+    for query in queries:
+        expected = {i for i, _ in flat.search(query, 10)}
+        hits += len(expected & {i for i, _ in ivf.search(query, 10)})
+    assert hits / (10 * len(queries)) >= 0.9
+
+def test_incremental_add_and_delete():
+    data = clustered_vectors(1000)
+    ivf = IVFIndex(32, nlist=8, nprobe=8)
+    ivf.add(range(1000), data)
+    
+    ivf.add([5000], data[7:8])
+    assert ivf.search(data[7], 2)[0][0] in (7, 5000)
+    
+    ivf.delete([7, 5000])
+    assert len(ivf) == 999
+    assert all(i not in (7, 5000) for i, _ in ivf.search(data[7], 20))
+    
+    ivf.add([7], data[7:8])
+    assert ivf.search(data[7], 1)[0][0] == 7
+
+def test_save_and_load_memory_mapped(tmp_path):
+    data = clustered_vectors(1000)
+    ivf = IVFIndex(32, nlist=8, nprobe=8)
+    ivf.add(range(1000), data)
+    ivf.delete([3])
+    ivf.save(str(tmp_path / "index"))
+    
+    loaded = IVFIndex.load(str(tmp_path / "index"))
+    
+    assert isinstance(loaded._vectors, np.memmap)
+    assert len(loaded) == 999
+    assert loaded.search(data[10], 1)[0][0] == 10
+    
+    loaded.add([2000], data[3:4])
+    loaded.delete([10])
+    assert loaded.search(data[3], 1)[0][0] == 2000
+    assert loaded.search(data[10], 1)[0][0] != 10
+
+def test_untrained_index_searches_exhaustively():
+    data = clustered_vectors(20)
+    ivf = IVFIndex(32, nlist=16)
+    ivf.add(range(20), data)
+    
+    assert not ivf.is_trained
+    assert ivf.search(data[4], 1)[0][0] == 4
+
+def test_untrained_index_survives_save_and_load(tmp_path):
+    data = clustered_vectors(10)
+    ivf = IVFIndex(32, nlist=16)
+    ivf.add(range(10), data)
+    ivf.save(str(tmp_path / "index"))
+    
+    loaded = IVFIndex.load(str(tmp_path / "index"))
+    
+    assert not loaded.is_trained
+    assert len(loaded) == 10
+    assert loaded.search(data[4], 1)[0][0] == 4
@@ -0,0 +1,87 @@
+import os
+import tempfile
+import pytest
+from app import worker
+from app.rag import db
+from app.graph import workflow
+
+@pytest.fixture
+def queue_db():
+    test_db = tempfile.NamedTemporaryFile(delete=False, suffix=".db")
+    original_db_path = db.DB_PATH
+    db.DB_PATH = test_db.name
+    db.init_db()
+    db.save_task("worker-1", {
+        "task_id": "worker-1",
+        "status": "pending",
+        "original_text": "合同金额：100元",
+        "modified_text": "合同金额：200元",
+        "category": "采购"
+    })
+    yield
+    db.close_connections()
+    db.DB_PATH = original_db_path
+    os.unlink(test_db.name)
+
+def test_run_worker_drains_queue(queue_db, monkeypatch):
+    monkeypatch.setattr(workflow, "run_contract_review", lambda **kwargs: {
+        "status": "completed",
+        "differences": [],
+        "evaluations": [],
+        "human_reviews": [],
+        "final_report": "report"
+    })
+    
+    worker.run_worker(worker_id="test-worker", once=True)
+    
+    task = db.get_task("worker-1")
+    assert task["status"] == "completed"
+    assert task["final_report"] == "report"
+    assert task["lease_owner"] is None
+
+def test_failed_task_is_requeued_then_failed(queue_db, monkeypatch):
+    def failing_review(**kwargs):
+        raise RuntimeError("boom")
+    
+    monkeypatch.setattr(workflow, "run_contract_review", failing_review)
+    monkeypatch.setattr(worker, "get_queue_config", lambda: {
+        "max_retries": 2,
+        "retry_delay": 0,
+        "lease_seconds": 60,
+        "heartbeat_interval": 15,
+        "poll_interval": 0
+    })
+    
+    assert worker.run_task("worker-1") == "failed"
+    
+    task = db.get_task("worker-1")
+    assert task["status"] == "failed"
+    assert task["attempts"] == 2
+    assert task["error"] == "boom"
+
+def test_run_batch_drains_only_its_batch(queue_db, monkeypatch):
+    from app.models.schemas import BatchItem
+    from app.services.batch import BatchBuilder
+    
+    reviewed = []
+    def fake_review(**kwargs):
+        reviewed.append(kwargs["task_id"])
+        return {"status": "completed", "differences": [], "evaluations": [], "human_reviews": [], "final_report": "report"}
+    
+    monkeypatch.setattr(workflow, "run_contract_review", fake_review)
+    
+    builder = BatchBuilder(category="采购", reuse=False)
+    builder.add([
+        BatchItem(original_text="甲", modified_text="乙", reference="a"),
+        BatchItem(original_text="甲", modified_text="乙", reference="b"),
+        BatchItem(original_text="甲", modified_text="丙", reference="c"),
+    ])
+    created = builder.create()
+    assert created["total"] == 3
+    # The repeated pair is reviewed once.
+    assert created["scheduled"] == 2
+    
+    assert worker.run_batch(created["batch_id"]) == 2
+    assert len(set(reviewed)) == 2
+    assert db.get_task("worker-1")["status"] == "pending"
+    assert not db.has_pending_batch_tasks(created["batch_id"])
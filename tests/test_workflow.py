@@ -0,0 +1,118 @@
+import pytest
+from app.rag import db
+from app.graph import workflow
+from app.graph import nodes
+
+ORIGINAL = "第一条 合同金额：人民币100万元整\n第二条 知识产权：服务成果归甲方所有"
+MODIFIED = "第一条 合同金额：人民币120万元整\n第二条 知识产权：服务成果归乙方所有"
+
+@pytest.fixture
+def isolated_workflow(monkeypatch, tmp_path):
+    original_db_path = db.DB_PATH
+    db.DB_PATH = str(tmp_path / "contracts.db")
+    db.init_db()
+    monkeypatch.setattr(workflow, "CHECKPOINT_DB_PATH", str(tmp_path / "checkpoints.db"))
+    monkeypatch.setattr(workflow, "_compiled_graph", None)
+    yield
+    db.close_connections()
+    db.DB_PATH = original_db_path
+
+def test_review_pauses_for_human_and_resumes_from_checkpoint(isolated_workflow, monkeypatch):
+    result = workflow.run_contract_review("wf-1", ORIGINAL, MODIFIED, "服务")
+    
+    assert result["status"] == "waiting_human"
+    assert result["final_report"] is None
+    
+    def fail_retrieval(*args, **kwargs):
+        raise AssertionError("resume must not re-run retrieval")
+    
+    monkeypatch.setattr(nodes.retriever, "retrieve_for_differences", fail_retrieval)
+    
+    reviews = [{"evaluation_id": e["id"], "approved": True} for e in result["evaluations"]]
+    task = {"task_id": "wf-1", "original_text": ORIGINAL, "modified_text": MODIFIED, "category": "服务"}
+    resumed = workflow.resume_contract_review(task, reviews)
+    
+    assert resumed["status"] == "completed"
+    assert resumed["human_reviews"] == reviews
+    assert "合同对比审查报告" in resumed["final_report"]
+
+def test_cloned_review_resumes_from_its_own_checkpoint(isolated_workflow, monkeypatch):
+    result = workflow.run_contract_review("wf-src", ORIGINAL, MODIFIED, "服务")
+    assert workflow.copy_paused_review("wf-src", "wf-clone")
+    
+    def fail_retrieval(*args, **kwargs):
+        raise AssertionError("resume must not re-run retrieval")
+    
+    monkeypatch.setattr(nodes.retriever, "retrieve_for_differences", fail_retrieval)
+    
+    reviews = [{"evaluation_id": e["id"], "approved": True} for e in result["evaluations"]]
+    resumed = workflow.resume_contract_review({"task_id": "wf-clone"}, reviews)
+    
+    assert resumed["status"] == "completed"
+    assert resumed["task_id"] == "wf-clone"
+    # The source is still paused for its own reviewer.
+    graph = workflow.get_contract_review_graph()
+    assert graph.get_state(workflow.thread_config("wf-src")).next == ("human_loop",)
+
+def test_resume_without_checkpoint_uses_stored_analysis(isolated_workflow):
+    evaluations = [{
+        "id": 0,
+        "difference": {"original_section": "甲", "modified_section": "乙", "similarity": 0.1, "change_type": "modified"},
+        "risk_level": "yellow",
+        "matched_rule": None,
+        "suggestion": "请人工审核此修改",
+        "explanation": "修改内容较复杂，建议人工确认"
+    }]
+    task = {
+        "task_id": "wf-legacy",
+        "original_text": "甲",
+        "modified_text": "乙",
+        "category": None,
+        "differences": [evaluations[0]["difference"]],
+        "evaluations": evaluations
+    }
+    
+    resumed = workflow.resume_contract_review(task, [{"evaluation_id": 0, "approved": True}])
+    
+    assert resumed["status"] == "completed"
+    assert resumed["evaluations"] == evaluations
+
+def test_evaluations_are_stored_as_they_are_decided(isolated_workflow):
+    result = workflow.run_contract_review("wf-3", ORIGINAL, MODIFIED, "服务")
+    entries = db.get_task_evaluations("wf-3")
+    
+    assert [entry["seq"] for entry in entries] == list(range(1, len(result["evaluations"]) + 1))
+    assert db.get_task_evaluation_results("wf-3") == result["evaluations"]
+    assert db.get_task_evaluations("wf-3", after_seq=1) == entries[1:]
+
+def test_checkpoints_hold_hashes_instead_of_texts(isolated_workflow):
+    workflow.run_contract_review("wf-4", ORIGINAL, MODIFIED, "服务")
+    graph = workflow.get_contract_review_graph()
+    
+    values = graph.get_state(workflow.thread_config("wf-4")).values
+    assert db.get_document(values["original_hash"]) == ORIGINAL
+    with graph.checkpointer.cursor(transaction=False) as cursor:
+        blobs = [row[0] for row in cursor.execute("SELECT checkpoint FROM checkpoints UNION ALL SELECT value FROM writes")]
+    assert not any(ORIGINAL.encode("utf-8") in bytes(blob) for blob in blobs if blob)
+
+def test_failed_run_drops_its_checkpoint(isolated_workflow, monkeypatch):
+    def fail(state):
+        raise RuntimeError("evaluator down")
+    
+    monkeypatch.setattr(workflow, "node_evaluator", fail)
+    with pytest.raises(RuntimeError):
+        workflow.run_contract_review("wf-5", ORIGINAL, MODIFIED, "服务")
+    
+    assert workflow.get_contract_review_graph().get_state(workflow.thread_config("wf-5")).values == {}
+
+def test_stale_paused_reviews_are_pruned(isolated_workflow):
+    for task_id in ("wf-fresh", "wf-stale", "wf-unknown"):
+        workflow.run_contract_review(task_id, ORIGINAL, MODIFIED, "服务")
+    for task_id in ("wf-fresh", "wf-stale"):
+        db.save_task(task_id, {"status": "waiting_human", "original_text": ORIGINAL, "modified_text": MODIFIED})
+    db.get_connection().execute("UPDATE tasks SET updated_at = datetime('now', '-2 hours') WHERE task_id = 'wf-stale'")
+    
+    assert workflow.prune_checkpoints(3600) == 2
+    graph = workflow.get_contract_review_graph()
+    assert graph.get_state(workflow.thread_config("wf-fresh")).next == ("human_loop",)
+    assert graph.get_state(workflow.thread_config("wf-stale")).values == {}